@@ -0,0 +1,185 @@
+"""
+Micro-banc des handshakes mTLS, par profil de clé des certificats.
+
+Pour chaque profil (rsa, ecdsa-p256, ecdsa-p384, ed25519), génère une CA,
+un certificat serveur et un certificat client jetables (CertificateManager),
+lance un serveur TLS minimal dans un processus séparé avec les mêmes réglages
+que server/tunnel.py, puis enchaîne des handshakes complets depuis le client
+(sans reprise de session) pendant la durée demandée. Mesure :
+
+    - le nombre de handshakes par seconde ;
+    - la latence d'un handshake (p50 / p99), jusqu'au premier octet du serveur ;
+    - avec --resume, les mêmes mesures en reprise de session (ticket TLS 1.3).
+
+Les certificats ne sont signés qu'une fois par handshake complet de chaque
+côté : c'est le coût qui varie d'un profil à l'autre, l'échange de clés
+(ECDHE) restant identique.
+
+Exemple :
+    python bench/handshake.py --duration 3 --profile rsa --profile ecdsa-p256
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import shutil
+import socket
+import ssl
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from loopback import _run_workers, generate_certs, git_commit, percentile
+
+PROFILES = ("rsa", "ecdsa-p256", "ecdsa-p384", "ed25519")
+OP_IGNORE_UNEXPECTED_EOF = getattr(ssl, "OP_IGNORE_UNEXPECTED_EOF", 0)
+
+
+def _server_context(certs_dir: Path) -> ssl.SSLContext:
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile=certs_dir / "server.pem")
+    context.load_verify_locations(certs_dir / "ca.pem")
+    context.verify_mode = ssl.CERT_REQUIRED
+    context.options |= OP_IGNORE_UNEXPECTED_EOF
+    return context
+
+
+def _client_context(certs_dir: Path) -> ssl.SSLContext:
+    context = ssl.create_default_context(ssl.Purpose.SERVER_AUTH)
+    context.load_verify_locations(certs_dir / "ca.pem")
+    context.load_cert_chain(certfile=certs_dir / "client.pem")
+    context.check_hostname = False
+    context.options |= OP_IGNORE_UNEXPECTED_EOF
+    return context
+
+
+def _handle(context: ssl.SSLContext, conn: socket.socket):
+    # Sans TCP_NODELAY, Nagle et l'ACK retardé ajoutent ~40 ms à chaque handshake
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        with context.wrap_socket(conn, server_side=True) as tls:
+            # Un octet applicatif : le client attend la fin du handshake côté serveur
+            # (vérification de son certificat) et reçoit le ticket de session
+            tls.sendall(b"k")
+            tls.recv(1)
+    except (ssl.SSLError, OSError):
+        conn.close()
+
+
+def run_server(listener: socket.socket, certs_dir: Path):
+    context = _server_context(certs_dir)
+    while True:
+        conn, _ = listener.accept()
+        threading.Thread(target=_handle, args=(context, conn), daemon=True).start()
+
+
+def bench_handshakes(address: tuple, context: ssl.SSLContext, duration: float,
+                     concurrency: int, resume: bool) -> dict:
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        samples, errors, reused, session = [], 0, 0, None
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with socket.create_connection(address, timeout=10.0) as raw:
+                    raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    with context.wrap_socket(raw, server_hostname="localhost", session=session) as tls:
+                        tls.recv(1)
+                        reused += tls.session_reused
+                        if resume:
+                            session = tls.session
+                        tls.sendall(b"k")
+            except OSError:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - start)
+        return samples, errors, reused
+
+    start = time.perf_counter()
+    results = _run_workers(concurrency, worker)
+    elapsed = time.perf_counter() - start
+    samples = sorted(s for worker_samples, _, _ in results for s in worker_samples)
+    return {
+        "handshakes_per_second": len(samples) / elapsed,
+        "handshakes": len(samples),
+        "errors": sum(r[1] for r in results),
+        "resumed": sum(r[2] for r in results),
+        "p50_ms": percentile(samples, 0.50) * 1e3,
+        "p99_ms": percentile(samples, 0.99) * 1e3,
+    }
+
+
+def bench_profile(profile: str, workdir: Path, args) -> dict:
+    certs_dir = workdir / profile
+    generate_certs(certs_dir, args.key_size, profile)
+    listener = socket.create_server(("127.0.0.1", 0), backlog=1024)
+    # Processus neuf (spawn) : rien n'est hérité de l'état OpenSSL du processus de mesure
+    server = multiprocessing.get_context("spawn").Process(target=run_server, args=(listener, certs_dir), daemon=True)
+    server.start()
+    address = listener.getsockname()
+    try:
+        context = _client_context(certs_dir)
+        # Attendre que le serveur soit prêt (démarrage du processus hors mesure)
+        with socket.create_connection(address, timeout=30.0) as raw:
+            with context.wrap_socket(raw, server_hostname="localhost") as tls:
+                tls.recv(1)
+                tls.sendall(b"k")
+        results = {"full": bench_handshakes(address, context, args.duration, args.concurrency, resume=False)}
+        if args.resume:
+            results["resumed"] = bench_handshakes(address, context, args.duration, args.concurrency, resume=True)
+    finally:
+        server.terminate()
+        server.join()
+        listener.close()
+    results["certificate_bytes"] = (certs_dir / "server.pem").stat().st_size
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-banc des handshakes mTLS par profil de clé")
+    parser.add_argument("--profile", action="append", choices=PROFILES,
+                        help="Profil à mesurer (répétable ; défaut : tous)")
+    parser.add_argument("--key-size", type=int, default=4096, help="Taille des clés RSA (profil rsa)")
+    parser.add_argument("--duration", type=float, default=3.0, help="Durée (s) de la mesure par profil")
+    parser.add_argument("--concurrency", type=int, default=1, help="Clients simultanés")
+    parser.add_argument("--resume", action="store_true", help="Mesurer aussi la reprise de session")
+    parser.add_argument("--output", help="Fichier de résultats JSON")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="pst-handshake-"))
+    results = {}
+    try:
+        for profile in args.profile or PROFILES:
+            results[profile] = bench_profile(profile, workdir, args)
+            full = results[profile]["full"]
+            name = f"{profile} ({args.key_size})" if profile == "rsa" else profile
+            line = (f"{name:12s} : {full['handshakes_per_second']:8.1f} handshakes/s, "
+                    f"p50 {full['p50_ms']:.2f} ms, p99 {full['p99_ms']:.2f} ms")
+            if args.resume:
+                line += f" | reprise {results[profile]['resumed']['handshakes_per_second']:8.1f} /s"
+            errors = full["errors"] + results[profile].get("resumed", {}).get("errors", 0)
+            print(line + (f" ({errors} erreurs)" if errors else ""))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.output:
+        report = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "openssl": ssl.OPENSSL_VERSION,
+            "platform": platform.platform(),
+            "parameters": {key: value for key, value in vars(args).items() if key != "output"},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Résultats écrits dans {args.output}")
+
+
+if __name__ == "__main__":
+    main()
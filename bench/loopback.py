@@ -0,0 +1,417 @@
+"""
+Banc de performance de bout en bout, entièrement en boucle locale.
+
+    client SOCKS5 (générateur de charge) → proxy client → tunnel mTLS → serveur → cibles locales
+
+Génère des certificats jetables (CertificateManager), lance le serveur et le
+client dans des processus séparés avec une configuration temporaire, puis mesure :
+
+    - le débit en masse (envoi vers un puits, réception depuis une source), en Mo/s ;
+    - le nombre de nouvelles connexions par seconde ;
+    - la latence requête/réponse de petits messages (p50 / p99 / p999).
+
+Les résultats sont écrits dans un fichier JSON pour comparer les exécutions
+entre commits (--compare).
+
+Exemple :
+    python bench/loopback.py --server-engine asyncio --mode mux --output resultats.json
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import yaml
+
+ROOT = Path(__file__).resolve().parent.parent
+SIZE = struct.Struct("!Q")
+CHUNK = 256 * 1024
+
+
+# ---------------------------------------------------------------------------
+# Cibles locales (processus séparé : elles ne partagent pas le GIL du générateur)
+# ---------------------------------------------------------------------------
+
+def _serve(listener: socket.socket, handler):
+    while True:
+        conn, _ = listener.accept()
+        threading.Thread(target=handler, args=(conn,), daemon=True).start()
+
+
+def _echo(conn: socket.socket):
+    with conn:
+        while True:
+            data = conn.recv(65536)
+            if not data:
+                return
+            conn.sendall(data)
+
+
+def _sink(conn: socket.socket):
+    """Lit jusqu'à la fin du flux puis renvoie le nombre d'octets reçus."""
+    with conn:
+        buf = bytearray(CHUNK)
+        total = 0
+        while True:
+            n = conn.recv_into(buf)
+            if not n:
+                break
+            total += n
+        conn.sendall(SIZE.pack(total))
+
+
+def _source(conn: socket.socket):
+    """Envoie le nombre d'octets demandé (entier 64 bits) puis ferme."""
+    with conn:
+        header = b""
+        while len(header) < SIZE.size:
+            chunk = conn.recv(SIZE.size - len(header))
+            if not chunk:
+                return
+            header += chunk
+        remaining = SIZE.unpack(header)[0]
+        payload = memoryview(os.urandom(CHUNK))
+        while remaining:
+            n = min(remaining, CHUNK)
+            conn.sendall(payload[:n])
+            remaining -= n
+
+
+def run_targets(listeners: dict):
+    handlers = {"echo": _echo, "sink": _sink, "source": _source}
+    for name, listener in listeners.items():
+        threading.Thread(target=_serve, args=(listener, handlers[name]), daemon=True).start()
+    threading.Event().wait()
+
+
+# ---------------------------------------------------------------------------
+# Générateur de charge SOCKS5
+# ---------------------------------------------------------------------------
+
+def recv_exactly(sock: socket.socket, n: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError(f"Fin de flux après {len(buf)}/{n} octets")
+        buf += chunk
+    return bytes(buf)
+
+
+def socks_connect(proxy: tuple, host: str, port: int, timeout: float = 30.0) -> socket.socket:
+    """Ouvre une connexion via le proxy SOCKS5 (sans authentification)."""
+    sock = socket.create_connection(proxy, timeout=timeout)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        encoded = host.encode()
+        # Salutation et requête CONNECT envoyées d'un bloc
+        sock.sendall(b"\x05\x01\x00" + b"\x05\x01\x00\x03" + bytes([len(encoded)]) + encoded + struct.pack("!H", port))
+        greeting = recv_exactly(sock, 2)
+        reply = recv_exactly(sock, 10)
+        if greeting != b"\x05\x00" or reply[1] != 0:
+            raise ConnectionError(f"Refus SOCKS5 : {greeting!r} {reply!r}")
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+def bench_upload(proxy: tuple, port: int, size: int) -> float:
+    payload = memoryview(os.urandom(CHUNK))
+    with socks_connect(proxy, "127.0.0.1", port) as sock:
+        start = time.perf_counter()
+        remaining = size
+        while remaining:
+            n = min(remaining, CHUNK)
+            sock.sendall(payload[:n])
+            remaining -= n
+        sock.shutdown(socket.SHUT_WR)
+        received = SIZE.unpack(recv_exactly(sock, SIZE.size))[0]
+        elapsed = time.perf_counter() - start
+    if received != size:
+        raise RuntimeError(f"Puits : {received} octets reçus sur {size}")
+    return size / elapsed / 1e6
+
+
+def bench_download(proxy: tuple, port: int, size: int) -> float:
+    buf = bytearray(CHUNK)
+    with socks_connect(proxy, "127.0.0.1", port) as sock:
+        start = time.perf_counter()
+        sock.sendall(SIZE.pack(size))
+        received = 0
+        while True:
+            n = sock.recv_into(buf)
+            if not n:
+                break
+            received += n
+        elapsed = time.perf_counter() - start
+    if received != size:
+        raise RuntimeError(f"Source : {received} octets reçus sur {size}")
+    return size / elapsed / 1e6
+
+
+def _run_workers(count: int, worker) -> list:
+    results = [None] * count
+    threads = [threading.Thread(target=lambda i=i: results.__setitem__(i, worker()), daemon=True) for i in range(count)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return results
+
+
+def bench_connection_rate(proxy: tuple, port: int, duration: float, concurrency: int) -> dict:
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        done = errors = 0
+        while time.perf_counter() < deadline:
+            try:
+                with socks_connect(proxy, "127.0.0.1", port) as sock:
+                    sock.sendall(b"x")
+                    recv_exactly(sock, 1)
+                done += 1
+            except OSError:
+                errors += 1
+        return done, errors
+
+    start = time.perf_counter()
+    results = _run_workers(concurrency, worker)
+    elapsed = time.perf_counter() - start
+    done = sum(r[0] for r in results)
+    return {
+        "connections_per_second": done / elapsed,
+        "connections": done,
+        "errors": sum(r[1] for r in results),
+    }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+
+def bench_latency(proxy: tuple, port: int, duration: float, concurrency: int, message_size: int) -> dict:
+    message = os.urandom(message_size)
+
+    def worker():
+        samples = []
+        with socks_connect(proxy, "127.0.0.1", port) as sock:
+            deadline = time.perf_counter() + duration
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                sock.sendall(message)
+                recv_exactly(sock, message_size)
+                samples.append(time.perf_counter() - start)
+        return samples
+
+    samples = sorted(s for worker_samples in _run_workers(concurrency, worker) for s in worker_samples)
+    return {
+        "samples": len(samples),
+        "requests_per_second": len(samples) / duration,
+        "p50_us": percentile(samples, 0.50) * 1e6,
+        "p99_us": percentile(samples, 0.99) * 1e6,
+        "p999_us": percentile(samples, 0.999) * 1e6,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Mise en place : certificats, configurations, processus
+# ---------------------------------------------------------------------------
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def generate_certs(certs_dir: Path, key_size: int, profile: str = "rsa"):
+    """Génère CA, certificat serveur et certificat client avec CertificateManager."""
+    os.environ["CERTS_DIR"] = str(certs_dir)
+    spec = importlib.util.spec_from_file_location("bench_certs", ROOT / "server" / "utils" / "certs.py")
+    certs = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(certs)
+
+    manager = certs.CertificateManager(key_size=key_size, profile=profile)
+    ca_cert, ca_key = manager.create_ca()
+    manager.create_signed_cert("ShadowLAN Bench Server", ca_cert, ca_key, manager.server_cert_path)
+    manager.create_signed_cert("ShadowLAN Bench Client", ca_cert, ca_key, certs_dir / "client.pem")
+
+
+def set_option(config: dict, assignment: str):
+    """Applique "section.clé=valeur" (valeur interprétée en YAML) à la configuration."""
+    path, _, raw = assignment.partition("=")
+    *sections, key = path.split(".")
+    node = config
+    for section in sections:
+        node = node.setdefault(section, {})
+    node[key] = yaml.safe_load(raw)
+
+
+def write_configs(workdir: Path, args, tunnel_port: int, proxy_port: int) -> tuple[Path, Path]:
+    with open(ROOT / "server" / "config" / "server_config.yaml") as f:
+        server = yaml.safe_load(f)
+    with open(ROOT / "client" / "config" / "client_config.yaml") as f:
+        client = yaml.safe_load(f)
+
+    server["server"].update(listen_host="127.0.0.1", listen_port=tunnel_port, engine=args.server_engine)
+    server.setdefault("metrics", {})["enabled"] = False
+    client["proxy"].update(listen_host="127.0.0.1", listen_port=proxy_port, engine=args.client_engine)
+    client["tunnel"].update(remote_host="127.0.0.1", remote_port=tunnel_port, mode=args.mode, header="binary")
+    client.setdefault("metrics", {})["enabled"] = False
+    for assignment in args.server_set:
+        set_option(server, assignment)
+    for assignment in args.client_set:
+        set_option(client, assignment)
+
+    server_path, client_path = workdir / "server_config.yaml", workdir / "client_config.yaml"
+    server_path.write_text(yaml.safe_dump(server))
+    client_path.write_text(yaml.safe_dump(client))
+    return server_path, client_path
+
+
+def wait_ready(proxy: tuple, echo_port: int, timeout: float = 30.0):
+    """Attend qu'un aller-retour complet passe par le tunnel."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socks_connect(proxy, "127.0.0.1", echo_port, timeout=2.0) as sock:
+                sock.sendall(b"ping")
+                recv_exactly(sock, 4)
+                return
+        except (OSError, ConnectionError):
+            if time.monotonic() > deadline:
+                raise RuntimeError("Le tunnel ne répond pas")
+            time.sleep(0.2)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "inconnu"
+
+
+def compare(results: dict, previous_path: str):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    print(f"\nComparaison avec {previous_path} ({previous.get('commit')}) :")
+    for name, value in flatten(results["results"]).items():
+        before = flatten(previous.get("results", {})).get(name)
+        if isinstance(value, (int, float)) and isinstance(before, (int, float)) and before:
+            print(f"  {name:45s} {before:12.1f} → {value:12.1f} ({(value - before) / before * 100:+.1f} %)")
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Banc de performance du tunnel en boucle locale")
+    parser.add_argument("--server-engine", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--client-engine", choices=("threaded", "asyncio"), default="threaded")
+    parser.add_argument("--mode", choices=("direct", "mux"), default="direct")
+    parser.add_argument("--server-set", action="append", default=[], metavar="SECTION.CLE=VALEUR",
+                        help="Option de configuration serveur (répétable), ex: ktls.enabled=true")
+    parser.add_argument("--client-set", action="append", default=[], metavar="SECTION.CLE=VALEUR",
+                        help="Option de configuration client (répétable), ex: tunnel.pool.enabled=true")
+    parser.add_argument("--bulk-mb", type=int, default=256, help="Volume (Mo) des transferts en masse")
+    parser.add_argument("--duration", type=float, default=5.0, help="Durée (s) des mesures de débit de connexions et de latence")
+    parser.add_argument("--concurrency", type=int, default=8, help="Clients simultanés")
+    parser.add_argument("--message-size", type=int, default=64, help="Taille (octets) des messages de latence")
+    parser.add_argument("--key-profile", default="rsa", help="Profil de clé des certificats (rsa, ecdsa-p256, ecdsa-p384, ed25519)")
+    parser.add_argument("--key-size", type=int, default=2048, help="Taille des clés RSA générées")
+    parser.add_argument("--output", default="loopback_results.json", help="Fichier de résultats JSON")
+    parser.add_argument("--compare", help="Résultats JSON d'une exécution précédente")
+    parser.add_argument("--keep", action="store_true", help="Conserver le répertoire de travail (journaux, certificats)")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="pst-bench-"))
+    generate_certs(workdir / "certs", args.key_size, args.key_profile)
+
+    listeners = {}
+    for name in ("echo", "sink", "source"):
+        listeners[name] = socket.create_server(("127.0.0.1", 0), backlog=1024)
+    ports = {name: listener.getsockname()[1] for name, listener in listeners.items()}
+    targets = multiprocessing.Process(target=run_targets, args=(listeners,), daemon=True)
+    targets.start()
+
+    tunnel_port, proxy_port = free_port(), free_port()
+    server_config, client_config = write_configs(workdir, args, tunnel_port, proxy_port)
+    env = dict(
+        os.environ,
+        CERTS_DIR=str(workdir / "certs"),
+        SERVER_CONFIG_FILE=str(server_config),
+        CLIENT_CONFIG_FILE=str(client_config),
+        LOG_LEVEL=os.environ.get("LOG_LEVEL", "WARNING"),
+    )
+    # Les journaux des processus vont dans le répertoire de travail
+    server = subprocess.Popen([sys.executable, str(ROOT / "server" / "main.py")], cwd=workdir, env=env)
+    client = subprocess.Popen([sys.executable, str(ROOT / "client" / "main.py")], cwd=workdir, env=env)
+    proxy = ("127.0.0.1", proxy_port)
+
+    try:
+        wait_ready(proxy, ports["echo"])
+        size = args.bulk_mb * 1024 * 1024
+        print("Mesures en cours...")
+        results = {
+            "bulk_upload_mbps": bench_upload(proxy, ports["sink"], size),
+            "bulk_download_mbps": bench_download(proxy, ports["source"], size),
+            "connection_rate": bench_connection_rate(proxy, ports["echo"], args.duration, args.concurrency),
+            "latency": bench_latency(proxy, ports["echo"], args.duration, args.concurrency, args.message_size),
+        }
+    finally:
+        for process in (client, server):
+            process.terminate()
+            process.wait()
+        targets.terminate()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {key: value for key, value in vars(args).items() if key not in ("output", "compare", "keep")},
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    latency = results["latency"]
+    rate = results["connection_rate"]
+    print(f"Envoi en masse        : {results['bulk_upload_mbps']:.1f} Mo/s")
+    print(f"Réception en masse    : {results['bulk_download_mbps']:.1f} Mo/s")
+    print(f"Nouvelles connexions  : {rate['connections_per_second']:.1f} /s ({rate['errors']} erreurs)")
+    print(f"Latence {args.message_size} octets     : p50 {latency['p50_us']:.0f} µs, "
+          f"p99 {latency['p99_us']:.0f} µs, p999 {latency['p999_us']:.0f} µs")
+    print(f"Résultats écrits dans {args.output}" + (f" (répertoire de travail : {workdir})" if args.keep else ""))
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import asyncio
+import time
+
+from config import ClientConfig
+from socks5 import (
+    CMD_CONNECT,
+    CMD_UDP_ASSOCIATE,
+    EARLY_DATA_MAX,
+    METHOD_NO_AUTH,
+    METHOD_NOT_ACCEPTABLE,
+    NEGOTIATION_READ,
+    REJECT_TIMEOUT,
+    REPLY_COMMAND_NOT_SUPPORTED,
+    REPLY_GENERAL_FAILURE,
+    REPLY_SUCCEEDED,
+    SOCKS_VERSION,
+    compression_offer,
+    config_changed,
+    early_data_allowed,
+    encode_target,
+    encode_udp_request,
+    log_proxy_access,
+    parse_greeting,
+    parse_socks_request,
+    reload_proxy,
+    socks_reply,
+    socks_stats,
+)
+from tunnel import AsyncMuxTunnel
+from balancer import ServerBalancer
+from udp_relay import UDPAssociation, udp_supported
+from utils.admission import AdmissionControl
+from utils.aio_streams import AsyncTCPStream, relay, run_event_loop
+from utils.compression import AsyncCompressedStream
+from utils.lifecycle import ConfigWatcher, install_signal_handlers, wait_drained_async
+from utils.logger import connection_logger, get_logger
+from utils.metrics import record_error, socks_negotiation_seconds
+from utils.profiling import stage_timer
+from utils.reaper import ConnectionReaper
+from utils.sockopts import tune_socket
+
+logger = get_logger("SOCKS5")
+
+
+async def read_parsed(reader, parse, buf: bytes = b""):
+    """Équivalent asyncio de socks5.recv_parsed."""
+    while True:
+        result = parse(buf)
+        if result is not None:
+            value, consumed = result
+            return value, buf[consumed:]
+        chunk = await reader.read(NEGOTIATION_READ)
+        if not chunk:
+            return None, b""
+        buf += chunk
+
+
+async def read_early_data(reader, pending: bytes, wait: float) -> bytes:
+    """Équivalent asyncio de Socks5ProxyHandler._early_data."""
+    if len(pending) >= EARLY_DATA_MAX:
+        return pending
+    read = asyncio.ensure_future(reader.read(EARLY_DATA_MAX - len(pending)))
+    done, _ = await asyncio.wait((read,), timeout=0 if pending else wait)
+    if not done:
+        # Aucun octet consommé : read() n'a rien retiré du tampon du flux
+        read.cancel()
+        return pending
+    return pending + read.result()
+
+
+class AsyncSocks5Proxy:
+    """
+    Moteur asyncio du proxy SOCKS5 : toutes les connexions sont servies par
+    une seule boucle d'événements, avec le même protocole de tunnel que
+    Socks5ProxyHandler.
+
+    Attributes:
+        config (ClientConfig): Configuration du client.
+        balancer (ServerBalancer): Répartition des connexions TLS entre les serveurs du tunnel.
+        mux (AsyncMuxTunnel): Tunnel multiplexé partagé, ou None en mode "direct".
+        admission (AdmissionControl): Limite de connexions simultanées.
+        reaper (ConnectionReaper): Fermeture des connexions inactives ou à moitié fermées.
+    """
+
+    def __init__(self, config: ClientConfig):
+        self.config = config
+        self.balancer = ServerBalancer.from_config(config)
+        self.mux = None
+        self.admission = AdmissionControl(config.max_connections)
+        self.reaper = ConnectionReaper(config.idle_timeout, config.half_close_timeout)
+        if config.tunnel_mode == "mux":
+            self.mux = AsyncMuxTunnel(self.balancer, config.mux_connections)
+
+    def start(self):
+        """
+        Lance le proxy (bloquant), sur uvloop s'il est installé, jusqu'à la
+        fin d'un arrêt progressif (voir Socks5Proxy.drain).
+        """
+        run_event_loop(self._serve())
+
+    def reload(self) -> bool:
+        """Voir reload_proxy."""
+        return reload_proxy(self.config, self.admission, self.reaper, self.balancer)
+
+    async def _serve(self):
+        config = self.config
+        server = await asyncio.start_server(
+            self._handle_client, config.proxy_host, config.proxy_port, reuse_address=True
+        )
+        drain_requested = asyncio.Event()
+        install_signal_handlers(self.reload, drain_requested.set, asyncio.get_running_loop())
+        watcher = ConfigWatcher(lambda: config_changed(config), self.reload, config.reload_interval)
+        tasks = [
+            asyncio.ensure_future(self.reaper.run_async()),
+            asyncio.ensure_future(watcher.run_async()),
+            asyncio.ensure_future(self.balancer.run_async()),
+        ]
+        try:
+            await drain_requested.wait()
+            logger.info(
+                f"Arrêt progressif : {self.admission.active} connexion(s) en cours, "
+                f"délai maximal {config.drain_timeout:g} s"
+            )
+            # Sans attendre wait_closed() : il attendrait aussi la fin des connexions
+            server.close()
+            await wait_drained_async(lambda: self.admission.active, config.drain_timeout)
+            logger.info("Proxy arrêté")
+        finally:
+            server.close()
+            for task in tasks:
+                task.cancel()
+
+    async def _handle_client(self, reader, writer):
+        client_addr = writer.get_extra_info("peername")
+        client = AsyncTCPStream(reader, writer)
+        if not self.admission.try_acquire():
+            try:
+                await asyncio.wait_for(self._reject(reader, client), REJECT_TIMEOUT)
+            except (asyncio.TimeoutError, OSError, ValueError):
+                pass
+            finally:
+                client.close()
+            return
+
+        tune_socket(writer.get_extra_info("socket"), "local")
+        log = connection_logger(logger)
+        start = time.monotonic()
+        target = counters = error = None
+        timer = stage_timer(start)
+        # Fermés par le ramasseur si la connexion reste inactive (négociation SOCKS5 comprise)
+        streams = [client]
+        tracker = self.reaper.track(lambda: [s.close() for s in streams])
+        try:
+            log.info(f"Nouvelle connexion depuis {client_addr}")
+
+            # === Étape 1 : handshake SOCKS5 ===
+            # Lectures tamponnées, comme Socks5ProxyHandler (pipelining)
+            methods, buf = await read_parsed(reader, parse_greeting)
+            if methods is None:
+                return
+            if METHOD_NO_AUTH not in methods:
+                logger.error("Aucune méthode d'authentification acceptable")
+                await client.write(bytes([SOCKS_VERSION, METHOD_NOT_ACCEPTABLE]))
+                return
+            await client.write(b"\x05\x00")  # Réponse : SOCKS5, No Auth
+
+            # === Étape 2 : demande de connexion ===
+            if buf:
+                socks_stats.incr("pipelined")
+            request, pending = await read_parsed(reader, parse_socks_request, buf)
+            if request is None:
+                return
+            if request.command not in (CMD_CONNECT, CMD_UDP_ASSOCIATE):
+                logger.error("Requête non supportée")
+                await client.write(socks_reply(REPLY_COMMAND_NOT_SUPPORTED))
+                return
+
+            addr, port = request.host, request.port
+            if request.command == CMD_UDP_ASSOCIATE:
+                target = "udp"
+                counters = await self._associate(client, writer, port, start, streams, tracker, log)
+                return
+            target = f"{addr}:{port}"
+            log.info(f"Requête de connexion vers {target}")
+
+            # === Étape 3 : réponse OK au client SOCKS5 ===
+            await client.write(socks_reply(REPLY_SUCCEEDED))  # connexion acceptée
+            socks_negotiation_seconds.observe(time.monotonic() - start)
+            timer.mark("socks")
+
+            # === Étape 4 : tunnel TLS (connexion dédiée ou flux multiplexé) ===
+            codecs = compression_offer(self.config)
+            tunnel = await self._open_tunnel()
+            streams.append(tunnel)
+            timer.mark("tunnel")
+            if early_data_allowed(self.config, codecs):
+                # Cible et premiers octets de l'application en une seule écriture TLS
+                pending = await read_early_data(reader, pending, self.config.early_data_wait)
+                await tunnel.write(encode_target(self.config, addr, port, early_data=pending))
+            else:
+                await tunnel.write(encode_target(self.config, addr, port, codecs))
+                if codecs:
+                    tunnel = AsyncCompressedStream.client(tunnel, codecs, self.config.compression_level)
+                if pending:
+                    await tunnel.write(pending)
+            counters = await relay(client, tunnel, tracker)
+            counters.upstream.bytes += len(pending)
+            timer.mark("relay")
+
+        except asyncio.CancelledError:
+            # Fin de drain : la boucle s'arrête et annule les connexions restantes.
+            # Terminer normalement évite une trace d'asyncio (Python < 3.12).
+            error = ConnectionAbortedError("Arrêt du proxy")
+        except Exception as e:
+            error = e
+            record_error("socks5", e)
+        finally:
+            tracker.release()
+            client.close()
+            self.admission.release()
+            if target is not None:
+                log_proxy_access(client_addr, target, self.mux is not None, start, counters, error, timer.as_dict())
+
+    async def _associate(self, client: AsyncTCPStream, writer, port: int, start: float, streams: list, tracker, log):
+        """UDP ASSOCIATE (voir Socks5ProxyHandler._associate)."""
+        if not udp_supported(self.config):
+            log.info("Association UDP refusée (udp.enabled: false ou en-tête legacy)")
+            await client.write(socks_reply(REPLY_COMMAND_NOT_SUPPORTED))
+            return None
+        association = UDPAssociation(
+            writer.get_extra_info("sockname")[0], writer.get_extra_info("peername")[0], port, tracker
+        )
+        try:
+            await client.write(socks_reply(REPLY_SUCCEEDED, association.bind_address))
+            socks_negotiation_seconds.observe(time.monotonic() - start)
+            log.info(f"Association UDP ouverte sur {association.bind_address[0]}:{association.bind_address[1]}")
+            tunnel = await self._open_tunnel()
+            streams.append(tunnel)
+            try:
+                await tunnel.write(encode_udp_request())
+                counters = await association.run_async(client, tunnel)
+            finally:
+                tunnel.close()
+            log.debug(f"Association UDP terminée : {counters.as_dict()}")
+            return counters
+        finally:
+            association.close()
+
+    async def _reject(self, reader, client: AsyncTCPStream):
+        """Négociation minimale puis réponse "échec général" (0x01)."""
+        methods, buf = await read_parsed(reader, parse_greeting)
+        if methods is None:
+            return
+        await client.write(b"\x05\x00")
+        request, _ = await read_parsed(reader, parse_socks_request, buf)
+        if request is not None:
+            await client.write(socks_reply(REPLY_GENERAL_FAILURE))
+
+    async def _open_tunnel(self):
+        if self.mux is not None:
+            return await self.mux.open_stream()
+        return await self.balancer.connect_async()
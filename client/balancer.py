@@ -0,0 +1,322 @@
+import asyncio
+import random
+import threading
+import time
+
+from tunnel import HANDSHAKE_TIMEOUT, TLSClientTunnel
+from utils.logger import get_logger
+from utils.metrics import registry
+from utils.stats import Stats
+
+logger = get_logger("BALANCER")
+
+# Poids d'une nouvelle mesure dans les moyennes mobiles (RTT, taux d'échec)
+SMOOTHING = 0.3
+# Coût multiplié par (1 + ERROR_PENALTY × taux d'échec)
+ERROR_PENALTY = 10.0
+# Le coût estimé d'un serveur diminue de moitié toutes les HALF_LIFE secondes
+# sans nouvelle observation : un serveur délaissé après une connexion lente
+# ou un échec isolé finit par être réessayé
+HALF_LIFE = 5.0
+
+# Basculements vers un autre serveur après un échec (failovers),
+# sondes des serveurs écartés (probes, probe_failures)
+balancer_stats = Stats("balancer")
+balancer_connections = registry.counter(
+    "balancer_connections_total", "Connexions TLS établies par serveur du tunnel", ("server",)
+)
+balancer_failures = registry.counter(
+    "balancer_failures_total", "Échecs de connexion ou de handshake par serveur du tunnel", ("server",)
+)
+balancer_ejections = registry.counter(
+    "balancer_ejections_total", "Mises à l'écart de serveurs du tunnel défaillants", ("server",)
+)
+balancer_ejected = registry.gauge("balancer_ejected", "Serveurs du tunnel actuellement écartés")
+
+
+class TunnelServer:
+    """
+    Serveur du tunnel et son état mesuré.
+
+    Attributes:
+        host (str): Hôte du serveur TLS.
+        port (int): Port du serveur TLS.
+        weight (float): Capacité relative (le coût estimé est divisé par le poids).
+        rtt (float): Moyenne mobile (s) des durées de connexion et de handshake, échecs compris
+            (un délai dépassé coûte cher, un refus immédiat non), None avant la première mesure.
+        updated (float): Instant (time.monotonic) de la dernière observation (succès ou échec).
+        error_rate (float): Moyenne mobile des échecs (0 : aucun, 1 : toutes les tentatives).
+        failures (int): Échecs consécutifs.
+        pending (int): Connexions en cours d'établissement.
+        ejected_until (float): Fin (time.monotonic) de la mise à l'écart, 0 si le serveur est disponible.
+        ejections (int): Mises à l'écart successives sans succès (durée doublée à chaque fois).
+    """
+
+    def __init__(self, host: str, port: int, weight: float = 1.0):
+        self.host = host
+        self.port = port
+        self.weight = weight
+        self.rtt = None
+        self.updated = 0.0
+        self.error_rate = 0.0
+        self.failures = 0
+        self.pending = 0
+        self.ejected_until = 0.0
+        self.ejections = 0
+
+    @property
+    def name(self) -> str:
+        return f"{self.host}:{self.port}"
+
+    @property
+    def ejected(self) -> bool:
+        return self.ejected_until > 0
+
+    def observe(self, elapsed: float):
+        """Intègre la durée d'une tentative à la moyenne mobile."""
+        self.rtt = elapsed if self.rtt is None else self.rtt + SMOOTHING * (elapsed - self.rtt)
+        self.updated = time.monotonic()
+
+    def score(self, now: float) -> float:
+        """Coût estimé d'une nouvelle connexion (le plus bas est choisi)."""
+        cost = (self.rtt or 0.0) * (1 + ERROR_PENALTY * self.error_rate)
+        cost *= 0.5 ** ((now - self.updated) / HALF_LIFE)
+        return cost * (1 + self.pending) / self.weight
+
+
+class ServerBalancer:
+    """
+    Répartition des connexions TLS entre les serveurs du tunnel.
+
+    Chaque connexion va vers le meilleur de deux serveurs tirés au sort selon
+    leur poids (power of two choices) : le score combine la durée mesurée des
+    connexions et handshakes, le taux d'échec et les connexions en cours.
+    Un serveur qui tarde à répondre perd ainsi sa part sans qu'aucune
+    connexion n'attende derrière lui. Un serveur qui échoue est remplacé par
+    un autre pour la même connexion.
+
+    Après `failure_threshold` échecs consécutifs, un serveur est écarté
+    pendant `eject_time` secondes (doublées à chaque nouvel échec, au plus
+    `max_eject_time`), puis sondé en arrière-plan par un handshake avant de
+    recevoir de nouveau des connexions. Si tous les serveurs sont écartés,
+    celui dont l'écart finit le plus tôt est tout de même essayé.
+
+    Attributes:
+        servers (list[TunnelServer]): Serveurs configurés.
+        handshake_timeout (float): Délai maximal (s) d'établissement d'une connexion.
+        failure_threshold (int): Échecs consécutifs avant mise à l'écart.
+        eject_time (float): Durée (s) de la première mise à l'écart.
+        max_eject_time (float): Durée maximale (s) d'une mise à l'écart.
+        probe_interval (float): Période (s) de vérification des serveurs à sonder.
+    """
+
+    def __init__(self, servers: list, handshake_timeout: float = HANDSHAKE_TIMEOUT, failure_threshold: int = 3,
+                 eject_time: float = 10.0, max_eject_time: float = 300.0, probe_interval: float = 2.0):
+        self.servers = [TunnelServer(host, port, weight) for host, port, weight in servers]
+        self.handshake_timeout = handshake_timeout
+        self.failure_threshold = max(1, failure_threshold)
+        self.eject_time = eject_time
+        self.max_eject_time = max(max_eject_time, eject_time)
+        self.probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._probing = set()
+
+    @classmethod
+    def from_config(cls, config) -> "ServerBalancer":
+        balancer = cls([])
+        balancer.configure(config)
+        return balancer
+
+    def configure(self, config):
+        """
+        Applique la configuration (démarrage ou rechargement). Les serveurs
+        conservés gardent leurs mesures ; les connexions établies vers un
+        serveur retiré continuent.
+        """
+        with self._lock:
+            known = {(s.host, s.port): s for s in self.servers}
+            servers = []
+            for host, port, weight in config.tunnel_servers:
+                server = known.pop((host, port), None) or TunnelServer(host, port)
+                server.weight = weight
+                servers.append(server)
+            for server in known.values():
+                if server.ejected:
+                    balancer_ejected.dec()
+            self.servers = servers
+            self.handshake_timeout = config.handshake_timeout
+            self.failure_threshold = max(1, config.balancer_failure_threshold)
+            self.eject_time = config.balancer_eject_time
+            self.max_eject_time = max(config.balancer_max_eject_time, config.balancer_eject_time)
+            self.probe_interval = config.balancer_probe_interval
+
+    # === Choix du serveur ===
+
+    def choose(self, exclude: list = ()) -> TunnelServer:
+        """Serveur de la prochaine connexion (hors `exclude`, déjà essayés)."""
+        with self._lock:
+            servers = [s for s in self.servers if s not in exclude]
+            if not servers:
+                raise ConnectionError("Aucun serveur de tunnel configuré")
+            available = [s for s in servers if not s.ejected]
+            if not available:
+                # Tous écartés : mieux vaut essayer que refuser la connexion
+                server = min(servers, key=lambda s: s.ejected_until)
+            elif len(available) == 1:
+                server = available[0]
+            else:
+                first = random.choices(available, [s.weight for s in available])[0]
+                others = [s for s in available if s is not first]
+                second = random.choices(others, [s.weight for s in others])[0]
+                now = time.monotonic()
+                server = min(first, second, key=lambda s: s.score(now))
+            server.pending += 1
+            return server
+
+    def _succeeded(self, server: TunnelServer, elapsed: float, probe: bool = False):
+        with self._lock:
+            if not probe:
+                server.pending -= 1
+            server.observe(elapsed)
+            server.error_rate -= SMOOTHING * server.error_rate
+            server.failures = 0
+            server.ejections = 0
+            if server.ejected:
+                server.ejected_until = 0.0
+                balancer_ejected.dec()
+                logger.info(f"Serveur {server.name} de nouveau disponible")
+        if not probe:
+            balancer_connections.inc(labels=(server.name,))
+
+    def _failed(self, server: TunnelServer, error: BaseException, elapsed: float, probe: bool = False):
+        """Échec d'une connexion (ou d'une sonde) : met le serveur à l'écart au-delà du seuil."""
+        with self._lock:
+            if not probe:
+                server.pending -= 1
+            server.observe(elapsed)
+            server.error_rate += SMOOTHING * (1 - server.error_rate)
+            server.failures += 1
+            if server.failures < self.failure_threshold and not server.ejected:
+                eject = None
+            else:
+                eject = min(self.eject_time * 2 ** server.ejections, self.max_eject_time)
+                if not server.ejected:
+                    balancer_ejected.inc()
+                server.ejections += 1
+                server.ejected_until = time.monotonic() + eject
+        balancer_failures.inc(labels=(server.name,))
+        if eject is not None:
+            balancer_ejections.inc(labels=(server.name,))
+            logger.warning(f"Serveur {server.name} écarté pendant {eject:g} s : {error}")
+
+    # === Connexions ===
+
+    def connect(self):
+        """
+        Connexion TLS vers le serveur choisi (voir TLSClientTunnel.connect_raw),
+        en essayant les autres serveurs si elle échoue.
+        """
+        tried = []
+        while True:
+            server = self.choose(tried)
+            tunnel = TLSClientTunnel()
+            tunnel.ssl_context()  # construit hors de la mesure (premier appel, rechargement)
+            start = time.monotonic()
+            try:
+                tls_sock = tunnel.connect_raw(server.host, server.port, self.handshake_timeout)
+            except OSError as e:
+                self._failed(server, e, time.monotonic() - start)
+                tried.append(server)
+                if len(tried) >= len(self.servers):
+                    raise
+                balancer_stats.incr("failovers")
+                continue
+            except BaseException:
+                self._cancelled(server)
+                raise
+            self._succeeded(server, time.monotonic() - start)
+            return tls_sock
+
+    async def connect_async(self):
+        """Équivalent asyncio de connect() (voir TLSClientTunnel.connect_async)."""
+        tried = []
+        while True:
+            server = self.choose(tried)
+            tunnel = TLSClientTunnel()
+            tunnel.ssl_context()
+            start = time.monotonic()
+            try:
+                stream = await tunnel.connect_async(server.host, server.port, self.handshake_timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self._failed(server, e, time.monotonic() - start)
+                tried.append(server)
+                if len(tried) >= len(self.servers):
+                    raise
+                balancer_stats.incr("failovers")
+                continue
+            except BaseException:
+                self._cancelled(server)
+                raise
+            self._succeeded(server, time.monotonic() - start)
+            return stream
+
+    def _cancelled(self, server: TunnelServer):
+        # Tentative interrompue (annulation, arrêt) : ni succès ni échec du serveur
+        with self._lock:
+            server.pending -= 1
+
+    # === Sondes des serveurs écartés ===
+
+    def start(self) -> "ServerBalancer":
+        """Sonde dans un thread dédié (moteur à threads)."""
+        threading.Thread(target=self._run, name="balancer-probe", daemon=True).start()
+        return self
+
+    async def run_async(self):
+        """Sonde dans la boucle d'événements (moteur asyncio)."""
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            for server in self._due():
+                asyncio.ensure_future(self._probe_async(server))
+
+    def _run(self):
+        while True:
+            time.sleep(self.probe_interval)
+            for server in self._due():
+                threading.Thread(target=self._probe, args=(server,), name="balancer-probe", daemon=True).start()
+
+    def _due(self) -> list:
+        """Serveurs écartés dont l'écart est échu et qui ne sont pas déjà sondés."""
+        now = time.monotonic()
+        with self._lock:
+            due = [s for s in self.servers if s.ejected and s.ejected_until <= now and s not in self._probing]
+            self._probing.update(due)
+        return due
+
+    def _probe(self, server: TunnelServer):
+        balancer_stats.incr("probes")
+        start = time.monotonic()
+        try:
+            TLSClientTunnel().connect_raw(server.host, server.port, self.handshake_timeout).close()
+        except OSError as e:
+            balancer_stats.incr("probe_failures")
+            self._failed(server, e, time.monotonic() - start, probe=True)
+        else:
+            self._succeeded(server, time.monotonic() - start, probe=True)
+        finally:
+            with self._lock:
+                self._probing.discard(server)
+
+    async def _probe_async(self, server: TunnelServer):
+        balancer_stats.incr("probes")
+        start = time.monotonic()
+        try:
+            (await TLSClientTunnel().connect_async(server.host, server.port, self.handshake_timeout)).close()
+        except (OSError, asyncio.TimeoutError) as e:
+            balancer_stats.incr("probe_failures")
+            self._failed(server, e, time.monotonic() - start, probe=True)
+        else:
+            self._succeeded(server, time.monotonic() - start, probe=True)
+        finally:
+            with self._lock:
+                self._probing.discard(server)
@@ -2,28 +2,189 @@ from pathlib import Path
 import os
 
 from utils.configLoader import ConfigLoader
+from utils.sockopts import socket_profile
+from utils.tls import TLSPolicy
 
 class ClientConfig:
     """
     Représente la configuration complète du client proxy.
 
     Attributs:
-        host (str): Adresse du serveur TLS distant.
-        port (int): Port du serveur TLS.
+        tunnel_servers (list[tuple]): Serveurs TLS distants (hôte, port, poids) ; remote_host / remote_port à défaut de liste.
         proxy_type (str): Type de proxy local (http, socks5...).
         proxy_port (int): Port d'écoute du proxy local.
+        engine (str): "threaded" (un thread par connexion) ou "asyncio" (boucle d'événements).
+        early_data (bool): Joint les premiers octets de l'application à l'en-tête d'ouverture du tunnel.
+        early_data_wait (float): Attente maximale (s) de ces octets quand ils ne sont pas encore arrivés (0 : aucune).
+        tunnel_mode (str): "direct" (une connexion TLS par flux) ou "mux" (flux multiplexés).
+        mux_connections (int): Nombre de connexions TLS persistantes en mode "mux".
+        tunnel_header (str): "legacy" (ligne "host:port", par défaut) ou "binary" (en-tête versionné).
+        handshake_timeout (float): Délai maximal (s) de connexion et de handshake TLS vers le serveur.
+        balancer_failure_threshold (int): Échecs consécutifs avant la mise à l'écart d'un serveur.
+        balancer_eject_time (float): Durée (s) de la première mise à l'écart (doublée à chaque récidive).
+        balancer_max_eject_time (float): Durée maximale (s) d'une mise à l'écart.
+        balancer_probe_interval (float): Période (s) de sondage des serveurs écartés.
+        pool_enabled (bool): Active la réserve de connexions TLS pré-établies (mode "direct").
+        pool_min_idle (int): Nombre minimal de connexions prêtes dans la réserve.
+        pool_max_size (int): Nombre maximal de connexions dans la réserve.
+        pool_max_age (float): Âge maximal (s) d'une connexion inutilisée.
+        relay_min_buffer (int): Taille minimale de lecture du relais.
+        relay_initial_buffer (int): Taille de lecture initiale du relais.
+        relay_max_buffer (int): Taille maximale de lecture du relais.
+        relay_adaptive (bool): Ajuste la taille de lecture au type de trafic.
+        idle_timeout (float): Inactivité maximale (s) d'une connexion avant fermeture (0 : illimitée).
+        half_close_timeout (float): Inactivité maximale (s) après la fin d'un des deux sens (0 : illimitée).
+        keepalive_enabled (bool): Keepalive TCP sur tous les sockets.
+        keepalive_idle (int): Inactivité (s) avant la première sonde keepalive.
+        keepalive_interval (int): Intervalle (s) entre deux sondes.
+        keepalive_count (int): Sondes sans réponse avant de déclarer le pair perdu.
+        max_connections (int): Connexions SOCKS5 simultanées (0 : illimité) ; au-delà, réponse 0x01.
+        compression_enabled (bool): Propose la compression des flux au serveur (en-tête "binary").
+        compression_codecs (list): Algorithmes proposés ("zstd" si le module zstandard est installé, "zlib").
+        compression_level (int): Niveau de compression (None : défaut de l'algorithme).
+        udp_enabled (bool): Accepte les demandes SOCKS5 UDP ASSOCIATE (en-tête "binary").
+        metrics_enabled (bool): Expose les métriques en HTTP (/metrics).
+        metrics_host (str): Adresse d'écoute de /metrics (bouclage uniquement).
+        metrics_port (int): Port d'écoute de /metrics.
+        stage_timing (bool): Mesure la durée de chaque étape des connexions (histogrammes, journal d'accès).
+        profile_seconds (float): Durée (s) d'un profil déclenché par SIGUSR2 ou /debug/profile.
+        profile_interval (float): Période (s) d'échantillonnage des piles pendant un profil.
+        socket_profiles (dict[str, SocketProfile]): Options TCP par lien : local (applications SOCKS5), tunnel (connexions au serveur).
+        fast_open (bool): TCP Fast Open sur les connexions sortantes et l'écoute du tunnel.
+        tls_policy (TLSPolicy): Versions, AEAD, groupes d'échange de clés et options TLS (section tls).
+        reload_interval (float): Période (s) de surveillance des fichiers de configuration et de certificats (0 : SIGHUP uniquement).
+        drain_timeout (float): Durée maximale (s) d'un arrêt progressif avant fermeture des connexions restantes.
     """
 
+    # Paramètres lus au démarrage seulement : un rechargement les ignore
+    RESTART_REQUIRED = (
+        "proxy_type", "proxy_host", "proxy_port", "engine", "tunnel_mode", "mux_connections",
+        "pool_enabled", "metrics_enabled", "metrics_host", "metrics_port",
+    )
+
     def __init__(self):
-        loader = ConfigLoader(
-            yaml_path=os.path.join(Path(__file__).resolve().parent, "config", "client_config.yaml")
+        # CLIENT_CONFIG_FILE permet d'utiliser un autre fichier (banc de test...)
+        self._loader = ConfigLoader(
+            yaml_path=os.getenv("CLIENT_CONFIG_FILE")
+            or os.path.join(Path(__file__).resolve().parent, "config", "client_config.yaml")
         )
-        config = loader.load()
+        self._parse(self._loader.load())
+
+    def changed(self) -> bool:
+        """True si le fichier de configuration a été modifié depuis son chargement."""
+        return self._loader.changed()
+
+    def reload(self) -> list:
+        """
+        Relit le fichier de configuration. Les nouvelles valeurs s'appliquent
+        aux connexions suivantes ; en cas d'erreur (YAML ou valeur invalide),
+        l'exception est propagée et la configuration reste inchangée.
+
+        Returns:
+            list: Paramètres modifiés qui ne prendront effet qu'au redémarrage.
+        """
+        staged = object.__new__(type(self))
+        staged._parse(self._loader.load())
+        ignored = [name for name in self.RESTART_REQUIRED if getattr(staged, name) != getattr(self, name)]
+        for name in self.RESTART_REQUIRED:
+            setattr(staged, name, getattr(self, name))
+        vars(self).update(vars(staged))
+        return ignored
+
+    def _parse(self, config: dict):
+        self.tunnel_servers = self._parse_servers(config.get("tunnel", {}))
+        self.tunnel_mode = config.get("tunnel", {}).get("mode", "direct")
+        self.mux_connections = int(config.get("tunnel", {}).get("mux_connections", 2))
+        self.tunnel_header = config.get("tunnel", {}).get("header", "legacy")
+        self.handshake_timeout = float(config.get("tunnel", {}).get("handshake_timeout", 10))
 
-        self.tunnel_host = config.get("tunnel", {}).get("remote_host")
-        self.tunnel_port = int(config.get("tunnel", {}).get("remote_port", 8443))
+        balancer = config.get("tunnel", {}).get("balancer", {})
+        self.balancer_failure_threshold = int(balancer.get("failure_threshold", 3))
+        self.balancer_eject_time = float(balancer.get("eject_time", 10))
+        self.balancer_max_eject_time = float(balancer.get("max_eject_time", 300))
+        self.balancer_probe_interval = float(balancer.get("probe_interval", 2))
+
+        pool = config.get("tunnel", {}).get("pool", {})
+        self.pool_enabled = bool(pool.get("enabled", False))
+        self.pool_min_idle = int(pool.get("min_idle", 4))
+        self.pool_max_size = int(pool.get("max_size", 16))
+        self.pool_max_age = float(pool.get("max_age", 60))
         self.proxy_type = config.get("proxy", {}).get("type", "socks5")
         self.proxy_host = config.get("proxy", {}).get("listen_host")
         self.proxy_port = int(config.get("proxy", {}).get("listen_port", 1080))
+        self.engine = config.get("proxy", {}).get("engine", "threaded")
+        self.early_data = bool(config.get("proxy", {}).get("early_data", True))
+        self.early_data_wait = float(config.get("proxy", {}).get("early_data_wait", 0))
         # self.socks5_user = config.get("auth", {}).get("socks5_user")
         # self.socks5_pass = config.get("auth", {}).get("socks5_pass")
+
+        relay = config.get("relay", {})
+        self.relay_min_buffer = int(relay.get("min_buffer", 4096))
+        self.relay_initial_buffer = int(relay.get("initial_buffer", 16384))
+        self.relay_max_buffer = int(relay.get("max_buffer", 262144))
+        self.relay_adaptive = bool(relay.get("adaptive", True))
+
+        timeouts = config.get("timeouts", {})
+        self.idle_timeout = float(timeouts.get("idle", 300))
+        self.half_close_timeout = float(timeouts.get("half_close", 60))
+        keepalive = timeouts.get("keepalive", {})
+        self.keepalive_enabled = bool(keepalive.get("enabled", True))
+        self.keepalive_idle = int(keepalive.get("idle", 60))
+        self.keepalive_interval = int(keepalive.get("interval", 10))
+        self.keepalive_count = int(keepalive.get("count", 5))
+
+        self.max_connections = int(config.get("admission", {}).get("max_connections", 0))
+
+        compression = config.get("compression", {})
+        self.compression_enabled = bool(compression.get("enabled", False))
+        self.compression_codecs = list(compression.get("codecs", ["zstd", "zlib"]))
+        self.compression_level = compression.get("level")
+
+        self.udp_enabled = bool(config.get("udp", {}).get("enabled", True))
+
+        metrics = config.get("metrics", {})
+        self.metrics_enabled = bool(metrics.get("enabled", False))
+        self.metrics_host = metrics.get("host", "127.0.0.1")
+        self.metrics_port = int(metrics.get("port", 9101))
+
+        profiling = config.get("profiling", {})
+        self.stage_timing = bool(profiling.get("stage_timing", False))
+        self.profile_seconds = float(profiling.get("sample_seconds", 10))
+        self.profile_interval = float(profiling.get("sample_interval", 0.005))
+        if self.profile_seconds <= 0 or self.profile_interval <= 0:
+            raise ValueError("profiling.sample_seconds et profiling.sample_interval doivent être positifs")
+
+        sockets = config.get("sockets", {})
+        self.socket_profiles = {
+            leg: socket_profile(str(sockets.get(leg, "interactive")), sockets.get("profiles"))
+            for leg in ("local", "tunnel")
+        }
+        self.fast_open = bool(sockets.get("fast_open", False))
+
+        tls = config.get("tls", {})
+        self.tls_policy = TLSPolicy(
+            min_version=str(tls.get("min_version", "1.2")),
+            max_version=str(tls.get("max_version", "1.3")),
+            ciphers=list(tls.get("ciphers", ["aes-128-gcm", "aes-256-gcm", "chacha20-poly1305"])),
+            prefer_fastest=bool(tls.get("prefer_fastest", True)),
+            groups=list(tls.get("groups", ["X25519"])),
+            renegotiation=bool(tls.get("renegotiation", False)),
+            compression=bool(tls.get("compression", False)),
+        )
+
+        lifecycle = config.get("lifecycle", {})
+        self.reload_interval = float(lifecycle.get("reload_interval", 2))
+        self.drain_timeout = float(lifecycle.get("drain_timeout", 30))
+
+    @staticmethod
+    def _parse_servers(tunnel: dict) -> list:
+        servers = tunnel.get("servers")
+        if not servers:
+            return [(tunnel.get("remote_host"), int(tunnel.get("remote_port", 8443)), 1.0)]
+        parsed = []
+        for server in servers:
+            weight = float(server.get("weight", 1))
+            if weight <= 0:
+                raise ValueError(f"Poids invalide pour le serveur {server.get('host')} : {weight}")
+            parsed.append((server["host"], int(server.get("port", 8443)), weight))
+        return parsed
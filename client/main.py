@@ -1,27 +1,25 @@
-import socket
-
-from socks5 import Socks5ProxyHandler
+from socks5 import Socks5Proxy
+from aio_proxy import AsyncSocks5Proxy
 from config import ClientConfig
-
-def start_socks5_proxy(config: ClientConfig):
-    listen_addr = config.proxy_host
-    listen_port = config.proxy_port
-    print(f"[SOCKS5] En écoute sur {listen_addr}:{listen_port}...")
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
-        server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        server_sock.bind((listen_addr, listen_port))
-        server_sock.listen()
-
-        while True:
-            client_sock, client_addr = server_sock.accept()
-            handler = Socks5ProxyHandler(client_sock, client_addr, config)
-            handler.start()
+from tunnel import configure_tls_policy
+from utils.metrics import start_metrics_server
+from utils.profiling import configure_profiling, profile_route
+from utils.reaper import configure_keepalive
+from utils.sockopts import configure_sockets
 
 if __name__ == "__main__":
     try:
         config = ClientConfig()
-        start_socks5_proxy(config)
+        configure_keepalive(config.keepalive_enabled, config.keepalive_idle,
+                            config.keepalive_interval, config.keepalive_count)
+        configure_profiling(config.stage_timing, config.profile_seconds, config.profile_interval)
+        configure_sockets(config.socket_profiles, config.fast_open)
+        configure_tls_policy(config.tls_policy)
+        if config.metrics_enabled:
+            start_metrics_server(config.metrics_host, config.metrics_port, routes={"/debug/profile": profile_route})
+        if config.engine == "asyncio":
+            AsyncSocks5Proxy(config).start()
+        else:
+            Socks5Proxy(config).start()
     except KeyboardInterrupt:
         exit(1)
-
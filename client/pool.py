@@ -0,0 +1,136 @@
+import socket
+import ssl
+import threading
+import time
+from collections import deque
+
+from utils.logger import get_logger
+
+logger = get_logger("POOL")
+
+
+class TLSConnectionPool:
+    """
+    Réserve de connexions TLS déjà établies (handshake terminé) vers le serveur.
+
+    Un thread de fond maintient au moins `min_idle` connexions prêtes, davantage
+    après une rafale (autant que de connexions prises pendant la dernière période),
+    sans dépasser `max_size`, et évince celles plus vieilles que `max_age`.
+    Si la réserve est vide, acquire() retombe sur une connexion synchrone.
+    Chaque connexion va vers le serveur choisi par le répartiteur.
+
+    Attributes:
+        balancer (ServerBalancer): Choix du serveur de chaque connexion TLS.
+        min_idle (int): Nombre minimal de connexions prêtes.
+        max_size (int): Nombre maximal de connexions en réserve.
+        max_age (float): Âge maximal (s) d'une connexion inutilisée.
+        refill_interval (float): Période (s) de vérification du thread de fond.
+    """
+
+    def __init__(self, balancer, min_idle: int = 4, max_size: int = 16,
+                 max_age: float = 60.0, refill_interval: float = 1.0):
+        self.balancer = balancer
+        self.min_idle = min_idle
+        self.max_size = max(max_size, min_idle)
+        self.max_age = max_age
+        self.refill_interval = refill_interval
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._acquired = 0
+        self._refiller = threading.Thread(target=self._refill_loop, daemon=True)
+
+    def start(self) -> "TLSConnectionPool":
+        self._refiller.start()
+        return self
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+        with self._lock:
+            idle, self._idle = list(self._idle), deque()
+        for tls_sock, _ in idle:
+            self._discard(tls_sock)
+
+    def acquire(self) -> ssl.SSLSocket:
+        """
+        Retourne une connexion TLS prête à l'emploi (la plus récente de la réserve),
+        ou en établit une nouvelle si aucune n'est disponible.
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._acquired += 1
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                tls_sock, created = self._idle.pop()
+            if now - created < self.max_age and self._is_alive(tls_sock):
+                self._wakeup.set()
+                return tls_sock
+            self._discard(tls_sock)
+
+        self._wakeup.set()
+        return self._connect()
+
+    def _connect(self) -> ssl.SSLSocket:
+        return self.balancer.connect()
+
+    def _is_alive(self, tls_sock: ssl.SSLSocket) -> bool:
+        """
+        Vérifie sans bloquer qu'une connexion inutilisée n'a pas été fermée par le serveur.
+        Les messages TLS post-handshake (tickets de session) sont consommés au passage.
+        """
+        try:
+            timeout = tls_sock.gettimeout()
+            tls_sock.setblocking(False)
+            try:
+                if not tls_sock.pending():
+                    # Socket TCP sous-jacent (SSLSocket.recv n'accepte pas de drapeaux) :
+                    # BlockingIOError si rien n'est arrivé
+                    socket.socket.recv(tls_sock, 1, socket.MSG_PEEK)
+                tls_sock.recv(1)
+                # EOF ou données inattendues : la connexion n'est plus réutilisable
+                return False
+            except (ssl.SSLWantReadError, BlockingIOError):
+                return True
+            finally:
+                tls_sock.settimeout(timeout)
+        except (OSError, ValueError):
+            return False
+
+    def _discard(self, tls_sock: ssl.SSLSocket):
+        try:
+            tls_sock.close()
+        except Exception:
+            pass
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        with self._lock:
+            expired = [c for c in self._idle if now - c[1] >= self.max_age]
+            self._idle = deque(c for c in self._idle if now - c[1] < self.max_age)
+        for tls_sock, _ in expired:
+            self._discard(tls_sock)
+
+    def _refill_loop(self):
+        while not self._stopped:
+            self._evict_expired()
+            with self._lock:
+                target = min(self.max_size, max(self.min_idle, self._acquired))
+                self._acquired = 0
+            while not self._stopped:
+                with self._lock:
+                    missing = len(self._idle) < target
+                if not missing:
+                    break
+                try:
+                    tls_sock = self._connect()
+                except Exception as e:
+                    logger.error(f"Remplissage de la réserve impossible : {e}")
+                    break
+                with self._lock:
+                    self._idle.append((tls_sock, time.monotonic()))
+            self._wakeup.wait(self.refill_interval)
+            self._wakeup.clear()
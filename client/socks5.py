@@ -1,98 +1,536 @@
+import queue
+import selectors
 import socket
 import threading
+import time
 
-from tunnel import TLSClientTunnel
+from tunnel import MuxTunnel, configure_tls_policy, reload_ssl_contexts, ssl_contexts_changed
+from balancer import ServerBalancer
+from pool import TLSConnectionPool
 from config import ClientConfig
-from utils.logger import get_logger
+from udp_relay import UDPAssociation, udp_supported
+from utils.admission import AdmissionControl
+from utils.compression import CompressedSocket, codec_mask
+from utils.lifecycle import (
+    ConfigWatcher,
+    close_listener,
+    install_signal_handlers,
+    lifecycle_stats,
+    wait_drained,
+)
+from utils.logger import connection_logger, get_logger, log_access
+from utils.metrics import record_error, socks_negotiation_seconds
+from utils.profiling import configure_profiling, stage_timer
+from utils.protocol import EARLY_DATA_MAX, FLAG_UDP, encode_address, encode_request, parse_address
+from utils.reaper import ConnectionReaper, configure_keepalive
+from utils.relay import RelayPolicy, abort, relay
+from utils.sockopts import configure_sockets, tune_socket
+from utils.stats import Stats
 
 logger = get_logger("SOCKS5")
 
+# Négociations dont la demande est arrivée avec la salutation (pipelined),
+# connexions ouvertes avec des données anticipées (early_data, early_data_bytes)
+socks_stats = Stats("socks5")
+
+SOCKS_VERSION = 5
+METHOD_NO_AUTH = 0x00
+METHOD_NOT_ACCEPTABLE = 0xFF
+
+CMD_CONNECT = 0x01
+CMD_UDP_ASSOCIATE = 0x03
+
+REPLY_SUCCEEDED = 0x00
+REPLY_GENERAL_FAILURE = 0x01
+REPLY_COMMAND_NOT_SUPPORTED = 0x07
+
+REJECT_TIMEOUT = 2.0  # délai (s) laissé à un client refusé pour envoyer sa demande
+NEGOTIATION_READ = 4096
+
+
+class SocksRequest:
+    """
+    Demande SOCKS5 décodée.
+
+    Attributes:
+        command (int): CMD_CONNECT, CMD_UDP_ASSOCIATE...
+        host (str): Adresse demandée (IP ou nom de domaine).
+        port (int): Port demandé.
+    """
+
+    def __init__(self, command: int, host: str, port: int):
+        self.command = command
+        self.host = host
+        self.port = port
+
+
+def parse_greeting(buf: bytes):
+    """
+    Décode la salutation SOCKS5 (VER, NMETHODS, METHODS) au début de `buf`.
+
+    Returns:
+        tuple[bytes, int] | None: Les méthodes proposées et le nombre d'octets
+        consommés, ou None s'il faut lire davantage.
+
+    Raises:
+        ValueError: Version autre que SOCKS5.
+    """
+    if len(buf) < 2:
+        return None
+    if buf[0] != SOCKS_VERSION:
+        raise ValueError(f"Version SOCKS non supportée : {buf[0]}")
+    end = 2 + buf[1]
+    if len(buf) < end:
+        return None
+    return bytes(buf[2:end]), end
+
+
+def parse_socks_request(buf: bytes):
+    """
+    Décode la demande SOCKS5 (VER, CMD, RSV, ATYP, adresse, port) au début
+    de `buf`. Les types d'adresse sont ceux de l'en-tête du tunnel
+    (utils.protocol.parse_address).
+
+    Returns:
+        tuple[SocksRequest, int] | None: La demande et le nombre d'octets
+        consommés, ou None s'il faut lire davantage.
+
+    Raises:
+        ValueError: Version autre que SOCKS5 ou type d'adresse inconnu.
+    """
+    if len(buf) < 4:
+        return None
+    if buf[0] != SOCKS_VERSION:
+        raise ValueError(f"Version SOCKS non supportée : {buf[0]}")
+    address = parse_address(buf, 3)
+    if address is None:
+        return None
+    host, port, end = address
+    return SocksRequest(buf[1], host, port), end
+
+
+def recv_parsed(sock, parse, buf: bytes = b""):
+    """
+    Lit `sock` par blocs jusqu'à ce que parse(buf) aboutisse : une seule
+    lecture suffit quand le client envoie tout d'un coup, et les lectures
+    courtes sont complétées.
+
+    Returns:
+        tuple: (valeur décodée, octets reçus au-delà), ou (None, b"") si la
+        connexion s'est fermée avant.
+    """
+    while True:
+        result = parse(buf)
+        if result is not None:
+            value, consumed = result
+            return value, buf[consumed:]
+        chunk = sock.recv(NEGOTIATION_READ)
+        if not chunk:
+            return None, b""
+        buf += chunk
+
+
+def socks_reply(code: int, bind: tuple = None) -> bytes:
+    """
+    Réponse SOCKS5 à une demande. `bind` : adresse liée (hôte, port), annoncée
+    pour UDP ASSOCIATE ; non renseignée (0.0.0.0:0) pour CONNECT.
+    """
+    return bytes([5, code, 0]) + encode_address(*(bind or ("0.0.0.0", 0)))
+
+
+def compression_offer(config: ClientConfig) -> int:
+    """Algorithmes de compression proposés au serveur (masque, 0 : pas de compression)."""
+    if not config.compression_enabled or config.tunnel_header == "legacy":
+        return 0
+    return codec_mask(config.compression_codecs)
+
+
+def encode_udp_request() -> bytes:
+    """En-tête d'ouverture d'un flux de datagrammes (association UDP, pas de cible)."""
+    return encode_request("0.0.0.0", 0, flags=FLAG_UDP)
+
+
+def early_data_allowed(config: ClientConfig, codecs: int) -> bool:
+    """
+    Mode optimiste : les premiers octets de l'application partent avec
+    l'en-tête (FLAG_EARLY_DATA), en-tête binaire et flux non compressé.
+    """
+    return config.early_data and not codecs and config.tunnel_header != "legacy"
+
+
+def encode_target(config: ClientConfig, addr: str, port: int, codecs: int = 0, early_data: bytes = b"") -> bytes:
+    """
+    En-tête d'ouverture du tunnel : binaire v1, ou ligne "host:port\n" pour
+    les anciens serveurs. `early_data` (voir early_data_allowed) est annoncé
+    dans l'en-tête et placé à sa suite, pour une seule écriture TLS.
+    """
+    if config.tunnel_header == "legacy":
+        return f"{addr}:{port}\n".encode()
+    if early_data:
+        socks_stats.incr("early_data")
+        socks_stats.incr("early_data_bytes", len(early_data))
+    return encode_request(addr, port, early_data_len=len(early_data), codecs=codecs) + early_data
+
+
+def log_proxy_access(client_addr: tuple, target: str, mux: bool, start: float, counters, error: Exception,
+                     stages: dict = None):
+    """
+    Enregistrement d'accès d'une connexion SOCKS5 relayée (moteurs threaded et asyncio).
+    `stages` : durées des étapes (utils.profiling.StageTimer.as_dict), ou None.
+    """
+    log_access(
+        side="client",
+        peer=f"{client_addr[0]}:{client_addr[1]}" if client_addr else None,
+        target=target,
+        mux=mux,
+        duration_ms=round((time.monotonic() - start) * 1000, 1),
+        **(counters.as_dict() if counters else {}),
+        error=type(error).__name__ if error else None,
+        **({"stages": stages} if stages else {}),
+    )
+
+def config_changed(config: ClientConfig) -> bool:
+    """True si la configuration ou les certificats du client ont changé sur disque."""
+    return config.changed() or ssl_contexts_changed()
+
+
+def reload_proxy(config: ClientConfig, admission: AdmissionControl, reaper: ConnectionReaper,
+                 balancer: ServerBalancer, pool: TLSConnectionPool = None) -> bool:
+    """
+    Recharge la configuration et les certificats du client (SIGHUP ou
+    modification des fichiers). Les connexions établies continuent ; les
+    suivantes utilisent les nouveaux serveurs, les nouvelles limites et les
+    nouveaux certificats. Une configuration invalide est refusée en bloc.
+
+    Args:
+        balancer (ServerBalancer): Répartiteur partagé entre les serveurs du tunnel.
+        pool (TLSConnectionPool): Réserve de connexions partagée, ou None.
+    """
+    try:
+        ignored = config.reload()
+    except Exception as e:
+        lifecycle_stats.incr("reload_failures")
+        record_error("reload", e)
+        logger.error(f"Configuration invalide, rechargement annulé : {e}")
+        return False
+    if ignored:
+        logger.warning(f"Pris en compte au prochain redémarrage seulement : {', '.join(ignored)}")
+
+    admission.configure(config.max_connections)
+    configure_keepalive(config.keepalive_enabled, config.keepalive_idle, config.keepalive_interval, config.keepalive_count)
+    configure_profiling(config.stage_timing, config.profile_seconds, config.profile_interval)
+    configure_sockets(config.socket_profiles, config.fast_open)
+    reaper.idle_timeout = config.idle_timeout
+    reaper.half_close_timeout = config.half_close_timeout
+    # Nouvelles connexions, sessions multiplexées et connexions de réserve vers les serveurs configurés
+    balancer.configure(config)
+    if pool is not None:
+        pool.min_idle = config.pool_min_idle
+        pool.max_size = max(config.pool_max_size, config.pool_min_idle)
+        pool.max_age = config.pool_max_age
+    configure_tls_policy(config.tls_policy)
+    reload_ssl_contexts()
+
+    lifecycle_stats.incr("reloads")
+    logger.info("Configuration rechargée")
+    return True
+
+
+class Socks5Rejector:
+    """
+    Répond "échec général" (0x01) aux connexions refusées par l'admission.
+
+    Un seul thread traite les refus, avec un délai court : sous surcharge,
+    refuser ne crée pas de thread. Si sa file est pleine, la connexion est
+    simplement fermée.
+    """
+
+    def __init__(self, max_pending: int = 256):
+        self._queue = queue.Queue(max_pending)
+        threading.Thread(target=self._run, name="socks5-reject", daemon=True).start()
+
+    def reject(self, client_sock: socket.socket):
+        try:
+            self._queue.put_nowait(client_sock)
+        except queue.Full:
+            client_sock.close()
+
+    def _run(self):
+        while True:
+            client_sock = self._queue.get()
+            try:
+                client_sock.settimeout(REJECT_TIMEOUT)
+                methods, buf = recv_parsed(client_sock, parse_greeting)
+                if methods is None:
+                    continue
+                client_sock.sendall(b"\x05\x00")
+                request, _ = recv_parsed(client_sock, parse_socks_request, buf)
+                if request is None:
+                    continue
+                client_sock.sendall(socks_reply(REPLY_GENERAL_FAILURE))
+            except (OSError, ValueError):
+                pass
+            finally:
+                client_sock.close()
+
+
+class Socks5Proxy:
+    """
+    Moteur à threads du proxy SOCKS5 : une boucle d'acceptation et un
+    Socks5ProxyHandler par connexion admise.
+
+    Attributes:
+        config (ClientConfig): Configuration du client.
+        balancer (ServerBalancer): Répartition des connexions TLS entre les serveurs du tunnel.
+        mux (MuxTunnel): Tunnel multiplexé partagé, ou None en mode "direct".
+        pool (TLSConnectionPool): Réserve de connexions TLS pré-établies, ou None.
+        admission (AdmissionControl): Limite de connexions simultanées.
+        reaper (ConnectionReaper): Fermeture des connexions inactives ou à moitié fermées.
+    """
+
+    def __init__(self, config: ClientConfig):
+        self.config = config
+        self.balancer = ServerBalancer.from_config(config)
+        self.mux = self.pool = None
+        if config.tunnel_mode == "mux":
+            self.mux = MuxTunnel(self.balancer, config.mux_connections)
+        elif config.pool_enabled:
+            self.pool = TLSConnectionPool(
+                self.balancer,
+                min_idle=config.pool_min_idle,
+                max_size=config.pool_max_size,
+                max_age=config.pool_max_age,
+            )
+        # Au-delà de max_connections, réponse SOCKS5 0x01 sans créer de thread
+        self.admission = AdmissionControl(config.max_connections)
+        self.reaper = ConnectionReaper(config.idle_timeout, config.half_close_timeout)
+        self._listener = None
+        self._draining = False
+
+    def reload(self) -> bool:
+        """Voir reload_proxy."""
+        return reload_proxy(self.config, self.admission, self.reaper, self.balancer, self.pool)
+
+    def drain(self):
+        """
+        Arrêt progressif (SIGTERM) : l'écoute est fermée ; start() rend la main
+        quand les connexions en cours sont terminées, au plus tard après
+        drain_timeout secondes.
+        """
+        if self._draining:
+            return
+        self._draining = True
+        logger.info(
+            f"Arrêt progressif : {self.admission.active} connexion(s) en cours, "
+            f"délai maximal {self.config.drain_timeout:g} s"
+        )
+        if self._listener is not None:
+            close_listener(self._listener)
+
+    def start(self):
+        """Lance le proxy (bloquant) jusqu'à la fin d'un arrêt progressif."""
+        config = self.config
+        print(f"[SOCKS5] En écoute sur {config.proxy_host}:{config.proxy_port}...")
+        self.balancer.start()
+        if self.pool is not None:
+            self.pool.start()
+        rejector = Socks5Rejector()
+        self.reaper.start()
+        install_signal_handlers(self.reload, self.drain)
+        ConfigWatcher(lambda: config_changed(config), self.reload, config.reload_interval).start()
+
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server_sock:
+            server_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server_sock.bind((config.proxy_host, config.proxy_port))
+            server_sock.listen()
+            self._listener = server_sock
+
+            while True:
+                try:
+                    client_sock, client_addr = server_sock.accept()
+                except OSError:
+                    if self._draining:
+                        break
+                    raise
+                if not self.admission.try_acquire():
+                    rejector.reject(client_sock)
+                    continue
+                tune_socket(client_sock, "local")
+                handler = Socks5ProxyHandler(
+                    client_sock, client_addr, config, self.balancer, self.mux, self.pool, self.admission, self.reaper
+                )
+                handler.start()
+
+        wait_drained(lambda: self.admission.active, config.drain_timeout)
+        if self.pool is not None:
+            self.pool.stop()
+        logger.info("Proxy arrêté")
+
+
 class Socks5ProxyHandler(threading.Thread):
     """
     Gère une connexion SOCKS5 entrante et la redirige via un tunnel TLS mTLS.
 
     Attributes:
         client_sock (socket.socket): Socket du client (navigateur).
-        tunnel (TLSClientTunnel): Instance du tunnel TLS pour l'envoi des données.
+        balancer (ServerBalancer): Choix du serveur en mode "direct" sans réserve.
+        mux (MuxTunnel): Tunnel multiplexé partagé, ou None en mode "direct".
+        pool (TLSConnectionPool): Réserve de connexions TLS pré-établies, ou None.
+        admission (AdmissionControl): Admission qui a accepté la connexion (libérée à la fin), ou None.
+        reaper (ConnectionReaper): Ferme la connexion si elle reste inactive, ou None.
     """
 
-    def __init__(self, client_sock, client_addr, config: ClientConfig):
-        super().__init__()
+    def __init__(self, client_sock, client_addr, config: ClientConfig, balancer: ServerBalancer,
+                 mux: MuxTunnel = None, pool: TLSConnectionPool = None, admission: AdmissionControl = None,
+                 reaper: ConnectionReaper = None):
+        # daemon : la fin du processus (drain échu) n'attend pas les relais restants
+        super().__init__(daemon=True)
         self.client_sock = client_sock
         self.client_addr = client_addr
         self.config = config
+        self.balancer = balancer
+        self.mux = mux
+        self.pool = pool
+        self.admission = admission
+        self.reaper = reaper
+        self._tunnel_sock = None
 
     def run(self):
+        log = connection_logger(logger)
+        start = time.monotonic()
+        target = counters = error = None
+        timer = stage_timer(start)
+        # Surveillé dès la négociation SOCKS5 (client qui n'envoie jamais sa demande)
+        tracker = self.reaper.track(self._abort) if self.reaper else None
         try:
-            logger.info(f"Nouvelle connexion depuis {self.client_addr}")
+            log.info(f"Nouvelle connexion depuis {self.client_addr}")
 
             # === Étape 1 : handshake SOCKS5 ===
-            version, nmethods = self.client_sock.recv(2)
-            self.client_sock.recv(nmethods)  # on ignore les méthodes proposées
+            # Lectures tamponnées : la salutation, la demande et les premiers
+            # octets de l'application peuvent arriver ensemble (pipelining)
+            methods, buf = recv_parsed(self.client_sock, parse_greeting)
+            if methods is None:
+                return  # client parti (ou connexion fermée par le ramasseur)
+            if METHOD_NO_AUTH not in methods:
+                logger.error("Aucune méthode d'authentification acceptable")
+                self.client_sock.sendall(bytes([SOCKS_VERSION, METHOD_NOT_ACCEPTABLE]))
+                return
             self.client_sock.sendall(b"\x05\x00")  # Réponse : SOCKS5, No Auth
 
             # === Étape 2 : demande de connexion ===
-            data = self.client_sock.recv(4)
-            if len(data) < 4 or data[0] != 5 or data[1] != 1:
+            if buf:
+                socks_stats.incr("pipelined")
+            request, pending = recv_parsed(self.client_sock, parse_socks_request, buf)
+            if request is None:
+                return
+            if request.command not in (CMD_CONNECT, CMD_UDP_ASSOCIATE):
                 logger.error("Requête non supportée")
-                self.client_sock.close()
+                self.client_sock.sendall(socks_reply(REPLY_COMMAND_NOT_SUPPORTED))
                 return
 
-            atyp = data[3]
-            if atyp == 1:  # IPv4
-                addr = socket.inet_ntoa(self.client_sock.recv(4))
-            elif atyp == 3:  # domaine
-                domain_len = self.client_sock.recv(1)[0]
-                addr = self.client_sock.recv(domain_len).decode()
-            elif atyp == 4:  # IPv6
-                addr = socket.inet_ntop(socket.AF_INET6, self.client_sock.recv(16))
-            else:
-                logger.error("Type d'adresse non supporté")
-                self.client_sock.close()
+            addr, port = request.host, request.port
+            if request.command == CMD_UDP_ASSOCIATE:
+                target = "udp"
+                counters = self._associate(port, start, tracker, log)
                 return
-
-            port_bytes = self.client_sock.recv(2)
-            port = int.from_bytes(port_bytes, "big")
-            logger.info(f"Requête de connexion vers {addr}:{port}")
+            target = f"{addr}:{port}"
+            log.info(f"Requête de connexion vers {target}")
 
             # === Étape 3 : réponse OK au client SOCKS5 ===
-            self.client_sock.sendall(b"\x05\x00\x00\x01" + b"\x00" * 6)  # connexion acceptée
-
-            # === Étape 4 : tunnel TLS ===
-            with TLSClientTunnel().connect_raw(
-                self.config.tunnel_host,
-                self.config.tunnel_port
-            ) as tls_sock:
-                # envoyer la cible (protocole interne)
-                target_line = f"{addr}:{port}\n".encode()
-                tls_sock.sendall(target_line)
-                self._relay(self.client_sock, tls_sock)               
+            self.client_sock.sendall(socks_reply(REPLY_SUCCEEDED))  # connexion acceptée
+            socks_negotiation_seconds.observe(time.monotonic() - start)
+            timer.mark("socks")
+
+            # === Étape 4 : tunnel TLS (connexion dédiée ou flux multiplexé) ===
+            codecs = compression_offer(self.config)
+            with self._open_tunnel() as tls_sock:
+                self._tunnel_sock = tls_sock
+                timer.mark("tunnel")
+                if early_data_allowed(self.config, codecs):
+                    # Cible et premiers octets de l'application en une seule écriture TLS
+                    pending = self._early_data(pending)
+                    tls_sock.sendall(encode_target(self.config, addr, port, early_data=pending))
+                else:
+                    # envoyer la cible (protocole interne)
+                    tls_sock.sendall(encode_target(self.config, addr, port, codecs))
+                    if codecs:
+                        tls_sock = CompressedSocket.client(tls_sock, codecs, self.config.compression_level)
+                    if pending:
+                        tls_sock.sendall(pending)
+                counters = relay(self.client_sock, tls_sock, self._relay_policy(), tracker=tracker)
+                counters.upstream.bytes += len(pending)
+                timer.mark("relay")
+                log.debug(f"Relais terminé vers {target} : {counters.as_dict()}")
 
         except Exception as e:
-            pass
+            error = e
+            record_error("socks5", e)
         finally:
+            if tracker is not None:
+                tracker.release()
             self.client_sock.close()
+            if self.admission is not None:
+                self.admission.release()
+            if target is not None:
+                log_proxy_access(self.client_addr, target, self.mux is not None, start, counters, error, timer.as_dict())
 
-    def _relay(self, sock1, sock2):
-        def pipe(src, dst, label):
-            try:
-                while True:
-                    data = src.recv(4096)
-                    if not data:
-                        break
-                    dst.sendall(data)
-            except Exception as e:
-                pass
-            finally:
-                try:
-                    dst.shutdown(socket.SHUT_WR)
-                except Exception:
-                    pass
+    def _associate(self, port: int, start: float, tracker, log):
+        """
+        UDP ASSOCIATE : port UDP local annoncé à l'application, datagrammes
+        relayés par un flux du tunnel jusqu'à la fin de la connexion de contrôle.
+        """
+        if not udp_supported(self.config):
+            log.info("Association UDP refusée (udp.enabled: false ou en-tête legacy)")
+            self.client_sock.sendall(socks_reply(REPLY_COMMAND_NOT_SUPPORTED))
+            return None
+        association = UDPAssociation(
+            self.client_sock.getsockname()[0], self.client_sock.getpeername()[0], port, tracker
+        )
+        try:
+            self.client_sock.sendall(socks_reply(REPLY_SUCCEEDED, association.bind_address))
+            socks_negotiation_seconds.observe(time.monotonic() - start)
+            log.info(f"Association UDP ouverte sur {association.bind_address[0]}:{association.bind_address[1]}")
+            with self._open_tunnel() as tls_sock:
+                self._tunnel_sock = tls_sock
+                tls_sock.sendall(encode_udp_request())
+                counters = association.run(self.client_sock, tls_sock)
+            log.debug(f"Association UDP terminée : {counters.as_dict()}")
+            return counters
+        finally:
+            association.close()
+
+    def _early_data(self, pending: bytes) -> bytes:
+        """
+        Premiers octets de l'application à joindre à l'en-tête : ceux reçus
+        avec la demande, complétés de ceux déjà arrivés pendant l'ouverture du
+        tunnel. Si aucun n'est arrivé, attend au plus early_data_wait secondes.
+        """
+        if len(pending) >= EARLY_DATA_MAX:
+            return pending
+        wait = 0 if pending else self.config.early_data_wait
+        with selectors.DefaultSelector() as selector:
+            selector.register(self.client_sock, selectors.EVENT_READ)
+            if selector.select(wait):
+                pending += self.client_sock.recv(EARLY_DATA_MAX - len(pending))
+        return pending
+
+    def _abort(self):
+        # Appelé par le ramasseur (autre thread) : réveille les lectures bloquées
+        abort(self.client_sock)
+        if self._tunnel_sock is not None:
+            abort(self._tunnel_sock)
 
-        t1 = threading.Thread(target=pipe, args=(sock1, sock2, "client→tunnel[request]"), daemon=True)
-        t2 = threading.Thread(target=pipe, args=(sock2, sock1, "tunnel→client[response]"), daemon=True)
+    def _open_tunnel(self):
+        if self.mux is not None:
+            return self.mux.open_stream()
+        if self.pool is not None:
+            return self.pool.acquire()
+        return self.balancer.connect()
 
-        t1.start()
-        t2.start()
-        t1.join()
-        t2.join()
+    def _relay_policy(self) -> RelayPolicy:
+        return RelayPolicy(
+            min_size=self.config.relay_min_buffer,
+            initial_size=self.config.relay_initial_buffer,
+            max_size=self.config.relay_max_buffer,
+            adaptive=self.config.relay_adaptive,
+        )
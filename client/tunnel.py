@@ -1,12 +1,136 @@
-import socket
+import asyncio
 import ssl
+import threading
+import time
 from pathlib import Path
 import os
 
 from dotenv import load_dotenv
 
+from utils.admission import peer_identity
+from utils.aio_mux import AsyncMuxSession, AsyncMuxStream
+from utils.aio_streams import AsyncTLSStream
+from utils.mux import MUX_PREFACE, MuxSession, MuxStream
+from utils.logger import get_logger
+from utils.metrics import handshake_seconds, record_error
+from utils.sockopts import connect_tcp, fast_open_enabled, tune_socket
+from utils.stats import Stats
+from utils.tls import OP_IGNORE_UNEXPECTED_EOF, SSLContextCache, TLSPolicy, log_tls_session
+
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(dotenv_path=os.path.join(BASE_DIR, "config", ".env"))
+logger = get_logger("TUNNEL")
+
+HANDSHAKE_TIMEOUT = 10.0  # délai (s) par défaut de connexion et de handshake vers le serveur
+
+# Compteurs de reprise de session (session_resumption_hits / _misses)
+tls_stats = Stats("tls")
+
+# Contextes SSL partagés par le processus, indexés par (CA, certificat client)
+_CONTEXT_CACHES = {}
+_CONTEXT_CACHES_LOCK = threading.Lock()
+
+# Politique TLS des contextes construits ensuite (configure_tls_policy)
+_TLS_POLICY = TLSPolicy()
+
+
+def configure_tls_policy(policy: TLSPolicy):
+    """
+    Politique TLS (versions, AEAD, groupes...) des contextes SSL construits
+    ensuite. Appeler reload_ssl_contexts() pour l'appliquer aux contextes existants.
+    """
+    global _TLS_POLICY
+    _TLS_POLICY = policy
+
+
+def ssl_contexts_changed() -> bool:
+    """True si la CA ou un certificat client a changé sur disque."""
+    with _CONTEXT_CACHES_LOCK:
+        caches = list(_CONTEXT_CACHES.values())
+    return any(cache.changed() for cache in caches)
+
+
+def reload_ssl_contexts():
+    """
+    Reconstruit les contextes SSL partagés (rechargement explicite) : les
+    connexions suivantes utilisent les nouveaux certificats, les tunnels
+    établis gardent l'ancien contexte.
+    """
+    with _CONTEXT_CACHES_LOCK:
+        caches = list(_CONTEXT_CACHES.values())
+    for cache in caches:
+        cache.reload()
+
+
+def record_handshake(duration: float, resumed: bool):
+    """Comptabilise un handshake réussi (durée, reprise de session)."""
+    handshake_seconds.observe(duration)
+    if resumed:
+        tls_stats.incr("session_resumption_hits")
+    else:
+        tls_stats.incr("session_resumption_misses")
+
+
+class _SessionCache:
+    """
+    Dernière session TLS (ticket) reçue pour chaque serveur (host, port).
+
+    Une session n'est réutilisable qu'avec le contexte SSL qui l'a créée :
+    elle est ignorée après une reconstruction du contexte.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple, context: ssl.SSLContext):
+        with self._lock:
+            entry = self._sessions.get(key)
+        if entry is not None and entry[0] is context:
+            return entry[1]
+        return None
+
+    def put(self, key: tuple, context: ssl.SSLContext, session: ssl.SSLSession):
+        with self._lock:
+            self._sessions[key] = (context, session)
+
+
+_SESSIONS = _SessionCache()
+
+
+class _ResumableSSLSocket(ssl.SSLSocket):
+    """
+    SSLSocket qui mémorise son ticket de session à la fermeture.
+
+    En TLS 1.3 le ticket n'arrive qu'après le handshake, avec les premières
+    données lues : la fermeture est le moment où il est sûrement disponible.
+    """
+
+    _session_key = None
+
+    def close(self):
+        try:
+            session = self.session
+            if self._session_key and session is not None and session.has_ticket:
+                _SESSIONS.put(self._session_key, self.context, session)
+        except (OSError, ValueError):
+            pass
+        super().close()
+
+
+class _ResumableAsyncTLSStream(AsyncTLSStream):
+    """Équivalent de _ResumableSSLSocket pour le moteur asyncio."""
+
+    _session_key = None
+
+    def close(self):
+        try:
+            session = self.sslobj.session
+            if self._session_key and session is not None and session.has_ticket:
+                _SESSIONS.put(self._session_key, self.sslobj.context, session)
+        except (OSError, ValueError):
+            pass
+        super().close()
 
 class TLSClientTunnel:
     """
@@ -32,9 +156,25 @@ class TLSClientTunnel:
         context.load_cert_chain(certfile=self.client_cert)
         context.verify_mode = ssl.CERT_REQUIRED
         context.check_hostname = False  # facultatif si CN/IP pas vérifié
+        context.options |= OP_IGNORE_UNEXPECTED_EOF
+        _TLS_POLICY.apply(context)
+        context.sslsocket_class = _ResumableSSLSocket
         return context
 
-    def connect_raw(self, host: str, port: int):
+    def ssl_context(self) -> ssl.SSLContext:
+        """
+        Retourne le contexte SSL partagé, reconstruit seulement si la CA
+        ou le certificat client ont changé sur disque.
+        """
+        key = (self.ca_cert, self.client_cert)
+        with _CONTEXT_CACHES_LOCK:
+            cache = _CONTEXT_CACHES.get(key)
+            if cache is None:
+                cache = SSLContextCache(self._create_ssl_context, key)
+                _CONTEXT_CACHES[key] = cache
+        return cache.get()
+
+    def connect_raw(self, host: str, port: int, timeout: float = HANDSHAKE_TIMEOUT):
         """
         Établit un tunnel TLS vers le serveur (sans envoyer la cible).
         L'envoi de l'adresse cible se fait dans Socks5ProxyHandler.
@@ -42,13 +182,202 @@ class TLSClientTunnel:
         Args:
             host (str): Hôte du serveur TLS.
             port (int): Port du serveur TLS.
-            target_addr (tuple): Adresse cible à atteindre (via le proxy serveur).
+            timeout (float): Délai maximal (s) de connexion et de handshake.
 
         Returns:
             socket.socket: Connexion TLS prête à être utilisée.
         """
-        context = self._create_ssl_context()
-        raw_sock = socket.create_connection((host, port))
-        tls_sock = context.wrap_socket(raw_sock, server_hostname=host)
+        context = self.ssl_context()
+        session_key = (host, port)
+        session = _SESSIONS.get(session_key, context)
+
+        raw_sock = connect_tcp(host, port, timeout, "tunnel")
+        start = time.monotonic()
+        try:
+            tls_sock = context.wrap_socket(raw_sock, server_hostname=host, session=session)
+        except (ssl.SSLError, OSError) as e:
+            record_error("handshake", e)
+            raw_sock.close()
+            raise
+        tls_sock.settimeout(None)
+        tls_sock._session_key = session_key
+
+        record_handshake(time.monotonic() - start, tls_sock.session_reused)
+        log_tls_session("client", (host, port), tls_sock.version(), tls_sock.cipher(),
+                        tls_sock.session_reused, peer_identity(tls_sock.getpeercert()))
+        return tls_sock
+
+    async def connect_async(self, host: str, port: int, timeout: float = HANDSHAKE_TIMEOUT) -> AsyncTLSStream:
+        """
+        Équivalent asyncio de connect_raw : même contexte partagé et même
+        cache de sessions.
+
+        Returns:
+            AsyncTLSStream: Flux TLS prêt à être utilisé.
+        """
+        context = self.ssl_context()
+        session_key = (host, port)
+        session = _SESSIONS.get(session_key, context)
+
+        if fast_open_enabled():
+            # connect() rend la main sans attendre le réseau : seul getaddrinfo peut bloquer
+            loop = asyncio.get_running_loop()
+            raw_sock = await loop.run_in_executor(None, connect_tcp, host, port, timeout, "tunnel")
+            reader, writer = await asyncio.open_connection(sock=raw_sock)
+        else:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            tune_socket(writer.get_extra_info("socket"), "tunnel")
+        stream = _ResumableAsyncTLSStream(
+            reader, writer, context, server_side=False, server_hostname=host, session=session
+        )
+        start = time.monotonic()
+        try:
+            await stream.handshake(timeout)
+        except BaseException as e:
+            record_error("handshake", e)
+            stream.close()
+            raise
+        stream._session_key = session_key
+
+        sslobj = stream.sslobj
+        record_handshake(time.monotonic() - start, sslobj.session_reused)
+        log_tls_session("client", (host, port), sslobj.version(), sslobj.cipher(),
+                        sslobj.session_reused, peer_identity(sslobj.getpeercert()))
+        return stream
+
+
+def _usable(session) -> bool:
+    """Session multiplexée pouvant recevoir de nouveaux flux."""
+    return session is not None and not session.closed and not session.going_away
+
+
+class MuxTunnel:
+    """
+    Tunnel multiplexé : un petit nombre de connexions TLS persistantes
+    transportant tous les flux SOCKS5.
+
+    Les sessions mortes sont rétablies à la demande lors de l'ouverture
+    du flux suivant, chacune vers le serveur choisi par le répartiteur.
+
+    Attributes:
+        balancer (ServerBalancer): Choix du serveur de chaque connexion TLS.
+        connections (int): Nombre de connexions TLS persistantes.
+    """
+
+    def __init__(self, balancer, connections: int = 1):
+        self.balancer = balancer
+        self.connections = max(1, connections)
+        self._sessions = [None] * self.connections
+        self._lock = threading.Lock()
+        # Emplacements dont la session est en cours d'établissement (hors verrou)
+        self._connecting = set()
+        self._settled = threading.Condition(self._lock)
+
+    def _connect_session(self) -> MuxSession:
+        tls_sock = self.balancer.connect()
+        tls_sock.sendall(MUX_PREFACE)
+        host, port = tls_sock.getpeername()[:2]
+        logger.info(f"Session multiplexée établie vers {host}:{port}")
+        return MuxSession(tls_sock, is_client=True).start()
+
+    def _session(self) -> MuxSession:
+        with self._lock:
+            while True:
+                # Choisir la session vivante la moins chargée, sinon (re)connecter un emplacement libre
+                # (une session en GOAWAY termine ses flux en cours mais n'en reçoit plus)
+                alive = [(s.stream_count, i) for i, s in enumerate(self._sessions) if _usable(s)]
+                free = [i for i, s in enumerate(self._sessions) if not _usable(s) and i not in self._connecting]
+                if free and (not alive or min(alive)[0] > 0):
+                    index = free[0]
+                    self._connecting.add(index)
+                    break
+                if alive:
+                    return self._sessions[min(alive)[1]]
+                # Aucune session utilisable : attendre celles en cours d'établissement
+                self._settled.wait()
+
+        # Connexion et handshake hors du verrou : les autres flux continuent
+        # d'utiliser les sessions déjà établies
+        session = None
+        try:
+            session = self._connect_session()
+            return session
+        finally:
+            with self._lock:
+                self._connecting.discard(index)
+                if session is not None:
+                    self._sessions[index] = session
+                self._settled.notify_all()
+
+    def open_stream(self) -> MuxStream:
+        """
+        Ouvre un nouveau flux multiplexé, utilisable comme un socket TLS
+        retourné par TLSClientTunnel.connect_raw.
+        """
+        try:
+            return self._session().open_stream()
+        except ConnectionError:
+            # La session choisie vient de tomber : une seule nouvelle tentative
+            return self._session().open_stream()
+
+
+class AsyncMuxTunnel:
+    """
+    Équivalent asyncio de MuxTunnel, pour le moteur asyncio du client.
+
+    Attributes:
+        balancer (ServerBalancer): Choix du serveur de chaque connexion TLS.
+        connections (int): Nombre de connexions TLS persistantes.
+    """
+
+    def __init__(self, balancer, connections: int = 1):
+        self.balancer = balancer
+        self.connections = max(1, connections)
+        self._sessions = [None] * self.connections
+        self._connecting = set()
+        # Remplacé à chaque fin d'établissement : réveille les ouvertures en attente
+        self._settled = asyncio.Event()
+        self._tasks = set()
+
+    async def _connect_session(self) -> AsyncMuxSession:
+        stream = await self.balancer.connect_async()
+        await stream.write(MUX_PREFACE)
+        host, port = stream.writer.get_extra_info("peername")[:2]
+        logger.info(f"Session multiplexée établie vers {host}:{port}")
+        session = AsyncMuxSession(stream, is_client=True)
+        task = asyncio.ensure_future(session.run())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return session
+
+    async def _session(self) -> AsyncMuxSession:
+        # Même principe que MuxTunnel._session : l'établissement d'une session
+        # ne bloque pas les ouvertures de flux sur les sessions existantes. Le
+        # choix se fait sans await : pas de verrou nécessaire dans la boucle.
+        while True:
+            alive = [(s.stream_count, i) for i, s in enumerate(self._sessions) if _usable(s)]
+            free = [i for i, s in enumerate(self._sessions) if not _usable(s) and i not in self._connecting]
+            if free and (not alive or min(alive)[0] > 0):
+                index = free[0]
+                self._connecting.add(index)
+                break
+            if alive:
+                return self._sessions[min(alive)[1]]
+            await self._settled.wait()
+
+        session = None
+        try:
+            session = await self._connect_session()
+            return session
+        finally:
+            self._connecting.discard(index)
+            if session is not None:
+                self._sessions[index] = session
+            self._settled.set()
+            self._settled = asyncio.Event()
 
-        return tls_sock
\ No newline at end of file
+    async def open_stream(self) -> AsyncMuxStream:
+        try:
+            return (await self._session()).open_stream()
+        except ConnectionError:
+            return (await self._session()).open_stream()
@@ -0,0 +1,196 @@
+import asyncio
+import threading
+
+from config import ClientConfig
+from utils.logger import get_logger
+from utils.metrics import record_error
+from utils.relay import RelayCounters, abort
+from utils.udp import (
+    AsyncFrameSender,
+    DatagramReader,
+    encode_socks_udp,
+    open_udp_socket,
+    record_datagram,
+    record_drop,
+    socks_to_frame,
+    udp_stats,
+)
+
+logger = get_logger("UDP")
+
+READ_SIZE = 64 * 1024
+
+
+def udp_supported(config: ClientConfig) -> bool:
+    """UDP ASSOCIATE accepté : activé, et serveur capable de l'en-tête binaire (FLAG_UDP)."""
+    return config.udp_enabled and config.tunnel_header != "legacy"
+
+
+class UDPAssociation:
+    """
+    Association SOCKS5 UDP côté client (RFC 1928 §7) : un port UDP local
+    reçoit les datagrammes de l'application et les transmet en trames dans
+    un flux du tunnel ; les réponses reviennent par ce même flux.
+
+    Seul l'hôte de la connexion de contrôle peut utiliser l'association : la
+    première source valide est retenue, les datagrammes d'autres sources sont
+    abandonnés. L'association dure autant que la connexion TCP de contrôle.
+
+    Attributes:
+        udp (DatagramSocket): Port UDP annoncé à l'application (BND.ADDR / BND.PORT).
+        client_host (str): IP de l'application (celle de la connexion de contrôle).
+        client_port (int): Port source annoncé par l'application (0 : inconnu).
+        tracker (TrackedConnection): Suivi d'activité du ramasseur, ou None.
+        counters (RelayCounters): Datagrammes et octets par sens.
+    """
+
+    def __init__(self, bind_host: str, client_host: str, client_port: int = 0, tracker=None):
+        self.udp = open_udp_socket(bind_host)
+        self.client_host = client_host
+        self.client_port = client_port
+        self.tracker = tracker
+        self.counters = RelayCounters()
+        self._client = None
+        self._closing = False
+
+    @property
+    def bind_address(self) -> tuple:
+        return self.udp.getsockname()[:2]
+
+    def close(self):
+        self.udp.close()
+
+    def _accept_source(self, addr: tuple) -> bool:
+        addr = addr[:2]
+        if self._client is None:
+            if addr[0] == self.client_host and self.client_port in (0, addr[1]):
+                self._client = addr
+                return True
+        elif addr == self._client:
+            return True
+        record_drop("foreign_source")
+        return False
+
+    def _touch(self):
+        if self.tracker is not None:
+            self.tracker.touch()
+
+    def _frame(self, data: bytes, addr: tuple):
+        """Trame du tunnel pour un datagramme de l'application, ou None (abandonné)."""
+        if not self._accept_source(addr):
+            return None
+        return socks_to_frame(data)
+
+    def _deliver(self, host: str, port: int, payload: bytes):
+        if self._client is None:
+            record_drop("unsolicited")
+            return
+        if self.udp.sendto(encode_socks_udp(host, port, payload), self._client):
+            record_datagram(self.counters.downstream, len(payload))
+
+    # === Moteur à threads ===
+
+    def run(self, control, tunnel) -> RelayCounters:
+        """
+        Relaie jusqu'à la fermeture de la connexion de contrôle `control` ou
+        du flux `tunnel` ; retourne les compteurs de l'association.
+        """
+        udp_stats.incr("associations")
+        threads = [
+            threading.Thread(target=self._upstream, args=(control, tunnel), name="udp-upstream", daemon=True),
+            threading.Thread(target=self._downstream, args=(control, tunnel), name="udp-downstream", daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            # La connexion de contrôle ne transporte plus rien : on attend sa fin
+            while control.recv(4096):
+                pass
+        finally:
+            # Les erreurs des threads réveillés par abort() ne sont pas comptées
+            self._closing = True
+            self.udp.abort()
+            abort(tunnel)
+            for thread in threads:
+                thread.join()
+            self.udp.close()
+        return self.counters
+
+    def _upstream(self, control, tunnel):
+        try:
+            while True:
+                batch = self.udp.recv_batch()
+                if not batch:
+                    return  # socket interrompu par abort()
+                frames = [frame for frame in (self._frame(data, addr) for data, addr in batch) if frame]
+                if not frames:
+                    continue
+                self._touch()
+                # Datagrammes déjà arrivés : une seule écriture dans le tunnel
+                tunnel.sendall(b"".join(frame for frame, _ in frames))
+                for _, size in frames:
+                    record_datagram(self.counters.upstream, size)
+        except OSError as e:
+            if not self._closing:
+                record_error("udp", e)
+        finally:
+            abort(control)
+
+    def _downstream(self, control, tunnel):
+        reader = DatagramReader()
+        try:
+            while True:
+                data = tunnel.recv(READ_SIZE)
+                if not data:
+                    return
+                for host, port, payload in reader.feed(data):
+                    self._touch()
+                    self._deliver(host, port, payload)
+        except (OSError, ValueError) as e:
+            if not self._closing:
+                record_error("udp", e)
+        finally:
+            abort(control)
+
+    # === Moteur asyncio ===
+
+    async def run_async(self, control, tunnel) -> RelayCounters:
+        """Équivalent asyncio de run() (`control` et `tunnel` : flux asyncio)."""
+        udp_stats.incr("associations")
+        sender = AsyncFrameSender(tunnel, self.counters.upstream)
+        self.udp.add_reader(lambda data, addr: self._on_datagram(sender, data, addr))
+        tasks = [
+            asyncio.ensure_future(sender.run()),
+            asyncio.ensure_future(self._downstream_async(tunnel)),
+            asyncio.ensure_future(self._watch_control(control)),
+        ]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.udp.close()
+        for task in done:
+            if task.exception() is not None:
+                record_error("udp", task.exception())
+        return self.counters
+
+    def _on_datagram(self, sender: AsyncFrameSender, data: bytes, addr: tuple):
+        result = self._frame(data, addr)
+        if result is not None:
+            self._touch()
+            sender.submit(*result)
+
+    async def _downstream_async(self, tunnel):
+        reader = DatagramReader()
+        while True:
+            data = await tunnel.read(READ_SIZE)
+            if not data:
+                return
+            for host, port, payload in reader.feed(data):
+                self._touch()
+                self._deliver(host, port, payload)
+
+    async def _watch_control(self, control):
+        while await control.read(4096):
+            pass
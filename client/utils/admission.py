@@ -0,0 +1,148 @@
+import threading
+
+from utils.metrics import registry
+from utils.stats import Stats
+
+# Décisions d'admission : admitted, rejected_connections (limite globale),
+# rejected_identity (limite par certificat), rejected_handshakes (file pleine),
+# rejected_draining (arrêt progressif en cours)
+admission_stats = Stats("admission")
+
+admission_active = registry.gauge("admission_active_connections", "Connexions admises en cours")
+admission_pending_handshakes = registry.gauge("admission_pending_handshakes", "Handshakes TLS en attente ou en cours")
+
+
+def peer_identity(cert: dict) -> str:
+    """Identité d'un client : CN de son certificat (getpeercert())."""
+    for rdn in (cert or {}).get("subject", ()):
+        for key, value in rdn:
+            if key == "commonName":
+                return value
+    return None
+
+
+class AdmissionControl:
+    """
+    Limites de concurrence : au-delà, les nouvelles connexions sont refusées
+    immédiatement au lieu d'ajouter des threads et des sockets sans borne.
+
+    Un refus ne coûte qu'une fermeture (ou une réponse d'erreur) : sous
+    surcharge, la mémoire et le nombre de threads restent bornés.
+    Les méthodes ne bloquent jamais (utilisables depuis une boucle asyncio).
+
+    Attributes:
+        max_connections (int): Connexions admises simultanément (0 : illimité).
+        max_per_identity (int): Connexions simultanées par certificat client (0 : illimité).
+        max_pending_handshakes (int): Handshakes TLS en attente ou en cours (0 : illimité).
+        closed (bool): Arrêt progressif : plus aucune nouvelle connexion n'est admise.
+    """
+
+    def __init__(self, max_connections: int = 0, max_per_identity: int = 0, max_pending_handshakes: int = 0):
+        self.max_connections = max_connections
+        self.max_per_identity = max_per_identity
+        self.max_pending_handshakes = max_pending_handshakes
+        self._lock = threading.Lock()
+        self._active = 0
+        self._pending = 0
+        self._by_identity = {}
+        self._sessions = set()
+        self.closed = False
+
+    @property
+    def active(self) -> int:
+        """Connexions admises, handshakes en attente et sessions multiplexées ouvertes."""
+        return self._active + self._pending + len(self._sessions)
+
+    def configure(self, max_connections: int, max_per_identity: int = 0, max_pending_handshakes: int = 0):
+        """Nouvelles limites (rechargement) : les connexions déjà admises ne sont pas remises en cause."""
+        with self._lock:
+            self.max_connections = max_connections
+            self.max_per_identity = max_per_identity
+            self.max_pending_handshakes = max_pending_handshakes
+
+    def close(self):
+        """
+        Refuse désormais les nouvelles connexions (try_handshake) : arrêt
+        progressif. Les connexions en cours continuent, handshakes en cours
+        compris ; les sessions multiplexées reçoivent un GOAWAY.
+        """
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            sessions = list(self._sessions)
+        for session in sessions:
+            session.goaway()
+
+    def open_session(self, session):
+        """
+        Suit une session multiplexée jusqu'à close_session() : pendant un
+        arrêt progressif, elle reste comptée dans `active` tant que le client
+        ne l'a pas fermée (des ouvertures de flux peuvent croiser le GOAWAY).
+        """
+        with self._lock:
+            self._sessions.add(session)
+            closed = self.closed
+        if closed:
+            session.goaway()
+
+    def close_session(self, session):
+        with self._lock:
+            self._sessions.discard(session)
+
+    def try_handshake(self) -> bool:
+        """
+        Réserve une place pour le handshake d'une connexion tout juste acceptée.
+        Refusée si la file de handshakes est pleine ou si le serveur est déjà
+        à sa limite de connexions (inutile alors de payer le handshake).
+        """
+        with self._lock:
+            if self.closed:
+                reason = "rejected_draining"
+            elif self.max_connections and self._active >= self.max_connections:
+                reason = "rejected_connections"
+            elif self.max_pending_handshakes and self._pending >= self.max_pending_handshakes:
+                reason = "rejected_handshakes"
+            else:
+                self._pending += 1
+                reason = None
+        if reason:
+            admission_stats.incr(reason)
+            return False
+        admission_pending_handshakes.inc()
+        return True
+
+    def handshake_done(self):
+        """Libère la place réservée par try_handshake (handshake réussi ou non)."""
+        with self._lock:
+            self._pending -= 1
+        admission_pending_handshakes.dec()
+
+    def try_acquire(self, identity: str = None) -> bool:
+        """Admet une connexion (de `identity`) si les limites le permettent ; à libérer par release()."""
+        with self._lock:
+            count = self._by_identity.get(identity, 0)
+            if self.max_connections and self._active >= self.max_connections:
+                reason = "rejected_connections"
+            elif self.max_per_identity and identity is not None and count >= self.max_per_identity:
+                reason = "rejected_identity"
+            else:
+                self._active += 1
+                self._by_identity[identity] = count + 1
+                reason = None
+        if reason:
+            admission_stats.incr(reason)
+            return False
+        admission_stats.incr("admitted")
+        admission_active.inc()
+        return True
+
+    def release(self, identity: str = None):
+        with self._lock:
+            self._active -= 1
+            count = self._by_identity.get(identity, 0) - 1
+            if count > 0:
+                self._by_identity[identity] = count
+            else:
+                self._by_identity.pop(identity, None)
+        admission_active.dec()
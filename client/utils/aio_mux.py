@@ -0,0 +1,247 @@
+import asyncio
+from collections import deque
+
+from utils.mux import (
+    DEFAULT_WINDOW,
+    FRAME_DATA,
+    FRAME_FIN,
+    FRAME_GOAWAY,
+    FRAME_HEADER,
+    FRAME_OPEN,
+    FRAME_RST,
+    FRAME_WINDOW,
+    MAX_FRAME_PAYLOAD,
+    WINDOW_INCREMENT,
+    parse_window,
+)
+from utils.aio_streams import READ_SIZE
+
+
+class AsyncMuxStream:
+    """
+    Équivalent asyncio de MuxStream : même protocole de trames, même contrôle
+    de flux, interface commune read / write / write_eof / close.
+    """
+
+    def __init__(self, session: "AsyncMuxSession", stream_id: int, window: int):
+        self.session = session
+        self.stream_id = stream_id
+        self._recv_buf = deque()
+        self._recv_eof = False
+        self._reset = False
+        self._fin_sent = False
+        self._closed = False
+        self._send_window = window
+        self._window = window
+        self._unacked = 0
+        self._recv_credit = window
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    async def read(self, n: int = READ_SIZE) -> bytes:
+        while not self._recv_buf and not self._recv_eof and not self._reset:
+            self._readable.clear()
+            await self._readable.wait()
+        if not self._recv_buf:
+            if self._reset and not self._recv_eof:
+                raise ConnectionResetError("Flux réinitialisé par le pair")
+            return b""
+        chunk = self._recv_buf.popleft()
+        if len(chunk) > n:
+            self._recv_buf.appendleft(chunk[n:])
+            chunk = chunk[:n]
+        self._unacked += len(chunk)
+        if self._unacked >= self._window // 2:
+            self.session._send_frame(FRAME_WINDOW, self.stream_id, WINDOW_INCREMENT.pack(self._unacked))
+            self._recv_credit += self._unacked
+            self._unacked = 0
+        return chunk
+
+    async def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            while self._send_window <= 0 and not self._reset:
+                self._writable.clear()
+                await self._writable.wait()
+            if self._reset or self._fin_sent:
+                raise BrokenPipeError("Flux fermé")
+            size = min(len(view), self._send_window, MAX_FRAME_PAYLOAD)
+            self._send_window -= size
+            self.session._send_frame(FRAME_DATA, self.stream_id, view[:size])
+            view = view[size:]
+            await self.session.drain()
+
+    def write_eof(self):
+        if self._fin_sent or self._reset:
+            return
+        self._fin_sent = True
+        self.session._send_frame(FRAME_FIN, self.stream_id)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        abort = not self._reset and not (self._fin_sent and self._recv_eof)
+        self._on_reset()
+        if abort:
+            self.session._send_frame(FRAME_RST, self.stream_id)
+        self.session._forget(self.stream_id)
+
+    def _on_data(self, payload: bytes) -> bool:
+        """Retourne False si le pair dépasse la fenêtre accordée (voir MuxStream)."""
+        self._recv_credit -= len(payload)
+        if self._recv_credit < 0:
+            return False
+        if not self._closed:
+            self._recv_buf.append(payload)
+            self._readable.set()
+        return True
+
+    def _on_fin(self):
+        self._recv_eof = True
+        self._readable.set()
+
+    def _on_reset(self):
+        self._reset = True
+        self._readable.set()
+        self._writable.set()
+
+    def _on_window(self, increment: int):
+        self._send_window += increment
+        self._writable.set()
+
+
+class AsyncMuxSession:
+    """
+    Session multiplexée asyncio, compatible trame à trame avec MuxSession.
+
+    Attributes:
+        stream: Flux TLS sous-jacent (AsyncTLSStream).
+        is_client (bool): True côté client (ouvre les flux), False côté serveur.
+        on_open (callable): Coroutine appelée avec chaque flux ouvert par le pair.
+        going_away (bool): Le serveur a annoncé son arrêt (GOAWAY) : ne plus ouvrir de flux.
+    """
+
+    def __init__(self, stream, is_client: bool, on_open=None, window: int = DEFAULT_WINDOW):
+        self.stream = stream
+        self.is_client = is_client
+        self.on_open = on_open
+        self.window = window
+        self.closed = False
+        self.going_away = False
+        self._streams = {}
+        self._next_id = 1 if is_client else 2
+        self._tasks = set()
+
+    @property
+    def stream_count(self) -> int:
+        return len(self._streams)
+
+    def open_stream(self) -> AsyncMuxStream:
+        if self.closed or self.going_away:
+            raise ConnectionError("Session multiplexée fermée")
+        stream_id = self._next_id
+        self._next_id += 2
+        stream = AsyncMuxStream(self, stream_id, self.window)
+        self._streams[stream_id] = stream
+        self._send_frame(FRAME_OPEN, stream_id)
+        return stream
+
+    def _send_frame(self, frame_type: int, stream_id: int, payload=b""):
+        if self.closed:
+            raise BrokenPipeError("Session multiplexée fermée")
+        # Écriture synchrone dans le tampon du transport ; la pression est
+        # appliquée par drain() côté flux.
+        self.stream.sslobj.write(FRAME_HEADER.pack(frame_type, stream_id, len(payload)) + bytes(payload))
+        self.stream._flush()
+
+    async def drain(self):
+        await self.stream.writer.drain()
+
+    def _forget(self, stream_id: int):
+        self._streams.pop(stream_id, None)
+        # Client : session en GOAWAY fermée après son dernier flux (voir MuxSession)
+        if self.going_away and self.is_client and not self._streams:
+            self.close()
+
+    def goaway(self):
+        """Côté serveur : annonce un arrêt progressif (voir MuxSession.goaway)."""
+        self.going_away = True
+        try:
+            self._send_frame(FRAME_GOAWAY, 0)
+        except OSError:
+            pass
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        for stream in list(self._streams.values()):
+            stream._on_reset()
+        self._streams.clear()
+        self.stream.close()
+
+    async def run(self, initial: bytes = b""):
+        """
+        Lit et distribue les trames jusqu'à la fermeture de la connexion.
+
+        Args:
+            initial (bytes): Octets déjà lus après le préambule.
+        """
+        buf = bytearray(initial)
+        try:
+            while True:
+                offset = 0
+                while len(buf) - offset >= FRAME_HEADER.size:
+                    frame_type, stream_id, length = FRAME_HEADER.unpack_from(buf, offset)
+                    end = offset + FRAME_HEADER.size + length
+                    if len(buf) < end:
+                        break
+                    self._dispatch(frame_type, stream_id, bytes(buf[offset + FRAME_HEADER.size:end]))
+                    offset = end
+                del buf[:offset]
+                data = await self.stream.read(READ_SIZE)
+                if not data:
+                    break
+                buf += data
+        except (OSError, ValueError):
+            pass
+        finally:
+            self.close()
+
+    def _dispatch(self, frame_type: int, stream_id: int, payload: bytes):
+        if frame_type == FRAME_OPEN:
+            if self.is_client or self.on_open is None:
+                return
+            # Même contrôle que MuxSession._check_open : sinon la session est fermée
+            if stream_id % 2 == self._next_id % 2 or stream_id in self._streams:
+                raise ValueError(f"Ouverture de flux invalide : {stream_id}")
+            stream = AsyncMuxStream(self, stream_id, self.window)
+            self._streams[stream_id] = stream
+            task = asyncio.ensure_future(self.on_open(stream))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return
+        if frame_type == FRAME_GOAWAY:
+            self.going_away = True
+            if self.is_client and not self._streams:
+                self.close()
+            return
+
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return
+        if frame_type == FRAME_DATA:
+            if not stream._on_data(payload):
+                # Fenêtre dépassée : le flux est abandonné des deux côtés
+                stream._on_reset()
+                self._forget(stream_id)
+                self._send_frame(FRAME_RST, stream_id)
+        elif frame_type == FRAME_WINDOW:
+            stream._on_window(parse_window(payload))
+        elif frame_type == FRAME_FIN:
+            stream._on_fin()
+        elif frame_type == FRAME_RST:
+            stream._on_reset()
+            self._forget(stream_id)
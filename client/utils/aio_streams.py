@@ -0,0 +1,192 @@
+import asyncio
+import ssl
+
+from utils.metrics import bytes_total, connections_active, connections_total, record_error
+from utils.relay import DirectionCounters, RelayCounters, relay_stats
+
+try:
+    import uvloop
+except ImportError:  # uvloop est optionnel
+    uvloop = None
+
+READ_SIZE = 64 * 1024
+
+
+def run_event_loop(main):
+    """Exécute la coroutine `main` sur uvloop s'il est installé, sinon sur asyncio."""
+    if uvloop is not None:
+        return uvloop.run(main)
+    return asyncio.run(main)
+
+
+class AsyncTCPStream:
+    """
+    Flux TCP asyncio exposant l'interface commune read / write / write_eof / close.
+
+    Attributes:
+        reader (asyncio.StreamReader): Lecture.
+        writer (asyncio.StreamWriter): Écriture.
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    async def read(self, n: int = READ_SIZE) -> bytes:
+        return await self.reader.read(n)
+
+    async def write(self, data: bytes):
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def write_eof(self):
+        if self.writer.can_write_eof():
+            self.writer.write_eof()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncTLSStream(AsyncTCPStream):
+    """
+    Flux TLS asyncio basé sur ssl.SSLObject et des MemoryBIO.
+
+    Contrairement au transport SSL d'asyncio, il permet une demi-fermeture TCP
+    (write_eof) après l'envoi des données chiffrées : c'est le comportement
+    de utils.relay.shutdown_write() du moteur à threads, le protocole sur le
+    réseau est donc identique.
+
+    Attributes:
+        sslobj (ssl.SSLObject): État TLS de la connexion.
+    """
+
+    def __init__(self, reader, writer, context: ssl.SSLContext, server_side: bool,
+                 server_hostname: str = None, session: ssl.SSLSession = None):
+        super().__init__(reader, writer)
+        self._incoming = ssl.MemoryBIO()
+        self._outgoing = ssl.MemoryBIO()
+        self.sslobj = context.wrap_bio(
+            self._incoming,
+            self._outgoing,
+            server_side=server_side,
+            server_hostname=server_hostname,
+            session=session,
+        )
+
+    def _flush(self):
+        data = self._outgoing.read()
+        if data:
+            self.writer.write(data)
+
+    async def _fill(self) -> bool:
+        data = await self.reader.read(READ_SIZE)
+        if not data:
+            self._incoming.write_eof()
+            return False
+        self._incoming.write(data)
+        return True
+
+    async def handshake(self, timeout: float = None):
+        async def _handshake():
+            while True:
+                try:
+                    self.sslobj.do_handshake()
+                    break
+                except ssl.SSLWantReadError:
+                    self._flush()
+                    await self.writer.drain()
+                    if not await self._fill():
+                        raise ConnectionResetError("Connexion fermée pendant le handshake")
+            self._flush()
+            await self.writer.drain()
+
+        await asyncio.wait_for(_handshake(), timeout)
+
+    async def read(self, n: int = READ_SIZE) -> bytes:
+        while True:
+            try:
+                data = self.sslobj.read(n)
+                # Messages post-handshake (tickets, key update) éventuels
+                self._flush()
+                return data
+            except ssl.SSLWantReadError:
+                self._flush()
+                if not await self._fill():
+                    try:
+                        return self.sslobj.read(n)
+                    except (ssl.SSLWantReadError, ssl.SSLEOFError, ssl.SSLZeroReturnError):
+                        # Fin TCP sans close_notify : même tolérance que suppress_ragged_eofs
+                        return b""
+            except ssl.SSLZeroReturnError:
+                return b""
+
+    async def write(self, data: bytes):
+        self.sslobj.write(data)
+        self._flush()
+        await self.writer.drain()
+
+    def write_eof(self):
+        self._flush()
+        super().write_eof()
+
+
+async def _pipe(src, dst, counters: DirectionCounters, tracker=None, throttle=None):
+    metric = bytes_total.labels(counters.direction)
+    touch = tracker.touch if tracker is not None else None
+    try:
+        while True:
+            data = await src.read(READ_SIZE)
+            counters.recv_calls += 1
+            if not data:
+                break
+            if touch is not None:
+                touch()
+            if throttle is not None:
+                delay = throttle.consume(len(data))
+                if delay:
+                    await asyncio.sleep(delay)
+            await dst.write(data)
+            counters.send_calls += 1
+            counters.bytes += len(data)
+            metric.inc(len(data))
+    except Exception as e:
+        record_error("relay", e)
+    finally:
+        if tracker is not None:
+            tracker.half_close()
+        try:
+            dst.write_eof()
+        except Exception:
+            pass
+
+
+async def relay(stream1, stream2, tracker=None, limiter=None) -> RelayCounters:
+    """
+    Relais bidirectionnel entre deux flux, avec demi-fermeture propagée.
+    stream1 est toujours le côté client (sens "upstream" : stream1 → stream2).
+    `tracker` : suivi d'activité du ramasseur (utils.reaper), ou None.
+    `limiter` : usage et limites de débit de l'identité (utils.ratelimit), ou None.
+
+    Returns:
+        RelayCounters: Compteurs de la connexion (comme utils.relay.relay).
+    """
+    counters = RelayCounters()
+    up, down = (limiter.upstream, limiter.downstream) if limiter is not None else (None, None)
+    connections_active.inc()
+    connections_total.inc()
+    try:
+        await asyncio.gather(
+            _pipe(stream1, stream2, counters.upstream, tracker, up),
+            _pipe(stream2, stream1, counters.downstream, tracker, down),
+        )
+    finally:
+        connections_active.dec()
+        for stream in (stream1, stream2):
+            try:
+                stream.close()
+            except Exception:
+                pass
+    for key, value in counters.as_dict().items():
+        relay_stats.incr(key, value)
+    relay_stats.incr("connections")
+    return counters
@@ -1,7 +1,8 @@
 from cryptography import x509
 from cryptography.x509.oid import NameOID
 from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from cryptography.hazmat.primitives.asymmetric.types import CertificateIssuerPrivateKeyTypes
 from cryptography.hazmat.backends import default_backend
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -12,39 +13,68 @@ from dotenv import load_dotenv
 BASE_DIR = Path(__file__).resolve().parent.parent
 load_dotenv(dotenv_path=os.path.join(BASE_DIR, "config", ".env"))
 
+# Profils de clé : ECDSA et Ed25519 signent bien plus vite que RSA, ce qui
+# réduit le coût CPU de chaque handshake complet (bench/handshake.py)
+KEY_PROFILES = ("ecdsa-p256", "ecdsa-p384", "ed25519", "rsa")
+DEFAULT_KEY_PROFILE = "ecdsa-p256"
+
+_CURVES = {"ecdsa-p256": ec.SECP256R1, "ecdsa-p384": ec.SECP384R1}
+
+
 class CertificateManager:
     """
     Gère la génération de l'autorité de certification (CA),
-    ainsi que les certificats serveur et client, avec RSA 4096 bits.
+    ainsi que les certificats serveur et client.
+
+    Attributes:
+        certs_dir (Path): Répertoire des certificats (CERTS_DIR, absolu ou relatif au projet).
+        profile (str): Profil de clé (CERT_KEY_PROFILE, voir KEY_PROFILES).
+        key_size (int): Taille des clés RSA générées (profil "rsa").
     """
 
-    def __init__(self):
-        self.certs_dir = os.path.join(BASE_DIR, os.getenv("CERTS_DIR"))
+    def __init__(self, key_size: int = 4096, profile: str = None):
+        self.certs_dir = Path(BASE_DIR, os.getenv("CERTS_DIR"))
         self.ca_cert_path = os.path.join(self.certs_dir, os.getenv("CA_CERT_NAME", "ca.pem"))
         # self.server_cert_path = self.certs_dir / os.getenv("SERVER_CERT_NAME", "server.pem")
         self.client_cert_path = os.path.join(self.certs_dir, os.getenv("CLIENT_CERT_NAME", "client.pem"))
-        self.key_size = 4096
+        self.profile = profile or os.getenv("CERT_KEY_PROFILE", DEFAULT_KEY_PROFILE)
+        if self.profile not in KEY_PROFILES:
+            raise ValueError(f"Profil de clé inconnu : {self.profile} (attendu : {', '.join(KEY_PROFILES)})")
+        self.key_size = key_size
         self.validity_days = 365
 
         self.certs_dir.mkdir(parents=True, exist_ok=True)
 
-    def generate_key(self) -> rsa.RSAPrivateKey:
-        """Génère une clé privée RSA."""
+    def generate_key(self) -> CertificateIssuerPrivateKeyTypes:
+        """Génère une clé privée selon le profil choisi."""
+        if self.profile == "ed25519":
+            return ed25519.Ed25519PrivateKey.generate()
+        if self.profile in _CURVES:
+            return ec.generate_private_key(_CURVES[self.profile]())
         return rsa.generate_private_key(public_exponent=65537, key_size=self.key_size)
 
-    def save_pem(self, cert: x509.Certificate, key: rsa.RSAPrivateKey, path: Path):
+    @staticmethod
+    def signature_hash(key: CertificateIssuerPrivateKeyTypes):
+        """Condensat utilisé pour signer avec `key` (aucun pour Ed25519, qui l'impose)."""
+        if isinstance(key, ed25519.Ed25519PrivateKey):
+            return None
+        if isinstance(key, ec.EllipticCurvePrivateKey) and key.curve.key_size >= 384:
+            return hashes.SHA384()
+        return hashes.SHA256()
+
+    def save_pem(self, cert: x509.Certificate, key: CertificateIssuerPrivateKeyTypes, path: Path):
         """Enregistre le certificat et sa clé dans un seul fichier PEM."""
         with open(path, "wb") as f:
             f.write(cert.public_bytes(serialization.Encoding.PEM))
             f.write(
                 key.private_bytes(
                     encoding=serialization.Encoding.PEM,
-                    format=serialization.PrivateFormat.TraditionalOpenSSL,
+                    format=serialization.PrivateFormat.PKCS8,  # seul format commun à RSA, ECDSA et Ed25519
                     encryption_algorithm=serialization.NoEncryption()
                 )
             )
 
-    def create_ca(self) -> tuple[x509.Certificate, rsa.RSAPrivateKey]:
+    def create_ca(self) -> tuple[x509.Certificate, CertificateIssuerPrivateKeyTypes]:
         """Crée un certificat d'autorité racine (CA) avec SubjectKeyIdentifier et KeyUsage."""
         ca_key = self.generate_key()
         subject = issuer = x509.Name([
@@ -82,13 +112,21 @@ class CertificateManager:
             ), critical=True
         )
 
-        cert = cert_builder.sign(ca_key, hashes.SHA256())
+        cert = cert_builder.sign(ca_key, self.signature_hash(ca_key))
 
         self.save_pem(cert, ca_key, self.ca_cert_path)
         return cert, ca_key
 
+    def load_or_create_ca(self) -> tuple[x509.Certificate, CertificateIssuerPrivateKeyTypes]:
+        """Charge la CA existante (certificat et clé dans le même PEM), ou en crée une."""
+        if not os.path.exists(self.ca_cert_path):
+            return self.create_ca()
+        with open(self.ca_cert_path, "rb") as f:
+            data = f.read()
+        return x509.load_pem_x509_certificate(data), serialization.load_pem_private_key(data, password=None)
+
     def create_signed_cert(self, common_name: str, ca_cert: x509.Certificate,
-                           ca_key: rsa.RSAPrivateKey, output_path: Path):
+                           ca_key: CertificateIssuerPrivateKeyTypes, output_path: Path):
         """Crée un certificat signé par la CA avec CN donné et avec l'extension AKI (Authority Key Identifier)."""
         key = self.generate_key()
         subject = x509.Name([
@@ -114,13 +152,13 @@ class CertificateManager:
             x509.AuthorityKeyIdentifier.from_issuer_public_key(ca_key.public_key()), critical=False
         )
 
-        cert = cert_builder.sign(ca_key, hashes.SHA256())
+        cert = cert_builder.sign(ca_key, self.signature_hash(ca_key))
 
         self.save_pem(cert, key, output_path)
 
     def generate_all(self):
         """Génère la CA, le certificat serveur et client."""
-        #ca_cert, ca_key = self.create_ca()
+        ca_cert, ca_key = self.load_or_create_ca()
         #self.create_signed_cert("ShadowLAN Proxy Server", ca_cert, ca_key, self.server_cert_path)
         self.create_signed_cert("ShadownLAN Proxy Client", ca_cert, ca_key, self.client_cert_path)
         print("[Certs] Certificat client a été généré avec succès.")
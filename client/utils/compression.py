@@ -0,0 +1,399 @@
+import socket
+import struct
+import time
+import zlib
+
+from utils.metrics import registry
+from utils.relay import abort, shutdown_write
+from utils.stats import Stats
+
+try:
+    import zstandard
+except ImportError:  # zstandard est optionnel
+    zstandard = None
+
+# Compression par flux à l'intérieur du tunnel, négociée dans l'en-tête
+# d'ouverture (utils.protocol, FLAG_COMPRESSION) :
+#
+#   1. le client annonce les algorithmes qu'il sait décoder (masque CODEC_*) ;
+#   2. le serveur répond par une trame HELLO : les algorithmes retenus ;
+#   3. dans chaque sens, les données circulent en trames indiquant leur
+#      algorithme : chaque côté compresse avec le meilleur algorithme retenu,
+#      ou envoie la trame telle quelle (petits paquets, données incompressibles).
+#
+# Avant la trame HELLO, le client n'utilise que zlib (toujours disponible).
+#
+# Trame : drapeaux (1) | longueur (4) | contenu
+FRAME = struct.Struct("!BI")
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_ZSTD = 2
+
+FRAME_HELLO = 0x80  # réponse du serveur (contenu : masque des algorithmes retenus)
+CODEC_MASK = 0x0F
+
+CODEC_NAMES = {CODEC_ZLIB: "zlib", CODEC_ZSTD: "zstd"}
+CODEC_PREFERENCE = (CODEC_ZSTD, CODEC_ZLIB)
+DEFAULT_LEVELS = {CODEC_ZLIB: 6, CODEC_ZSTD: 3}
+MAX_LEVELS = {CODEC_ZLIB: 9, CODEC_ZSTD: 22}
+
+MAX_CHUNK = 256 * 1024            # données d'une trame (avant compression)
+MAX_FRAME = MAX_CHUNK + 1024      # contenu maximal accepté (la compression peut grossir un peu)
+MIN_COMPRESS_SIZE = 64            # en dessous, le gain ne compense pas l'en-tête du bloc compressé
+SAMPLE_BYTES = 64 * 1024          # fenêtre de mesure du taux de compression
+INCOMPRESSIBLE_RATIO = 0.9        # taux au-delà duquel la compression est suspendue
+RETRY_AFTER = 8 * 1024 * 1024     # octets envoyés tels quels avant un nouvel essai
+
+READ_SIZE = 64 * 1024
+
+# Flux négociés (streams), dont compressés (streams_compressed), et
+# suspensions sur données incompressibles (incompressible)
+compression_stats = Stats("compression")
+
+compression_input_bytes = registry.counter(
+    "compression_input_bytes_total", "Octets soumis à la compression", ("codec",)
+)
+compression_output_bytes = registry.counter(
+    "compression_output_bytes_total", "Octets produits par la compression", ("codec",)
+)
+compression_cpu_seconds = registry.counter(
+    "compression_cpu_seconds_total", "Temps CPU de compression et de décompression", ("codec", "operation")
+)
+
+
+def available_codecs() -> int:
+    """Masque des algorithmes utilisables dans ce processus."""
+    return CODEC_ZLIB | (CODEC_ZSTD if zstandard is not None else 0)
+
+
+def codec_mask(names) -> int:
+    """Masque des algorithmes nommés (ex: ["zstd", "zlib"]) disponibles localement."""
+    mask = 0
+    for codec, name in CODEC_NAMES.items():
+        if name in names:
+            mask |= codec
+    return mask & available_codecs()
+
+
+def best_codec(mask: int) -> int:
+    for codec in CODEC_PREFERENCE:
+        if mask & codec:
+            return codec
+    return CODEC_NONE
+
+
+def encode_hello(codecs: int) -> bytes:
+    return FRAME.pack(FRAME_HELLO, 1) + bytes([codecs])
+
+
+def looks_encrypted(data) -> bool:
+    """Début d'un flux TLS (handshake ou données applicatives) : inutile de compresser."""
+    return len(data) >= 3 and data[0] in (0x16, 0x17) and data[1] == 0x03
+
+
+def _new_compressor(codec: int, level: int = None):
+    level = min(level or DEFAULT_LEVELS[codec], MAX_LEVELS[codec])
+    if codec == CODEC_ZSTD:
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    return zlib.compressobj(level)
+
+
+def _flush(codec: int, compressor) -> bytes:
+    # Vidage à chaque trame : le pair peut décoder sans attendre la suite
+    if codec == CODEC_ZSTD:
+        return compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+    return compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Compressor:
+    """
+    Sens émission d'un flux compressé : découpe les données en trames et
+    choisit pour chacune de les compresser ou non.
+
+    La compression est suspendue quand le flux commence comme du TLS ou que le
+    taux mesuré sur SAMPLE_BYTES dépasse INCOMPRESSIBLE_RATIO ; elle est
+    retentée après RETRY_AFTER octets.
+
+    Attributes:
+        codec (int): Algorithme utilisé (CODEC_NONE : trames non compressées).
+        level (int): Niveau de compression (None : niveau par défaut de l'algorithme).
+    """
+
+    def __init__(self, codecs: int = 0, level: int = None):
+        self.level = level
+        self.codec = best_codec(codecs)
+        self._compressors = {}
+        self._first = True
+        self._bypass = 0
+        self._sample_in = 0
+        self._sample_out = 0
+
+    def set_codecs(self, codecs: int):
+        """Algorithmes retenus par le pair (trame HELLO)."""
+        self.codec = best_codec(codecs)
+
+    def encode(self, data) -> bytes:
+        if len(data) > MAX_CHUNK:
+            view = memoryview(data)
+            return b"".join(self.encode(view[i:i + MAX_CHUNK]) for i in range(0, len(view), MAX_CHUNK))
+
+        codec = self._choose(data)
+        if codec == CODEC_NONE:
+            return FRAME.pack(CODEC_NONE, len(data)) + data
+
+        compressor = self._compressors.get(codec)
+        if compressor is None:
+            compressor = self._compressors[codec] = _new_compressor(codec, self.level)
+        start = time.thread_time()
+        payload = compressor.compress(data) + _flush(codec, compressor)
+        compression_cpu_seconds.inc(time.thread_time() - start, (CODEC_NAMES[codec], "compress"))
+        compression_input_bytes.inc(len(data), (CODEC_NAMES[codec],))
+        compression_output_bytes.inc(len(payload), (CODEC_NAMES[codec],))
+
+        self._sample_in += len(data)
+        self._sample_out += len(payload)
+        if self._sample_in >= SAMPLE_BYTES:
+            if self._sample_out > self._sample_in * INCOMPRESSIBLE_RATIO:
+                self._suspend()
+            self._sample_in = self._sample_out = 0
+        return FRAME.pack(codec, len(payload)) + payload
+
+    def _choose(self, data) -> int:
+        if self.codec == CODEC_NONE or len(data) < MIN_COMPRESS_SIZE:
+            return CODEC_NONE
+        if self._first:
+            self._first = False
+            if looks_encrypted(data):
+                self._suspend()
+        if self._bypass > 0:
+            self._bypass -= len(data)
+            return CODEC_NONE
+        return self.codec
+
+    def _suspend(self):
+        self._bypass = RETRY_AFTER
+        compression_stats.incr("incompressible")
+
+
+class _ZstdStream:
+    """
+    Décompression zstd bornée. zstandard n'a pas d'équivalent du max_length
+    de zlib : la sortie passe par un stream_writer et la trame est refusée dès
+    qu'elle dépasse MAX_CHUNK octets décodés, sans attendre la fin du contenu.
+
+    Le tampon de sortie (MAX_CHUNK + 1) contient toute trame valide : le
+    writer ne garde ainsi aucune donnée décodée en attente de l'écriture
+    suivante (il ne vide le décodeur que tant qu'il reste des octets à lire).
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+        self._writer = zstandard.ZstdDecompressor().stream_writer(self, write_size=MAX_CHUNK + 1)
+
+    def write(self, data) -> int:
+        self._size += len(data)
+        if self._size > MAX_CHUNK:
+            raise ValueError("Trame décompressée trop longue")
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def decompress(self, payload: bytes) -> bytes:
+        self._chunks, self._size = [], 0
+        self._writer.write(payload)
+        return b"".join(self._chunks)
+
+
+class Decompressor:
+    """
+    Sens réception d'un flux compressé : reconstitue les trames et restitue
+    les données décompressées.
+
+    Attributes:
+        on_hello (callable): Appelé avec le masque de la trame HELLO (côté client).
+    """
+
+    def __init__(self, on_hello=None):
+        self.on_hello = on_hello
+        self._buf = bytearray()
+        self._decompressors = {}
+
+    def feed(self, data) -> bytes:
+        """Ajoute des octets reçus ; retourne les données décodées (éventuellement vides)."""
+        self._buf += data
+        out = []
+        offset = 0
+        while len(self._buf) - offset >= FRAME.size:
+            flags, length = FRAME.unpack_from(self._buf, offset)
+            if length > MAX_FRAME:
+                raise ValueError(f"Trame compressée trop longue : {length}")
+            end = offset + FRAME.size + length
+            if end > len(self._buf):
+                break
+            payload = bytes(self._buf[offset + FRAME.size:end])
+            offset = end
+
+            if flags & FRAME_HELLO:
+                if self.on_hello is not None and payload:
+                    self.on_hello(payload[0])
+                continue
+            codec = flags & CODEC_MASK
+            out.append(payload if codec == CODEC_NONE else self._decompress(codec, payload))
+        del self._buf[:offset]
+        return b"".join(out)
+
+    def finish(self):
+        """Fin du flux : une trame incomplète signifie une coupure en cours d'envoi."""
+        if self._buf:
+            raise ConnectionError("Trame compressée tronquée")
+
+    def _decompress(self, codec: int, payload: bytes) -> bytes:
+        decompressor = self._decompressors.get(codec)
+        if decompressor is None:
+            if not available_codecs() & codec:
+                raise ValueError(f"Algorithme de compression non supporté : {codec}")
+            if codec == CODEC_ZSTD:
+                decompressor = _ZstdStream()
+            else:
+                decompressor = zlib.decompressobj()
+            self._decompressors[codec] = decompressor
+
+        start = time.thread_time()
+        if codec == CODEC_ZSTD:
+            data = decompressor.decompress(payload)
+        else:
+            data = decompressor.decompress(payload, MAX_CHUNK + 1)
+            if decompressor.unconsumed_tail:
+                data += b"\0"  # dépasse forcément la borne ci-dessous
+        compression_cpu_seconds.inc(time.thread_time() - start, (CODEC_NAMES[codec], "decompress"))
+        if len(data) > MAX_CHUNK:
+            raise ValueError("Trame décompressée trop longue")
+        return data
+
+
+def _client_side(offered: int, level: int = None) -> tuple[Compressor, Decompressor]:
+    compressor = Compressor(offered & CODEC_ZLIB, level)
+    compression_stats.incr("streams")
+    return compressor, Decompressor(on_hello=compressor.set_codecs)
+
+
+def _server_side(offered: int, enabled: bool, level: int = None) -> tuple[int, Compressor, Decompressor]:
+    codecs = offered & available_codecs() if enabled else 0
+    compression_stats.incr("streams")
+    if codecs:
+        compression_stats.incr("streams_compressed")
+    return codecs, Compressor(codecs, level), Decompressor()
+
+
+class CompressedSocket:
+    """
+    Socket (ou MuxStream) dont les données circulent en trames compressées.
+    Même interface (recv, recv_into, sendall, shutdown, close) : utilisable
+    tel quel par utils.relay.
+
+    Attributes:
+        sock: Socket TLS ou flux multiplexé sous-jacent.
+        compressor (Compressor): Sens émission.
+        decompressor (Decompressor): Sens réception.
+    """
+
+    def __init__(self, sock, compressor: Compressor, decompressor: Decompressor, initial: bytes = b""):
+        self.sock = sock
+        self.compressor = compressor
+        self.decompressor = decompressor
+        self._pending = memoryview(decompressor.feed(initial) if initial else b"")
+
+    @classmethod
+    def client(cls, sock, offered: int, level: int = None) -> "CompressedSocket":
+        """Côté client, juste après l'envoi de l'en-tête annonçant `offered`."""
+        return cls(sock, *_client_side(offered, level))
+
+    @classmethod
+    def server(cls, sock, offered: int, enabled: bool = True, level: int = None,
+               initial: bytes = b"") -> "CompressedSocket":
+        """Côté serveur : répond à l'offre du client (trame HELLO) ; `initial` : octets déjà lus."""
+        codecs, compressor, decompressor = _server_side(offered, enabled, level)
+        sock.sendall(encode_hello(codecs))
+        return cls(sock, compressor, decompressor, initial)
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        nbytes = nbytes or len(buffer)
+        while not self._pending:
+            data = self.sock.recv(READ_SIZE)
+            if not data:
+                self.decompressor.finish()
+                return 0
+            self._pending = memoryview(self.decompressor.feed(data))
+        n = min(nbytes, len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+    def recv(self, bufsize: int) -> bytes:
+        buffer = bytearray(bufsize)
+        return bytes(buffer[:self.recv_into(buffer, bufsize)])
+
+    def sendall(self, data):
+        self.sock.sendall(self.compressor.encode(data))
+
+    def shutdown(self, how: int):
+        if how == socket.SHUT_WR:
+            shutdown_write(self.sock)
+        else:
+            self.sock.shutdown(how)
+
+    def abort(self):
+        abort(self.sock)
+
+    def close(self):
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncCompressedStream:
+    """
+    Équivalent de CompressedSocket pour le moteur asyncio
+    (interface read / write / write_eof / close).
+    """
+
+    def __init__(self, stream, compressor: Compressor, decompressor: Decompressor, initial: bytes = b""):
+        self.stream = stream
+        self.compressor = compressor
+        self.decompressor = decompressor
+        self._pending = decompressor.feed(initial) if initial else b""
+
+    @classmethod
+    def client(cls, stream, offered: int, level: int = None) -> "AsyncCompressedStream":
+        return cls(stream, *_client_side(offered, level))
+
+    @classmethod
+    async def server(cls, stream, offered: int, enabled: bool = True, level: int = None,
+                     initial: bytes = b"") -> "AsyncCompressedStream":
+        codecs, compressor, decompressor = _server_side(offered, enabled, level)
+        await stream.write(encode_hello(codecs))
+        return cls(stream, compressor, decompressor, initial)
+
+    async def read(self, n: int = READ_SIZE) -> bytes:
+        while not self._pending:
+            data = await self.stream.read(READ_SIZE)
+            if not data:
+                self.decompressor.finish()
+                return b""
+            self._pending = self.decompressor.feed(data)
+        data, self._pending = self._pending[:n], self._pending[n:]
+        return data
+
+    async def write(self, data: bytes):
+        await self.stream.write(self.compressor.encode(data))
+
+    def write_eof(self):
+        self.stream.write_eof()
+
+    def close(self):
+        self.stream.close()
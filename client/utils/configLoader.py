@@ -2,6 +2,8 @@ import os
 import yaml
 from pathlib import Path
 
+from utils.lifecycle import file_signature
+
 
 class ConfigLoader:
     """
@@ -15,15 +17,27 @@ class ConfigLoader:
     def __init__(self, yaml_path: Path = None):
         self.yaml_path = yaml_path
         self.config = {}
+        self._signature = None
 
     def load(self) -> dict:
-        """Charge le fichier YAML dans self.config et retourne le dict final."""
+        """
+        Charge (ou recharge) le fichier YAML dans self.config et retourne le dict final.
+        Un rechargement repart de zéro : une clé retirée du fichier reprend sa valeur par défaut.
+        """
+        config = {}
 
         # Charger YAML
         if self.yaml_path:
+            # Mémorisée même si la lecture échoue : pas de nouvel essai avant la prochaine modification
+            self._signature = file_signature([self.yaml_path])
             with open(self.yaml_path, "r") as f:
                 yaml_config = yaml.safe_load(f)
                 if yaml_config:
-                    self.config.update(yaml_config)
+                    config.update(yaml_config)
 
+        self.config = config
         return self.config
+
+    def changed(self) -> bool:
+        """True si le fichier YAML a été modifié depuis le dernier chargement."""
+        return bool(self.yaml_path) and file_signature([self.yaml_path]) != self._signature
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import queue
+import signal
+import socket
+import threading
+import time
+
+from utils.logger import get_logger
+from utils.profiling import start_profile
+from utils.stats import Stats
+
+logger = get_logger("LIFECYCLE")
+
+# Rechargements (reloads, reload_failures) et arrêts progressifs (drains, drain_timeouts)
+lifecycle_stats = Stats("lifecycle")
+
+DRAIN_POLL_INTERVAL = 0.1  # période (s) de vérification des connexions restantes pendant un drain
+
+# Signaux reçus par le moteur à threads, traités par le thread "signals". Le
+# gestionnaire de signal ne fait que les déposer ici (SimpleQueue.put est
+# réentrante) : journaliser ou prendre un verrou depuis un gestionnaire peut
+# bloquer sur un verrou détenu par le code interrompu (file du logger,
+# AdmissionControl).
+_signal_queue = queue.SimpleQueue()
+_signal_actions = {}
+_signal_thread = None
+
+
+def file_signature(paths) -> tuple:
+    """Empreinte (date, taille, inode) des fichiers : change à chaque réécriture ou remplacement."""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size, st.st_ino))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+class ConfigWatcher:
+    """
+    Surveille les fichiers de configuration et de certificats : `reload` est
+    appelé dès que `changed()` le signale (sondage toutes les `interval` secondes).
+
+    Attributes:
+        changed (callable): Retourne True si un fichier surveillé a changé.
+        reload (callable): Rechargement à déclencher.
+        interval (float): Période (s) de sondage (0 : désactivé, SIGHUP uniquement).
+    """
+
+    def __init__(self, changed, reload, interval: float = 2.0):
+        self.changed = changed
+        self.reload = reload
+        self.interval = interval
+
+    def start(self) -> "ConfigWatcher":
+        """Sonde dans un thread dédié (moteur à threads)."""
+        if self.interval > 0:
+            threading.Thread(target=self._run, name="config-watcher", daemon=True).start()
+        return self
+
+    async def run_async(self):
+        """Sonde dans la boucle d'événements (moteur asyncio)."""
+        if self.interval <= 0:
+            return
+        while True:
+            await asyncio.sleep(self.interval)
+            self._check()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self._check()
+
+    def _check(self):
+        try:
+            if self.changed():
+                logger.info("Modification des fichiers de configuration détectée")
+                self.reload()
+        except Exception as e:
+            logger.error(f"Rechargement automatique impossible : {e}")
+
+
+def install_signal_handlers(reload, drain, loop: asyncio.AbstractEventLoop = None):
+    """
+    SIGHUP : reload() ; SIGTERM : drain(). Un second SIGTERM pendant un
+    drain arrête le processus immédiatement. SIGUSR2 : profil du processus
+    (utils.profiling.start_profile).
+
+    Sans effet hors du thread principal. Avec `loop`, les actions s'exécutent
+    dans la boucle d'événements ; sinon dans le thread "signals", jamais dans
+    le gestionnaire de signal lui-même.
+    """
+    global _signal_thread
+    draining = []
+
+    def on_terminate():
+        if draining:
+            logger.warning("Second signal d'arrêt : arrêt immédiat")
+            os._exit(1)
+        draining.append(True)
+        drain()
+
+    handlers = {signal.SIGHUP: reload, signal.SIGTERM: on_terminate, signal.SIGUSR2: start_profile}
+    if loop is None:
+        _signal_actions.update(handlers)
+        # Un processus issu d'un fork hérite de la référence, pas du thread
+        if _signal_thread is None or not _signal_thread.is_alive():
+            _signal_thread = threading.Thread(target=_run_signal_actions, name="signals", daemon=True)
+            _signal_thread.start()
+    try:
+        for signum, handler in handlers.items():
+            if loop is not None:
+                loop.add_signal_handler(signum, handler)
+            else:
+                signal.signal(signum, lambda signum, frame: _signal_queue.put(signum))
+    except (ValueError, RuntimeError, NotImplementedError):
+        pass  # hors du thread principal, ou plateforme sans ces signaux
+
+
+def _run_signal_actions():
+    while True:
+        signum = _signal_queue.get()
+        try:
+            _signal_actions[signum]()
+        except Exception as e:
+            logger.error(f"Traitement du signal {signal.Signals(signum).name} impossible : {e}")
+
+
+def close_listener(sock):
+    """
+    Ferme un socket d'écoute depuis un autre thread que celui qui y attend
+    dans accept() : sous Linux, close() seul ne réveille pas accept(),
+    shutdown() le fait échouer aussitôt.
+    """
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+def wait_drained(pending, timeout: float) -> bool:
+    """
+    Attend que `pending()` (connexions encore actives) tombe à zéro, au plus
+    `timeout` secondes. Retourne False si l'échéance est atteinte.
+    """
+    deadline = time.monotonic() + timeout
+    while pending() > 0:
+        if time.monotonic() >= deadline:
+            return _drain_timed_out(pending())
+        time.sleep(DRAIN_POLL_INTERVAL)
+    lifecycle_stats.incr("drains")
+    return True
+
+
+async def wait_drained_async(pending, timeout: float) -> bool:
+    """Équivalent asyncio de wait_drained."""
+    deadline = time.monotonic() + timeout
+    while pending() > 0:
+        if time.monotonic() >= deadline:
+            return _drain_timed_out(pending())
+        await asyncio.sleep(DRAIN_POLL_INTERVAL)
+    lifecycle_stats.incr("drains")
+    return True
+
+
+def _drain_timed_out(remaining: int) -> bool:
+    lifecycle_stats.incr("drain_timeouts")
+    logger.warning(f"Délai de drain écoulé : {remaining} connexion(s) interrompue(s)")
+    return False
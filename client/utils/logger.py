@@ -1,14 +1,26 @@
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 import os
 from dotenv import load_dotenv
 
+from utils.stats import Stats
+
 # Charger les variables d'environnement (LOG_LEVEL, etc.)
 load_dotenv(dotenv_path="config/.env")
 
 # Dictionnaire pour conserver les loggers déjà créés
 _LOGGERS = {}
+_LOGGERS_LOCK = threading.Lock()
+
+# Enregistrements mis en file (queued) et perdus faute de place (dropped)
+logging_stats = Stats("logging")
 
 def _init_base_logger():
     """Initialise la configuration de base pour tous les loggers."""
@@ -26,45 +38,156 @@ def _init_base_logger():
         "max_bytes": max_bytes,
         "backup_count": backup_count,
         "log_dir": log_dir,
+        # Taille maximale de la file d'écriture (au-delà, les enregistrements sont perdus)
+        "queue_size": int(os.getenv("LOG_QUEUE_SIZE", 10000)),
+        # Proportion des connexions dont les événements individuels sont journalisés
+        "sample_rate": float(os.getenv("LOG_SAMPLE_RATE", 1.0)),
+        # Enregistrement d'accès structuré à la fin de chaque connexion
+        "access_log": os.getenv("LOG_ACCESS", "true").lower() in ("1", "true", "yes"),
     }
 
-def get_logger(name: str) -> logging.Logger:
+_CONFIG = _init_base_logger()
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Met les enregistrements en file sans jamais bloquer l'appelant :
+    si la file est pleine, l'enregistrement est perdu et compté.
+    """
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+            logging_stats.incr("queued")
+        except queue.Full:
+            logging_stats.incr("dropped")
+
+
+class _RoutingHandler(logging.Handler):
+    """Côté écrivain : transmet chaque enregistrement aux handlers de son logger."""
+
+    def __init__(self):
+        super().__init__()
+        self.routes = {}
+
+    def handle(self, record: logging.LogRecord):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_QUEUE = queue.Queue(maxsize=_CONFIG["queue_size"])
+_ROUTER = _RoutingHandler()
+_LISTENER = QueueListener(_QUEUE, _ROUTER)
+_LISTENER.start()
+
+
+def _stop_listener():
+    # Vider la file avant la sortie du processus
+    _LISTENER.stop()
+
+
+def _restart_after_fork():
+    # Le thread d'écriture n'existe pas dans un processus fils (worker) :
+    # nouvelle file (ses verrous ont pu être copiés verrouillés) et nouvel écrivain.
+    global _QUEUE, _LISTENER
+    _QUEUE = queue.Queue(maxsize=_CONFIG["queue_size"])
+    for logger in _LOGGERS.values():
+        for handler in logger.handlers:
+            if isinstance(handler, _DroppingQueueHandler):
+                handler.queue = _QUEUE
+    _LISTENER = QueueListener(_QUEUE, _ROUTER)
+    _LISTENER.start()
+
+
+atexit.register(_stop_listener)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+def get_logger(name: str, console: bool = True) -> logging.Logger:
     """
     Récupère (ou crée) un logger configuré globalement.
 
+    Les appels de journalisation ne font que mettre l'enregistrement en file :
+    l'écriture (console et fichier avec rotation) est faite par un thread dédié.
+
     Args:
         name (str): Nom du logger (ex: "SOCKS5", "TLS_SERVER").
+        console (bool): Écrit aussi sur la console (sinon fichier seul).
+    """
+    with _LOGGERS_LOCK:
+        if name in _LOGGERS:
+            return _LOGGERS[name]
+
+        config = _CONFIG
+
+        logger = logging.getLogger(name)
+        logger.setLevel(config["level"])
+        logger.propagate = False
+
+        if not logger.hasHandlers():
+            # Format uniforme
+            formatter = logging.Formatter(
+                fmt="[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s",
+                datefmt="%Y-%m-%d %H:%M:%S",
+            )
+            handlers = []
+
+            # Handler console
+            if console:
+                console_handler = logging.StreamHandler()
+                console_handler.setFormatter(formatter)
+                handlers.append(console_handler)
+
+            # Handler fichier (rotation auto)
+            log_file = config["log_dir"] / f"{name.lower()}.log"
+            file_handler = RotatingFileHandler(
+                log_file,
+                maxBytes=config["max_bytes"],
+                backupCount=config["backup_count"],
+                encoding="utf-8",
+            )
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+
+            _ROUTER.routes[name] = handlers
+            logger.addHandler(_DroppingQueueHandler(_QUEUE))
+
+        _LOGGERS[name] = logger
+        return logger
+
+
+class _SilentLogger:
+    """Logger sans effet, pour les connexions non échantillonnées."""
+
+    def debug(self, *args, **kwargs):
+        pass
+
+    info = warning = debug
+
+
+_SILENT = _SilentLogger()
+
+
+def connection_logger(logger: logging.Logger):
+    """
+    Logger à utiliser pour les événements d'une connexion : `logger` lui-même
+    pour une proportion LOG_SAMPLE_RATE des connexions, un logger muet sinon.
+    Les erreurs restent à journaliser avec le logger du module.
+    """
+    rate = _CONFIG["sample_rate"]
+    if rate >= 1.0 or random.random() < rate:
+        return logger
+    return _SILENT
+
+
+def log_access(**fields):
+    """
+    Écrit l'enregistrement d'accès (une ligne JSON) d'une connexion terminée
+    dans logs/access.log, si LOG_ACCESS est actif.
     """
-    if name in _LOGGERS:
-        return _LOGGERS[name]
-
-    config = _init_base_logger()
-
-    logger = logging.getLogger(name)
-    logger.setLevel(config["level"])
-
-    if not logger.hasHandlers():
-        # Format uniforme
-        formatter = logging.Formatter(
-            fmt="[%(asctime)s] [%(levelname)s] [%(name)s] %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-
-        # Handler console
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-        logger.addHandler(console_handler)
-
-        # Handler fichier (rotation auto)
-        log_file = config["log_dir"] / f"{name.lower()}.log"
-        file_handler = RotatingFileHandler(
-            log_file,
-            maxBytes=config["max_bytes"],
-            backupCount=config["backup_count"],
-            encoding="utf-8",
-        )
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-
-    _LOGGERS[name] = logger
-    return logger
+    if not _CONFIG["access_log"]:
+        return
+    fields["ts"] = round(time.time(), 3)
+    get_logger("ACCESS", console=False).info(json.dumps(fields, separators=(",", ":")))
@@ -0,0 +1,336 @@
+import socket
+import struct
+import threading
+from collections import deque
+
+from utils.relay import abort
+
+# Préambule envoyé par le client juste après le handshake TLS pour annoncer
+# une connexion multiplexée (à la place de la ligne "host:port\n").
+MUX_PREFACE = b"PSTMUX/1\n"
+
+# En-tête de trame : type (1 octet), identifiant de flux (4), longueur (2)
+FRAME_HEADER = struct.Struct("!BIH")
+
+FRAME_OPEN = 0x01    # ouverture d'un flux
+FRAME_DATA = 0x02    # données applicatives
+FRAME_FIN = 0x03     # fin d'émission (équivalent de shutdown(SHUT_WR))
+FRAME_RST = 0x04     # abandon du flux
+FRAME_WINDOW = 0x05  # crédit de contrôle de flux (payload : uint32)
+FRAME_GOAWAY = 0x06  # serveur en arrêt progressif : plus de nouveaux flux sur cette session (flux 0)
+
+MAX_FRAME_PAYLOAD = 16 * 1024   # une trame = un enregistrement TLS
+DEFAULT_WINDOW = 256 * 1024     # fenêtre initiale par flux
+
+WINDOW_INCREMENT = struct.Struct("!I")
+
+
+def parse_window(payload: bytes) -> int:
+    """Incrément d'une trame WINDOW ; ValueError (erreur de protocole) si sa taille est invalide."""
+    if len(payload) != WINDOW_INCREMENT.size:
+        raise ValueError(f"Trame WINDOW invalide ({len(payload)} octets)")
+    return WINDOW_INCREMENT.unpack(payload)[0]
+
+
+class MuxStream:
+    """
+    Flux logique transporté dans une session multiplexée.
+
+    Expose la même interface qu'un socket (recv, sendall, shutdown, close)
+    afin d'être utilisable tel quel par les boucles de relais existantes.
+
+    Attributes:
+        stream_id (int): Identifiant du flux dans la session.
+        session (MuxSession): Session propriétaire.
+    """
+
+    def __init__(self, session: "MuxSession", stream_id: int, window: int):
+        self.session = session
+        self.stream_id = stream_id
+        self._cond = threading.Condition()
+        self._recv_buf = deque()
+        self._recv_eof = False
+        self._reset = False
+        self._fin_sent = False
+        self._closed = False
+        self._send_window = window
+        self._window = window
+        self._unacked = 0
+        # Crédit accordé au pair et pas encore consommé par ses trames DATA
+        self._recv_credit = window
+
+    # --- Interface "socket" -------------------------------------------------
+
+    def recv(self, bufsize: int) -> bytes:
+        with self._cond:
+            while not self._recv_buf and not self._recv_eof and not self._reset:
+                self._cond.wait()
+            if not self._recv_buf:
+                if self._reset and not self._recv_eof:
+                    raise ConnectionResetError("Flux réinitialisé par le pair")
+                return b""
+            chunk = self._recv_buf.popleft()
+            if len(chunk) > bufsize:
+                self._recv_buf.appendleft(chunk[bufsize:])
+                chunk = chunk[:bufsize]
+            self._unacked += len(chunk)
+            increment = 0
+            if self._unacked >= self._window // 2:
+                increment, self._unacked = self._unacked, 0
+                self._recv_credit += increment
+
+        if increment:
+            self.session._send_frame(FRAME_WINDOW, self.stream_id, WINDOW_INCREMENT.pack(increment))
+        return chunk
+
+    def recv_into(self, buffer, nbytes: int = 0) -> int:
+        chunk = self.recv(nbytes or len(buffer))
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+    def sendall(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            with self._cond:
+                while self._send_window <= 0 and not self._reset:
+                    self._cond.wait()
+                if self._reset or self._fin_sent:
+                    raise BrokenPipeError("Flux fermé")
+                size = min(len(view), self._send_window, MAX_FRAME_PAYLOAD)
+                self._send_window -= size
+            self.session._send_frame(FRAME_DATA, self.stream_id, view[:size])
+            view = view[size:]
+
+    def shutdown(self, how: int):
+        if how in (socket.SHUT_WR, socket.SHUT_RDWR):
+            with self._cond:
+                if self._fin_sent or self._reset:
+                    return
+                self._fin_sent = True
+            self.session._send_frame(FRAME_FIN, self.stream_id)
+
+    def close(self):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            # Si l'échange n'est pas terminé proprement des deux côtés, on abandonne le flux
+            abort = not self._reset and not (self._fin_sent and self._recv_eof)
+            self._reset = True
+            self._cond.notify_all()
+        if abort:
+            self.session._send_frame(FRAME_RST, self.stream_id)
+        self.session._forget(self.stream_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Appelé par le thread lecteur de la session ---------------------------
+
+    def _on_data(self, payload: bytes) -> bool:
+        """Retourne False si le pair dépasse la fenêtre qui lui a été accordée."""
+        with self._cond:
+            self._recv_credit -= len(payload)
+            if self._recv_credit < 0:
+                return False
+            if not self._closed:
+                self._recv_buf.append(payload)
+                self._cond.notify_all()
+            return True
+
+    def _on_fin(self):
+        with self._cond:
+            self._recv_eof = True
+            self._cond.notify_all()
+
+    def _on_reset(self):
+        with self._cond:
+            self._reset = True
+            self._cond.notify_all()
+
+    def _on_window(self, increment: int):
+        with self._cond:
+            self._send_window += increment
+            self._cond.notify_all()
+
+
+class MuxSession:
+    """
+    Session multiplexée : plusieurs flux MuxStream sur une seule connexion TLS.
+
+    Un thread lecteur démultiplexe les trames entrantes vers les flux ;
+    les écritures sont sérialisées par un verrou sur le socket.
+
+    Attributes:
+        sock (socket.socket): Connexion TLS sous-jacente.
+        is_client (bool): True côté client (ouvre les flux), False côté serveur.
+        on_open (callable): Appelé avec chaque nouveau flux ouvert par le pair.
+        window (int): Fenêtre de contrôle de flux par flux.
+        going_away (bool): Le serveur a annoncé son arrêt (GOAWAY) : ne plus ouvrir de flux.
+    """
+
+    def __init__(self, sock, is_client: bool, on_open=None, window: int = DEFAULT_WINDOW):
+        self.sock = sock
+        self.is_client = is_client
+        self.on_open = on_open
+        self.window = window
+        self.closed = False
+        self.going_away = False
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._next_id = 1 if is_client else 2
+        self._reader = threading.Thread(target=self._read_loop, daemon=True)
+
+    def start(self) -> "MuxSession":
+        self._reader.start()
+        return self
+
+    def run(self, initial: bytes = b""):
+        """
+        Exécute la boucle de lecture dans le thread courant (côté serveur).
+
+        Args:
+            initial (bytes): Octets déjà lus après le préambule.
+        """
+        self._read_loop(initial)
+
+    @property
+    def stream_count(self) -> int:
+        return len(self._streams)
+
+    def open_stream(self) -> MuxStream:
+        """Ouvre un nouveau flux vers le pair."""
+        with self._lock:
+            if self.closed or self.going_away:
+                raise ConnectionError("Session multiplexée fermée")
+            stream_id = self._next_id
+            self._next_id += 2
+            stream = MuxStream(self, stream_id, self.window)
+            self._streams[stream_id] = stream
+        self._send_frame(FRAME_OPEN, stream_id)
+        return stream
+
+    def goaway(self):
+        """
+        Côté serveur : annonce un arrêt progressif. Le client ouvre ses flux
+        suivants sur une autre session ; les flux en cours continuent.
+        """
+        self.going_away = True
+        try:
+            self._send_frame(FRAME_GOAWAY, 0)
+        except OSError:
+            pass
+
+    def close(self):
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            streams = list(self._streams.values())
+            self._streams.clear()
+        for stream in streams:
+            stream._on_reset()
+        # close() seul ne libère pas le socket tant que le makefile() du thread lecteur est ouvert
+        abort(self.sock)
+        try:
+            self.sock.close()
+        except Exception:
+            pass
+
+    def _send_frame(self, frame_type: int, stream_id: int, payload=b""):
+        header = FRAME_HEADER.pack(frame_type, stream_id, len(payload))
+        with self._write_lock:
+            if self.closed:
+                raise BrokenPipeError("Session multiplexée fermée")
+            try:
+                self.sock.sendall(header + bytes(payload))
+            except OSError:
+                self.close()
+                raise
+
+    def _forget(self, stream_id: int):
+        with self._lock:
+            self._streams.pop(stream_id, None)
+        if self.going_away and self.is_client:
+            self._close_if_idle()
+
+    def _close_if_idle(self):
+        # Client : une session en GOAWAY est fermée après son dernier flux,
+        # ce qui signale au serveur qu'aucune ouverture n'est plus en route.
+        with self._lock:
+            if self._streams or self.closed:
+                return
+        self.close()
+
+    def _check_open(self, stream_id: int):
+        # Identifiant du pair : parité opposée à la nôtre et flux pas déjà
+        # ouvert (les OPEN de threads concurrents peuvent arriver dans le
+        # désordre). Sinon erreur de protocole : la session est fermée.
+        if stream_id % 2 == self._next_id % 2 or stream_id in self._streams:
+            raise ValueError(f"Ouverture de flux invalide : {stream_id}")
+
+    def _read_loop(self, initial: bytes = b""):
+        reader = self.sock.makefile("rb")
+        pending = bytearray(initial)
+
+        def read(n: int) -> bytes:
+            if not pending:
+                return reader.read(n)
+            data = bytes(pending[:n])
+            del pending[:n]
+            if len(data) < n:
+                data += reader.read(n - len(data))
+            return data
+
+        try:
+            while True:
+                header = read(FRAME_HEADER.size)
+                if len(header) < FRAME_HEADER.size:
+                    break
+                frame_type, stream_id, length = FRAME_HEADER.unpack(header)
+                payload = read(length) if length else b""
+                if len(payload) < length:
+                    break
+                self._dispatch(frame_type, stream_id, payload)
+        except (OSError, ValueError):
+            pass
+        finally:
+            reader.close()
+            self.close()
+
+    def _dispatch(self, frame_type: int, stream_id: int, payload: bytes):
+        if frame_type == FRAME_OPEN:
+            if self.is_client or self.on_open is None:
+                return
+            self._check_open(stream_id)
+            stream = MuxStream(self, stream_id, self.window)
+            with self._lock:
+                self._streams[stream_id] = stream
+            self.on_open(stream)
+            return
+        if frame_type == FRAME_GOAWAY:
+            self.going_away = True
+            if self.is_client:
+                self._close_if_idle()
+            return
+
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            return
+        if frame_type == FRAME_DATA:
+            if not stream._on_data(payload):
+                # Fenêtre dépassée : le flux est abandonné des deux côtés
+                stream._on_reset()
+                self._forget(stream_id)
+                self._send_frame(FRAME_RST, stream_id)
+        elif frame_type == FRAME_WINDOW:
+            stream._on_window(parse_window(payload))
+        elif frame_type == FRAME_FIN:
+            stream._on_fin()
+        elif frame_type == FRAME_RST:
+            stream._on_reset()
+            self._forget(stream_id)
@@ -0,0 +1,203 @@
+import hashlib
+import threading
+import time
+
+from utils.metrics import registry
+
+identity_bytes = registry.counter(
+    "identity_bytes_total", "Octets relayés par identité (CN du certificat client) et par sens", ("identity", "direction")
+)
+identity_connections = registry.counter(
+    "identity_connections_total", "Connexions relayées par identité", ("identity",)
+)
+identity_rejected = registry.counter(
+    "identity_rejected_total", "Connexions refusées par identité (débit de connexions dépassé)", ("identity",)
+)
+identity_throttled_seconds = registry.counter(
+    "identity_throttled_seconds_total", "Attente imposée par la limite de débit, par identité et par sens",
+    ("identity", "direction"),
+)
+
+
+def cert_fingerprint(der: bytes) -> str:
+    """Empreinte "sha256:<hex>" d'un certificat (getpeercert(binary_form=True))."""
+    return "sha256:" + hashlib.sha256(der or b"").hexdigest()
+
+
+class TokenBucket:
+    """
+    Seau à jetons partagé entre threads : `rate` jetons par seconde, au plus
+    `burst` en réserve.
+
+    Le solde peut devenir négatif : celui qui consomme au-delà de la réserve
+    attend le remboursement de la dette (take() retourne l'attente). Plusieurs
+    consommateurs d'un même seau se partagent donc le débit.
+    """
+
+    def __init__(self, rate: float, burst: float = 0):
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+        self._last = time.monotonic()
+        self.configure(rate, burst)
+        self._tokens = self.burst
+
+    def configure(self, rate: float, burst: float = 0):
+        """Nouveau débit (rechargement) ; burst 0 : une seconde de débit."""
+        with self._lock:
+            self.rate = rate
+            self.burst = burst or rate
+            self._tokens = min(self._tokens, self.burst)
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, amount: float) -> float:
+        """Consomme `amount` jetons ; retourne l'attente (s) avant de poursuivre (0 : aucune)."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= amount
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def try_take(self, amount: float = 1) -> bool:
+        """Consomme `amount` jetons s'ils sont disponibles, sans dette."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens < amount:
+                return False
+            self._tokens -= amount
+            return True
+
+
+class RateLimit:
+    """
+    Limites d'une identité (0 : illimité).
+
+    Attributes:
+        bytes_per_second (float): Débit maximal dans chaque sens, toutes connexions de l'identité confondues.
+        burst_bytes (float): Octets pouvant passer d'un coup au-delà du débit (0 : une seconde de débit).
+        connections_per_second (float): Nouvelles connexions par seconde.
+        burst_connections (float): Connexions pouvant s'ouvrir d'un coup (0 : une seconde de débit, au moins 1).
+    """
+
+    def __init__(self, bytes_per_second: float = 0, burst_bytes: float = 0,
+                 connections_per_second: float = 0, burst_connections: float = 0):
+        self.bytes_per_second = bytes_per_second
+        self.burst_bytes = burst_bytes
+        self.connections_per_second = connections_per_second
+        self.burst_connections = burst_connections
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, RateLimit) and vars(self) == vars(other)
+
+
+class DirectionLimiter:
+    """
+    Un sens de relais d'une identité : compteur d'usage et seau d'octets
+    (None : illimité). Passé au relais (utils.relay.pipe, utils.aio_streams).
+    """
+
+    __slots__ = ("bucket", "_usage", "_throttled")
+
+    def __init__(self, identity: str, direction: str):
+        self.bucket = None
+        self._usage = identity_bytes.labels(identity, direction)
+        self._throttled = identity_throttled_seconds.labels(identity, direction)
+
+    def consume(self, amount: int) -> float:
+        """Comptabilise `amount` octets ; retourne l'attente (s) imposée par la limite."""
+        self._usage.inc(amount)
+        bucket = self.bucket
+        if bucket is None:
+            return 0.0
+        delay = bucket.take(amount)
+        if delay:
+            self._throttled.inc(delay)
+        return delay
+
+
+class IdentityLimiter:
+    """
+    État partagé par toutes les connexions d'une identité.
+
+    Attributes:
+        identity (str): Étiquette des compteurs d'usage (CN, ou empreinte à défaut).
+        limit (RateLimit): Limites appliquées.
+        upstream (DirectionLimiter): Sens client → cible.
+        downstream (DirectionLimiter): Sens cible → client.
+    """
+
+    def __init__(self, identity: str, limit: RateLimit):
+        self.identity = identity
+        self.limit = None
+        self.upstream = DirectionLimiter(identity, "upstream")
+        self.downstream = DirectionLimiter(identity, "downstream")
+        self._connections = None
+        self._accepted = identity_connections.labels(identity)
+        self._rejected = identity_rejected.labels(identity)
+        self.apply(limit)
+
+    def apply(self, limit: RateLimit):
+        """Applique `limit`, y compris aux connexions en cours (rechargement)."""
+        if limit == self.limit:
+            return
+        self.limit = limit
+        for direction in (self.upstream, self.downstream):
+            direction.bucket = self._bucket(direction.bucket, limit.bytes_per_second, limit.burst_bytes)
+        # Au moins une connexion en réserve, même sous 1 connexion/s
+        burst = max(limit.burst_connections or limit.connections_per_second, 1)
+        self._connections = self._bucket(self._connections, limit.connections_per_second, burst)
+
+    @staticmethod
+    def _bucket(bucket, rate: float, burst: float):
+        if not rate:
+            return None
+        if bucket is None:
+            return TokenBucket(rate, burst)
+        bucket.configure(rate, burst)
+        return bucket
+
+    def admit(self) -> bool:
+        """Nouvelle connexion de l'identité : False si son débit de connexions est dépassé."""
+        bucket = self._connections
+        if bucket is not None and not bucket.try_take():
+            self._rejected.inc()
+            return False
+        self._accepted.inc()
+        return True
+
+
+class RateLimits:
+    """
+    Limites de débit par identité de client : CN du certificat, ou empreinte
+    "sha256:<hex>" pour viser un certificat précis. Les identités sans entrée
+    propre reçoivent chacune leurs propres seaux, aux valeurs par défaut.
+
+    Attributes:
+        default (RateLimit): Limites des identités sans entrée propre.
+        identities (dict[str, RateLimit]): Limites par CN ou par empreinte.
+    """
+
+    def __init__(self, default: RateLimit = None, identities: dict = None):
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self.default = default or RateLimit()
+        self.identities = dict(identities or {})
+
+    def configure(self, default: RateLimit, identities: dict):
+        """Nouvelles limites (rechargement), appliquées aussi aux connexions en cours."""
+        with self._lock:
+            self.default = default
+            self.identities = dict(identities)
+            for key, limiter in self._limiters.items():
+                limiter.apply(self.identities.get(key, self.default))
+
+    def limiter(self, identity: str, fingerprint: str = None) -> IdentityLimiter:
+        """État partagé de l'identité (une recherche par connexion TLS)."""
+        key = fingerprint if fingerprint in self.identities else identity or fingerprint
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = IdentityLimiter(key, self.identities.get(key, self.default))
+                self._limiters[key] = limiter
+            return limiter
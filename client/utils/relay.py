@@ -0,0 +1,202 @@
+import socket
+import ssl
+import threading
+import time
+
+from utils.metrics import bytes_total, connections_active, connections_total, record_error
+from utils.stats import Stats
+
+# Totaux du processus, alimentés à la fin de chaque connexion relayée
+relay_stats = Stats("relay")
+
+
+class RelayPolicy:
+    """
+    Politique de taille des tampons du relais.
+
+    En mode adaptatif, la taille de lecture double tant que les lectures
+    remplissent le tampon (transfert en masse) et diminue de moitié quand
+    elles n'en remplissent qu'une petite partie (trafic interactif).
+
+    Attributes:
+        min_size (int): Taille minimale de lecture.
+        initial_size (int): Taille de lecture initiale.
+        max_size (int): Taille maximale de lecture.
+        adaptive (bool): Active l'ajustement de la taille de lecture.
+    """
+
+    def __init__(self, min_size: int = 4096, initial_size: int = 16384,
+                 max_size: int = 262144, adaptive: bool = True):
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size)
+        self.initial_size = min(max(initial_size, self.min_size), self.max_size)
+        self.adaptive = adaptive
+
+    def next_size(self, size: int, received: int) -> int:
+        if not self.adaptive:
+            return size
+        if received == size and size < self.max_size:
+            return min(size * 2, self.max_size)
+        if received < size // 4 and size > self.min_size:
+            return max(size // 2, self.min_size)
+        return size
+
+
+class DirectionCounters:
+    """Compteurs d'un sens de relais ("upstream" ou "downstream") : octets, appels recv et send."""
+
+    __slots__ = ("direction", "bytes", "recv_calls", "send_calls")
+
+    def __init__(self, direction: str):
+        self.direction = direction
+        self.bytes = 0
+        self.recv_calls = 0
+        self.send_calls = 0
+
+
+class RelayCounters:
+    """
+    Compteurs d'une connexion relayée (sock1 est toujours le côté client).
+
+    Attributes:
+        upstream (DirectionCounters): sock1 → sock2 (requête).
+        downstream (DirectionCounters): sock2 → sock1 (réponse).
+    """
+
+    def __init__(self):
+        self.upstream = DirectionCounters("upstream")
+        self.downstream = DirectionCounters("downstream")
+
+    def as_dict(self) -> dict:
+        return {
+            "bytes_upstream": self.upstream.bytes,
+            "bytes_downstream": self.downstream.bytes,
+            "recv_calls": self.upstream.recv_calls + self.downstream.recv_calls,
+            "send_calls": self.upstream.send_calls + self.downstream.send_calls,
+        }
+
+
+def shutdown_write(sock):
+    """
+    Demi-fermeture en écriture. SSLSocket.shutdown() détache l'objet SSL : le
+    sens de lecture, encore actif, recevrait alors les enregistrements chiffrés
+    et la session ne pourrait plus être récupérée. On envoie donc le FIN TCP
+    sans passer par la surcharge ssl (lu comme fin de flux par le pair).
+    """
+    if isinstance(sock, ssl.SSLSocket):
+        socket.socket.shutdown(sock, socket.SHUT_WR)
+    else:
+        sock.shutdown(socket.SHUT_WR)
+
+
+def abort(sock):
+    """
+    Interrompt depuis un autre thread les E/S bloquées sur `sock` (ramasseur
+    de connexions) : shutdown() réveille un recv() en cours, close() non.
+    """
+    try:
+        if isinstance(sock, socket.socket):
+            socket.socket.shutdown(sock, socket.SHUT_RDWR)
+        elif hasattr(sock, "abort"):
+            sock.abort()
+        else:
+            # MuxStream : la fermeture réveille les lectures et écritures en attente
+            sock.close()
+    except OSError:
+        pass
+
+
+def pipe(src, dst, policy: RelayPolicy, counters: DirectionCounters, fast_path=None, tracker=None, throttle=None):
+    """
+    Copie src vers dst jusqu'à la fin du flux, puis propage la demi-fermeture.
+
+    Les lectures se font avec recv_into dans un tampon préalloué réutilisé :
+    aucun objet bytes n'est créé par lecture. La métrique d'octets est
+    fragmentée par thread : l'incrément ne prend pas de verrou.
+
+    Args:
+        fast_path (callable): Transfert optionnel tenté d'abord, fast_path(src, dst, touch) -> bool ;
+            s'il retourne False, la copie continue dans l'espace utilisateur.
+        tracker (TrackedConnection): Suivi d'activité du ramasseur (utils.reaper), ou None.
+        throttle (DirectionLimiter): Usage et limite de débit de l'identité (utils.ratelimit), ou None ;
+            le transfert optionnel, qui n'en tiendrait pas compte, n'est alors pas tenté.
+    """
+    touch = tracker.touch if tracker is not None else None
+    try:
+        if fast_path is not None and throttle is None and fast_path(src, dst, touch):
+            return
+        metric = bytes_total.labels(counters.direction)
+        size = policy.initial_size
+        buf = memoryview(bytearray(size))
+        while True:
+            received = src.recv_into(buf, size)
+            counters.recv_calls += 1
+            if not received:
+                break
+            if touch is not None:
+                touch()
+            if throttle is not None:
+                # Lecture suspendue pendant l'attente : le pair est freiné par TCP
+                delay = throttle.consume(received)
+                if delay:
+                    time.sleep(delay)
+            dst.sendall(buf[:received])
+            counters.send_calls += 1
+            counters.bytes += received
+            metric.inc(received)
+
+            new_size = policy.next_size(size, received)
+            if new_size != size:
+                size = new_size
+                buf = memoryview(bytearray(size))
+    except Exception as e:
+        record_error("relay", e)
+    finally:
+        if tracker is not None:
+            tracker.half_close()
+        try:
+            shutdown_write(dst)
+        except Exception:
+            pass
+
+
+def relay(sock1, sock2, policy: RelayPolicy = None, fast_upstream=None, fast_downstream=None,
+          tracker=None, limiter=None) -> RelayCounters:
+    """
+    Relais bidirectionnel entre deux sockets (ou objets compatibles : MuxStream...).
+
+    Args:
+        sock1: Socket côté client.
+        sock2: Socket côté cible.
+        policy (RelayPolicy): Tailles de tampon (valeurs par défaut si None).
+        fast_upstream (callable): Transfert rapide optionnel sock1 → sock2 (ex: splice).
+        fast_downstream (callable): Transfert rapide optionnel sock2 → sock1.
+        tracker (TrackedConnection): Suivi d'activité du ramasseur (utils.reaper), ou None.
+        limiter (IdentityLimiter): Usage et limites de débit de l'identité du client (utils.ratelimit), ou None.
+
+    Returns:
+        RelayCounters: Compteurs de la connexion.
+    """
+    policy = policy or RelayPolicy()
+    counters = RelayCounters()
+    up, down = (limiter.upstream, limiter.downstream) if limiter is not None else (None, None)
+
+    t1 = threading.Thread(
+        target=pipe, args=(sock1, sock2, policy, counters.upstream, fast_upstream, tracker, up), daemon=True
+    )
+    t2 = threading.Thread(
+        target=pipe, args=(sock2, sock1, policy, counters.downstream, fast_downstream, tracker, down), daemon=True
+    )
+
+    connections_active.inc()
+    connections_total.inc()
+    t1.start()
+    t2.start()
+    t1.join()
+    t2.join()
+    connections_active.dec()
+
+    for key, value in counters.as_dict().items():
+        relay_stats.incr(key, value)
+    relay_stats.incr("connections")
+    return counters
@@ -0,0 +1,249 @@
+import os
+import ssl
+import threading
+import time
+
+from utils.lifecycle import file_signature
+from utils.logger import get_logger, log_access
+from utils.metrics import record_error, tls_sessions
+
+logger = get_logger("TLS")
+
+# Le relais propage une demi-fermeture par un FIN TCP, sans close_notify.
+# Sans cette option, OpenSSL 3 la traite comme une erreur fatale : le pair
+# répond par une alerte decode_error et le sens retour est perdu.
+OP_IGNORE_UNEXPECTED_EOF = getattr(ssl, "OP_IGNORE_UNEXPECTED_EOF", 0)
+# SSL_OP_PRIORITIZE_CHACHA (OpenSSL >= 1.1.1), non exposé par le module ssl
+OP_PRIORITIZE_CHACHA = getattr(ssl, "OP_PRIORITIZE_CHACHA", 0x200000)
+
+TLS_VERSIONS = {"1.2": ssl.TLSVersion.TLSv1_2, "1.3": ssl.TLSVersion.TLSv1_3}
+
+# AEAD utilisables : suite TLS 1.3 et suites TLS 1.2 (échange ECDHE uniquement).
+# Le module ssl ne configure que les suites TLS 1.2 (set_ciphers) : en TLS 1.3,
+# les suites et leur ordre restent ceux d'OpenSSL.
+AEAD_SUITES = {
+    "aes-128-gcm": ("TLS_AES_128_GCM_SHA256", "ECDHE-ECDSA-AES128-GCM-SHA256:ECDHE-RSA-AES128-GCM-SHA256"),
+    "aes-256-gcm": ("TLS_AES_256_GCM_SHA384", "ECDHE-ECDSA-AES256-GCM-SHA384:ECDHE-RSA-AES256-GCM-SHA384"),
+    "chacha20-poly1305": ("TLS_CHACHA20_POLY1305_SHA256", "ECDHE-ECDSA-CHACHA20-POLY1305:ECDHE-RSA-CHACHA20-POLY1305"),
+}
+
+SELF_TEST_RECORD = 16384  # taille d'un enregistrement TLS plein
+SELF_TEST_DURATION = 0.03  # durée (s) de mesure par AEAD
+
+# Groupes d'échange de clés : nom usuel -> nom OpenSSL (set_ecdh_curve)
+GROUPS = {
+    "X25519": "X25519",
+    "X448": "X448",
+    "P-256": "prime256v1",
+    "P-384": "secp384r1",
+    "P-521": "secp521r1",
+}
+
+_self_test_results = None
+_self_test_lock = threading.Lock()
+
+
+def aead_self_test() -> dict:
+    """
+    Mesure le débit (Mo/s) de chiffrement de chaque AEAD sur ce processeur,
+    par enregistrements de 16 Ko. Exécuté une fois par processus ; dictionnaire
+    vide si le module cryptography est absent.
+    """
+    global _self_test_results
+    with _self_test_lock:
+        if _self_test_results is not None:
+            return _self_test_results
+        try:
+            from cryptography.hazmat.primitives.ciphers.aead import AESGCM, ChaCha20Poly1305
+        except ImportError:
+            _self_test_results = {}
+            return _self_test_results
+        ciphers = {
+            "aes-128-gcm": AESGCM(os.urandom(16)),
+            "aes-256-gcm": AESGCM(os.urandom(32)),
+            "chacha20-poly1305": ChaCha20Poly1305(os.urandom(32)),
+        }
+        record, nonce = os.urandom(SELF_TEST_RECORD), os.urandom(12)
+        results = {}
+        for name, cipher in ciphers.items():
+            count, start = 0, time.perf_counter()
+            while time.perf_counter() - start < SELF_TEST_DURATION:
+                cipher.encrypt(nonce, record, None)
+                count += 1
+            results[name] = count * SELF_TEST_RECORD / (time.perf_counter() - start) / 1e6
+        _self_test_results = results
+        logger.info("Auto-test AEAD : " + ", ".join(f"{name} {mbps:.0f} Mo/s" for name, mbps in results.items()))
+        return results
+
+
+class TLSPolicy:
+    """
+    Politique TLS appliquée aux contextes client et serveur (section `tls:`).
+
+    Les AEAD sont donnés par ordre de préférence ; avec `prefer_fastest`, le
+    plus rapide d'après l'auto-test passe en tête. Cet ordre s'applique aux
+    suites TLS 1.2 : en TLS 1.3, le module ssl ne permet pas de choisir les
+    suites, l'ordre par défaut d'OpenSSL est conservé. Côté serveur, l'ordre
+    du serveur prévaut, sauf pour un client qui place ChaCha20 en tête quand
+    `prioritize_chacha` est actif (processeur sans AES matériel).
+
+    Seul le premier groupe d'échange de clés est appliqué (set_ecdh_curve n'en
+    accepte qu'un) ; sans groupe, la liste par défaut d'OpenSSL est conservée.
+
+    Attributes:
+        min_version (str): Version minimale ("1.2" ou "1.3").
+        max_version (str): Version maximale ("1.2" ou "1.3").
+        ciphers (list): AEAD autorisés en TLS 1.2 (clés de AEAD_SUITES), par ordre de préférence.
+        prefer_fastest (bool): Place en tête l'AEAD le plus rapide (auto-test au démarrage).
+        groups (list): Groupes d'échange de clés (clés de GROUPS ou noms OpenSSL) ; seul le premier est appliqué.
+        renegotiation (bool): Autorise la renégociation (TLS 1.2).
+        compression (bool): Autorise la compression TLS.
+        prioritize_chacha (bool): (serveur) Suit un client qui préfère ChaCha20.
+    """
+
+    def __init__(self, min_version: str = "1.2", max_version: str = "1.3",
+                 ciphers: list = ("aes-128-gcm", "aes-256-gcm", "chacha20-poly1305"),
+                 prefer_fastest: bool = True, groups: list = ("X25519",),
+                 renegotiation: bool = False, compression: bool = False, prioritize_chacha: bool = True):
+        for version in (min_version, max_version):
+            if version not in TLS_VERSIONS:
+                raise ValueError(f"Version TLS inconnue : {version} (attendu : {', '.join(TLS_VERSIONS)})")
+        if TLS_VERSIONS[min_version] > TLS_VERSIONS[max_version]:
+            raise ValueError(f"Version TLS minimale {min_version} supérieure à la maximale {max_version}")
+        unknown = [name for name in ciphers if name not in AEAD_SUITES]
+        if unknown or not ciphers:
+            raise ValueError(f"AEAD inconnu(s) : {', '.join(unknown) or '(aucun)'} (attendu : {', '.join(AEAD_SUITES)})")
+        unknown = [name for name in groups if name not in GROUPS and name not in GROUPS.values()]
+        if unknown:
+            raise ValueError(f"Groupe(s) TLS inconnu(s) : {', '.join(unknown)} (attendu : {', '.join(GROUPS)})")
+        self.min_version = min_version
+        self.max_version = max_version
+        self.ciphers = list(ciphers)
+        self.prefer_fastest = prefer_fastest
+        self.groups = list(groups)
+        self.renegotiation = renegotiation
+        self.compression = compression
+        self.prioritize_chacha = prioritize_chacha
+
+    def cipher_order(self) -> list:
+        """AEAD autorisés dans l'ordre appliqué (le plus rapide en tête si demandé)."""
+        if not self.prefer_fastest:
+            return list(self.ciphers)
+        speeds = aead_self_test()
+        if not speeds:
+            return list(self.ciphers)
+        fastest = max(self.ciphers, key=lambda name: speeds.get(name, 0))
+        return [fastest] + [name for name in self.ciphers if name != fastest]
+
+    def apply(self, context: ssl.SSLContext, server_side: bool = False):
+        """Applique la politique à un contexte neuf (avant toute connexion)."""
+        context.minimum_version = TLS_VERSIONS[self.min_version]
+        context.maximum_version = TLS_VERSIONS[self.max_version]
+        if not self.renegotiation:
+            context.options |= getattr(ssl, "OP_NO_RENEGOTIATION", 0)
+        if self.compression:
+            context.options &= ~ssl.OP_NO_COMPRESSION
+        else:
+            context.options |= ssl.OP_NO_COMPRESSION
+        if server_side and self.prioritize_chacha:
+            context.options |= OP_PRIORITIZE_CHACHA
+
+        if self.min_version == "1.2":
+            context.set_ciphers(":".join(AEAD_SUITES[name][1] for name in self.cipher_order()))
+        if self.groups:
+            context.set_ecdh_curve(GROUPS.get(self.groups[0], self.groups[0]))
+
+
+def log_tls_session(side: str, peer: tuple, version: str, cipher: tuple, resumed: bool, identity: str = None):
+    """
+    Trace d'audit d'une connexion TLS établie : version et suite négociées,
+    dans logs/access.log et dans pst_tls_sessions_total.
+
+    Args:
+        cipher (tuple): Résultat de SSLSocket.cipher() / SSLObject.cipher().
+    """
+    name = cipher[0] if cipher else None
+    tls_sessions.inc(labels=(version, name))
+    log_access(
+        side=side,
+        event="tls",
+        peer=f"{peer[0]}:{peer[1]}" if peer else None,
+        identity=identity,
+        version=version,
+        cipher=name,
+        bits=cipher[2] if cipher else None,
+        resumed=resumed,
+    )
+
+
+class SSLContextCache:
+    """
+    Contexte SSL partagé par tout le processus.
+
+    Le contexte n'est reconstruit (via `factory`) que lorsque l'un des fichiers
+    surveillés change sur disque ; la vérification est limitée à une fois
+    toutes les `check_interval` secondes. Le remplacement est atomique : les
+    connexions établies gardent l'ancien contexte, les suivantes utilisent le
+    nouveau. Si la reconstruction échoue (fichiers en cours d'écriture, paire
+    clé/certificat incohérente), l'ancien contexte reste en service.
+
+    Attributes:
+        factory (callable): Fonction sans argument retournant un nouveau ssl.SSLContext.
+        paths (list): Fichiers (certificats, CA) dont dépend le contexte.
+        generation (int): Incrémenté à chaque reconstruction.
+    """
+
+    def __init__(self, factory, paths, check_interval: float = 1.0):
+        self.factory = factory
+        self.paths = list(paths)
+        self.check_interval = check_interval
+        self.generation = 0
+        self._context = None
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> ssl.SSLContext:
+        now = time.monotonic()
+        context = self._context
+        if context is not None and now - self._checked_at < self.check_interval:
+            return context
+
+        with self._lock:
+            if self._context is not None and now - self._checked_at < self.check_interval:
+                return self._context
+            signature = file_signature(self.paths)
+            if self._context is None or signature != self._signature:
+                self._rebuild(signature)
+            self._checked_at = now
+            return self._context
+
+    def changed(self) -> bool:
+        """True si un fichier surveillé a changé depuis la dernière construction."""
+        return self._context is not None and file_signature(self.paths) != self._signature
+
+    def reload(self) -> bool:
+        """
+        Reconstruit le contexte sans attendre la prochaine vérification
+        (rechargement explicite). Retourne False si l'ancien contexte est conservé.
+        """
+        with self._lock:
+            generation = self.generation
+            self._rebuild(file_signature(self.paths))
+            self._checked_at = time.monotonic()
+            return self.generation != generation
+
+    def _rebuild(self, signature: tuple):
+        try:
+            context = self.factory()
+        except (ssl.SSLError, OSError, ValueError) as e:
+            if self._context is None:
+                raise
+            # Signature mémorisée : nouvel essai à la prochaine modification
+            self._signature = signature
+            record_error("tls_reload", e)
+            logger.error(f"Rechargement des certificats impossible, contexte précédent conservé : {e}")
+            return
+        self._context = context
+        self._signature = signature
+        self.generation += 1
@@ -0,0 +1,345 @@
+import asyncio
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+
+from utils.protocol import encode_address, parse_address
+from utils.relay import DirectionCounters
+from utils.stats import Stats
+
+# Datagrammes d'une association UDP (SOCKS5 UDP ASSOCIATE) dans un flux du
+# tunnel ouvert avec FLAG_UDP :
+#
+#   longueur (2) | adresse distante (type + adresse + port) | données
+#
+# L'adresse est codée comme dans l'en-tête (utils.protocol.encode_address) :
+# destination dans le sens client → serveur, source dans le sens inverse.
+# Chaque datagramme est une trame autonome, écrite dès sa réception : aucun
+# datagramme n'attend le suivant pour partir.
+FRAME_LEN = struct.Struct("!H")
+SOCKS_UDP_PREFIX = b"\x00\x00\x00"  # RSV (2) + FRAG (1)
+MAX_DATAGRAM = 65507
+MAX_BATCH = 64  # datagrammes lus d'un coup sur un socket d'association
+UDP_BUFFER = 1 << 20  # tampons (octets) des sockets d'association, plafonnés par net.core.rmem_max
+
+# Linux : compteur des datagrammes perdus faute de place dans le tampon de réception
+SO_RXQ_OVFL = getattr(socket, "SO_RXQ_OVFL", 40)
+
+# Associations (associations), mappings NAT créés (mappings), datagrammes et
+# octets par sens (datagrams_upstream, bytes_downstream...), datagrammes
+# abandonnés par motif (dropped_<motif>)
+udp_stats = Stats("udp")
+
+
+def record_drop(reason: str):
+    """
+    Datagramme abandonné : malformed, fragmented, oversize, foreign_source
+    (autre source que l'application associée), unsolicited (réponse sans
+    mapping NAT), nat_full, unresolved, send_error, queue_full
+    (socket_overflow est compté par DatagramSocket).
+    """
+    udp_stats.incr(f"dropped_{reason}")
+
+
+def record_datagram(counters: DirectionCounters, size: int):
+    """Comptabilise un datagramme relayé dans les compteurs de l'association et du processus."""
+    counters.recv_calls += 1
+    counters.send_calls += 1
+    counters.bytes += size
+    udp_stats.incr(f"datagrams_{counters.direction}")
+    udp_stats.incr(f"bytes_{counters.direction}", size)
+
+
+def encode_datagram(host: str, port: int, payload: bytes) -> bytes:
+    """
+    Trame d'un datagramme dans le tunnel.
+
+    Raises:
+        ValueError: Datagramme trop grand pour une trame.
+    """
+    address = encode_address(host, port)
+    size = len(address) + len(payload)
+    if size > 0xFFFF:
+        raise ValueError(f"Datagramme trop grand : {len(payload)} octets")
+    return FRAME_LEN.pack(size) + address + payload
+
+
+class DatagramReader:
+    """Découpe incrémentale du flux du tunnel en datagrammes (encode_datagram)."""
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data: bytes) -> list:
+        """
+        Ajoute `data` et retourne les datagrammes complets : liste de
+        (hôte, port, données).
+
+        Raises:
+            ValueError: Trame invalide (le flux n'est plus exploitable).
+        """
+        buf = self._buf
+        buf += data
+        datagrams = []
+        offset = 0
+        while len(buf) - offset >= FRAME_LEN.size:
+            end = offset + FRAME_LEN.size + FRAME_LEN.unpack_from(buf, offset)[0]
+            if len(buf) < end:
+                break
+            frame = bytes(buf[offset + FRAME_LEN.size:end])
+            address = parse_address(frame)
+            if address is None:
+                raise ValueError("Trame de datagramme tronquée")
+            host, port, consumed = address
+            datagrams.append((host, port, frame[consumed:]))
+            offset = end
+        del buf[:offset]
+        return datagrams
+
+
+def socks_to_frame(data: bytes):
+    """
+    Convertit un datagramme SOCKS5 de l'application (RSV, FRAG, adresse,
+    données ; RFC 1928 §7) en trame du tunnel. Les datagrammes fragmentés
+    (FRAG != 0) ne sont pas pris en charge.
+
+    Returns:
+        tuple[bytes, int] | None: (trame, taille des données), ou None si le
+        datagramme est abandonné (motif comptabilisé).
+    """
+    if len(data) < 4 or data[:2] != b"\x00\x00":
+        record_drop("malformed")
+        return None
+    if data[2] != 0:
+        record_drop("fragmented")
+        return None
+    try:
+        address = parse_address(data, 3)
+    except ValueError:
+        address = None
+    if address is None:
+        record_drop("malformed")
+        return None
+    # L'adresse est déjà codée comme dans le tunnel : elle est reprise telle quelle
+    return FRAME_LEN.pack(len(data) - 3) + data[3:], len(data) - address[2]
+
+
+def encode_socks_udp(host: str, port: int, payload: bytes) -> bytes:
+    """Datagramme SOCKS5 remis à l'application (source host:port)."""
+    return SOCKS_UDP_PREFIX + encode_address(host, port) + payload
+
+
+def unmap_address(sockaddr: tuple) -> tuple:
+    """(IP, port) d'une adresse de socket, IPv4 sans préfixe "::ffff:" (socket double pile)."""
+    host, port = sockaddr[0], sockaddr[1]
+    if host.startswith("::ffff:") and "." in host:
+        host = host[7:]
+    return host, port
+
+
+def open_udp_socket(host: str = None) -> "DatagramSocket":
+    """
+    Socket UDP d'une association. Sans `host` : double pile (IPv6 et IPv4
+    mappée) sur un port éphémère, IPv4 seule si IPv6 est indisponible.
+    """
+    if host is not None:
+        family = socket.AF_INET6 if ":" in host else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.bind((host, 0))
+        return DatagramSocket(sock)
+    try:
+        sock = socket.socket(socket.AF_INET6, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.IPPROTO_IPV6, socket.IPV6_V6ONLY, 0)
+        sock.bind(("::", 0))
+    except OSError:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(("0.0.0.0", 0))
+    return DatagramSocket(sock)
+
+
+class DatagramSocket:
+    """
+    Socket UDP d'une association.
+
+    Les datagrammes déjà arrivés sont lus par lots (recv_batch) : pendant une
+    rafale, ils partent ensemble vers le tunnel, sans qu'aucun n'attende le
+    suivant. Les pertes du noyau (tampon de réception plein) sont comptées
+    grâce à SO_RXQ_OVFL (Linux) dans dropped_socket_overflow.
+
+    Attributes:
+        sock (socket.socket): Socket UDP lié.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self._loop = None
+        self._overflow = 0
+        for option in (socket.SO_RCVBUF, socket.SO_SNDBUF):
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, option, UDP_BUFFER)
+            except OSError:
+                pass
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, SO_RXQ_OVFL, 1)
+            self._ancbufsize = socket.CMSG_SPACE(4)
+        except OSError:
+            self._ancbufsize = 0
+
+    @property
+    def family(self) -> int:
+        return self.sock.family
+
+    def getsockname(self) -> tuple:
+        return self.sock.getsockname()
+
+    def recv_batch(self, block: bool = True) -> list:
+        """
+        Lit un datagramme (en l'attendant si `block`) puis ceux déjà arrivés,
+        au plus MAX_BATCH : liste de (données, adresse). Liste vide en mode
+        bloquant : socket interrompu par abort().
+        """
+        batch = []
+        flags = 0 if block else socket.MSG_DONTWAIT
+        while len(batch) < MAX_BATCH:
+            try:
+                data, ancdata, _, addr = self.sock.recvmsg(MAX_DATAGRAM, self._ancbufsize, flags)
+            except (BlockingIOError, InterruptedError):
+                break
+            if addr is None:
+                break  # shutdown() : réveil des lectures bloquées
+            if ancdata:
+                self._count_overflow(ancdata)
+            batch.append((data, addr))
+            flags = socket.MSG_DONTWAIT
+        return batch
+
+    def _count_overflow(self, ancdata: list):
+        for level, kind, value in ancdata:
+            if level == socket.SOL_SOCKET and kind == SO_RXQ_OVFL and len(value) >= 4:
+                # Compteur cumulé du socket : seul l'écart depuis la lecture précédente est ajouté
+                total = struct.unpack("=I", value[:4])[0]
+                if total > self._overflow:
+                    udp_stats.incr("dropped_socket_overflow", total - self._overflow)
+                self._overflow = total
+
+    def sendto(self, data: bytes, addr: tuple) -> bool:
+        """Envoi sans attente ; False si le datagramme est abandonné (send_error)."""
+        try:
+            self.sock.sendto(data, addr)
+            return True
+        except OSError:
+            record_drop("send_error")
+            return False
+
+    def add_reader(self, on_datagram):
+        """Moteur asyncio : appelle on_datagram(données, adresse) pour chaque datagramme reçu."""
+        self.sock.setblocking(False)
+        self._loop = asyncio.get_running_loop()
+        self._loop.add_reader(self.sock.fileno(), self._on_readable, on_datagram)
+
+    def _on_readable(self, on_datagram):
+        for data, addr in self.recv_batch(block=False):
+            on_datagram(data, addr)
+
+    def abort(self):
+        """Réveille depuis un autre thread une lecture bloquée (voir utils.relay.abort)."""
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            # Socket non connecté : ENOTCONN, mais les lectures en attente sont réveillées
+            pass
+
+    def close(self):
+        if self._loop is not None and self.sock.fileno() >= 0:
+            self._loop.remove_reader(self.sock.fileno())
+            self._loop = None
+        self.sock.close()
+
+
+class NatTable:
+    """
+    Table de correspondance d'une association UDP, façon NAT à filtrage
+    dépendant de l'adresse et du port (RFC 4787) : un seul port local par
+    association, et seules les réponses des destinations contactées depuis
+    moins de `timeout` secondes sont relayées vers le client.
+
+    Les entrées sont rangées par échéance (chaque envoi repousse la sienne
+    en fin de table) : l'expiration ne parcourt que les entrées échues.
+
+    Attributes:
+        timeout (float): Durée de vie (s) d'une correspondance sans envoi.
+        max_entries (int): Correspondances simultanées (0 : illimité).
+    """
+
+    def __init__(self, timeout: float = 60, max_entries: int = 256):
+        self.timeout = timeout
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def outbound(self, key: tuple) -> bool:
+        """Envoi vers `key` (IP, port) : crée ou prolonge la correspondance. False si la table est pleine."""
+        now = time.monotonic()
+        with self._lock:
+            if key in self._entries:
+                self._entries[key] = now + self.timeout
+                self._entries.move_to_end(key)
+                return True
+            self._expire(now)
+            if self.max_entries and len(self._entries) >= self.max_entries:
+                return False
+            self._entries[key] = now + self.timeout
+        udp_stats.incr("mappings")
+        return True
+
+    def inbound(self, key: tuple) -> bool:
+        """Datagramme reçu de `key` (IP, port) : True s'il correspond à une correspondance vivante."""
+        expires = self._entries.get(key)
+        return expires is not None and expires >= time.monotonic()
+
+    def _expire(self, now: float):
+        while self._entries:
+            key, expires = next(iter(self._entries.items()))
+            if expires >= now:
+                break
+            del self._entries[key]
+
+
+class AsyncFrameSender:
+    """
+    Émission asyncio des trames d'une association vers le tunnel : une file
+    bornée et une seule tâche d'écriture, qui envoie d'un bloc les trames en
+    attente. Si le tunnel n'avance pas, les datagrammes suivants sont
+    abandonnés (queue_full) au lieu de s'accumuler.
+
+    Attributes:
+        stream: Flux du tunnel (interface read / write / close).
+        counters (DirectionCounters): Compteurs du sens émis.
+    """
+
+    def __init__(self, stream, counters: DirectionCounters, max_pending: int = 256):
+        self.stream = stream
+        self.counters = counters
+        self._queue = asyncio.Queue(max_pending)
+
+    def submit(self, frame: bytes, size: int):
+        try:
+            self._queue.put_nowait((frame, size))
+        except asyncio.QueueFull:
+            record_drop("queue_full")
+
+    async def run(self):
+        """Écrit les trames jusqu'à une erreur du tunnel (tâche à annuler en fin d'association)."""
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            while not queue.empty():
+                batch.append(queue.get_nowait())
+            await self.stream.write(b"".join(frame for frame, _ in batch))
+            for _, size in batch:
+                record_datagram(self.counters, size)
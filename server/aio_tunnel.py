@@ -0,0 +1,224 @@
+import asyncio
+import ssl
+import time
+
+from forward_handler import log_forward_access
+from tunnel import TLSServerTunnel, record_handshake, record_handshake_failure
+from udp_relay import UDPForwarder
+from utils.admission import peer_identity
+from utils.aio_mux import AsyncMuxSession
+from utils.aio_streams import AsyncTCPStream, AsyncTLSStream, relay, run_event_loop
+from utils.compression import AsyncCompressedStream
+from utils.lifecycle import ConfigWatcher, install_signal_handlers, wait_drained_async
+from utils.logger import connection_logger, get_logger
+from utils.metrics import record_error
+from utils.profiling import stage_timer
+from utils.protocol import FLAG_UDP, parse_request
+from utils.sockopts import enable_fast_open_listener, tune_socket
+from utils.tls import log_tls_session
+
+logger = get_logger("SERVER")
+
+
+class AsyncTLSServerTunnel:
+    """
+    Moteur asyncio du serveur : une seule boucle d'événements pour toutes les
+    connexions, sans thread par connexion. Le protocole (ligne cible ou session
+    multiplexée) est le même que celui de TLSServerTunnel / ForwardingHandler.
+
+    Attributes:
+        tunnel (TLSServerTunnel): Fournit le contexte SSL, le connecteur de cibles et les limites d'admission partagés.
+    """
+
+    def __init__(self, tunnel: TLSServerTunnel):
+        self.tunnel = tunnel
+
+    def start(self, host: str = "0.0.0.0", port: int = 8443, reuse_port: bool = False, supervised: bool = False):
+        """
+        Lance le serveur (bloquant), sur uvloop s'il est installé, jusqu'à la
+        fin d'un arrêt progressif (voir TLSServerTunnel.drain).
+
+        Args:
+            host (str): Adresse d'écoute (par défaut : 0.0.0.0).
+            port (int): Port d'écoute (par défaut : 8443).
+            reuse_port (bool): SO_REUSEPORT, pour plusieurs processus sur le même port.
+            supervised (bool): Worker d'un WorkerSupervisor, qui surveille lui-même les fichiers.
+        """
+        run_event_loop(self._serve(host, port, reuse_port, supervised))
+
+    async def _serve(self, host: str, port: int, reuse_port: bool = False, supervised: bool = False):
+        tunnel = self.tunnel
+        server = await asyncio.start_server(
+            self._handle_connection, host, port,
+            reuse_address=True,
+            reuse_port=reuse_port or None,
+            backlog=tunnel.config.backlog,
+        )
+        for sock in server.sockets:
+            enable_fast_open_listener(sock)
+        logger.info(f"En écoute sur {host}:{port} (moteur asyncio)")
+        drain_requested = asyncio.Event()
+        install_signal_handlers(tunnel.reload, drain_requested.set, asyncio.get_running_loop())
+        tasks = [asyncio.ensure_future(tunnel.reaper.run_async())]
+        if not supervised:
+            watcher = ConfigWatcher(tunnel.changed, tunnel.reload, tunnel.config.reload_interval)
+            tasks.append(asyncio.ensure_future(watcher.run_async()))
+        try:
+            await drain_requested.wait()
+            logger.info(
+                f"Arrêt progressif : {tunnel.admission.active} connexion(s) en cours, "
+                f"délai maximal {tunnel.config.drain_timeout:g} s"
+            )
+            # Sans attendre wait_closed() : il attendrait aussi la fin des connexions
+            server.close()
+            tunnel.admission.close()
+            await wait_drained_async(lambda: tunnel.admission.active, tunnel.config.drain_timeout)
+            logger.info("Serveur arrêté")
+        finally:
+            server.close()
+            for task in tasks:
+                task.cancel()
+
+    async def _handle_connection(self, reader, writer):
+        addr = writer.get_extra_info("peername")
+        admission = self.tunnel.admission
+        if not admission.try_handshake():
+            writer.close()
+            return
+        tune_socket(writer.get_extra_info("socket"), "tunnel")
+        connection_logger(logger).info(f"Connexion entrante depuis {addr}")
+        stream = AsyncTLSStream(reader, writer, self.tunnel.context_cache.get(), server_side=True)
+        start = time.monotonic()
+        try:
+            await stream.handshake(timeout=self.tunnel.config.handshake_timeout)
+        except (asyncio.TimeoutError, ssl.SSLError, OSError) as e:
+            record_handshake_failure(e)
+            logger.error(f"Handshake échoué avec {addr} : {e}")
+            stream.close()
+            return
+        finally:
+            admission.handshake_done()
+        record_handshake(time.monotonic() - start, stream.sslobj.session_reused)
+        timer = stage_timer(start)
+        timer.mark("handshake")
+        identity = peer_identity(stream.sslobj.getpeercert())
+        log_tls_session("server", addr, stream.sslobj.version(), stream.sslobj.cipher(), stream.sslobj.session_reused, identity)
+        limiter = self.tunnel.limiter(stream.sslobj, identity)
+
+        try:
+            request, leftover = await self._read_request(stream)
+            if request.mux:
+                logger.info("Session multiplexée ouverte")
+                session = AsyncMuxSession(
+                    stream,
+                    is_client=False,
+                    on_open=lambda mux_stream: self._handle_stream(mux_stream, addr, identity, limiter),
+                )
+                admission.open_session(session)
+                try:
+                    await session.run(leftover)
+                finally:
+                    admission.close_session(session)
+                logger.info("Session multiplexée fermée")
+                return
+
+            await self._forward(stream, request, leftover, addr, identity, limiter, timer, mux=False)
+        except asyncio.CancelledError:
+            # Fin de drain : la boucle s'arrête et annule les connexions restantes.
+            # Terminer normalement évite une trace d'asyncio (Python < 3.12).
+            pass
+        except Exception as e:
+            record_error("forward", e)
+            logger.debug(f"Connexion {addr} terminée : {e}")
+        finally:
+            stream.close()
+
+    async def _handle_stream(self, stream, peer: tuple, identity: str, limiter):
+        timer = stage_timer()
+        try:
+            request, leftover = await self._read_request(stream)
+            if not request.mux:
+                await self._forward(stream, request, leftover, peer, identity, limiter, timer, mux=True)
+        except Exception as e:
+            record_error("forward", e)
+        finally:
+            stream.close()
+
+    async def _read_request(self, stream):
+        """Lit l'en-tête d'ouverture (binaire ou ligne) ; retourne (requête, surplus)."""
+        return await asyncio.wait_for(self._read_request_header(stream), self.tunnel.config.handshake_timeout)
+
+    async def _read_request_header(self, stream):
+        buf = b""
+        while True:
+            result = parse_request(buf)
+            if result is not None:
+                request, consumed = result
+                return request, buf[consumed:]
+            chunk = await stream.read(4096)
+            if not chunk:
+                raise ConnectionError("Aucune adresse cible reçue")
+            buf += chunk
+
+    async def _forward(self, stream, request, leftover: bytes, peer: tuple, identity: str, limiter, timer,
+                       mux: bool):
+        log = connection_logger(logger)
+        start = time.monotonic()
+        timer.mark("header")
+        counters = error = None
+        target_host, target_port = request.host, request.port
+        admission = self.tunnel.admission
+        if limiter is not None and not limiter.admit():
+            log.info(f"Connexion refusée pour {identity} (débit de connexions dépassé)")
+            log_forward_access(peer, request, mux, start, None, ConnectionRefusedError("Débit de connexions dépassé"))
+            return
+        if not admission.try_acquire(identity):
+            log.info(f"Connexion refusée pour {identity} (limite atteinte)")
+            log_forward_access(peer, request, mux, start, None, ConnectionRefusedError("Limite de connexions atteinte"))
+            return
+        # Fermés par le ramasseur si la connexion reste inactive
+        streams = [stream]
+        tracker = self.tunnel.reaper.track(lambda: [s.close() for s in streams])
+        try:
+            if request.flags & FLAG_UDP:
+                if not self.tunnel.config.udp_enabled:
+                    log.info("Association UDP refusée (udp.enabled: false)")
+                    raise ConnectionRefusedError("UDP désactivé")
+                log.info("Association UDP ouverte")
+                forwarder = UDPForwarder(stream, self.tunnel.config, self.tunnel.connector, tracker)
+                counters = await forwarder.run_async(leftover)
+                timer.mark("relay")
+                return
+            # Données anticipées : au plus EARLY_DATA_MAX octets (parse_request)
+            early_data = bytearray(leftover)
+            while len(early_data) < request.early_data_len:
+                chunk = await stream.read(request.early_data_len - len(early_data))
+                if not chunk:
+                    break
+                early_data += chunk
+            leftover = bytes(early_data)
+            if request.codecs:
+                config = self.tunnel.config
+                stream = await AsyncCompressedStream.server(
+                    stream, request.codecs, config.compression_enabled, config.compression_level, initial=leftover
+                )
+                leftover = b""
+            log.info(f"Requête de connexion vers {target_host}:{target_port}")
+
+            # Données déjà arrivées avec la requête : transmises avec la connexion (TCP Fast Open)
+            target_sock = await self.tunnel.connector.connect_async(target_host, target_port, timer, leftover)
+            tune_socket(target_sock, "target")
+            target_reader, target_writer = await asyncio.open_connection(sock=target_sock)
+            target = AsyncTCPStream(target_reader, target_writer)
+            streams.append(target)
+            timer.mark("connect")
+            log.info("Connexion établie")
+            counters = await relay(stream, target, tracker, limiter)
+            timer.mark("relay")
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            tracker.release()
+            admission.release(identity)
+            log_forward_access(peer, request, mux, start, counters, error, timer.as_dict())
@@ -2,6 +2,9 @@ from pathlib import Path
 import os
 
 from utils.configLoader import ConfigLoader
+from utils.sockopts import socket_profile
+from utils.ratelimit import RateLimit
+from utils.tls import TLSPolicy
 
 
 class ServerConfig:
@@ -11,13 +14,186 @@ class ServerConfig:
     Attributes:
         listen_host (str): IP d'écoute du serveur.
         listen_port (int): Port d'écoute du serveur.
+        engine (str): "threaded" (un thread par connexion) ou "asyncio" (boucle d'événements).
+        backlog (int): File d'attente du listen().
+        workers (int): Nombre de processus serveur (SO_REUSEPORT) ; 1 = processus unique.
+        handshake_workers (int): Nombre de handshakes TLS menés en parallèle (moteur "threaded").
+        handshake_timeout (float): Délai maximal (s) d'un handshake TLS.
+        ktls_enabled (bool): Déchargement kTLS et relais par splice (Linux, si disponible).
+        relay_min_buffer (int): Taille minimale de lecture du relais.
+        relay_initial_buffer (int): Taille de lecture initiale du relais.
+        relay_max_buffer (int): Taille maximale de lecture du relais.
+        relay_adaptive (bool): Ajuste la taille de lecture au type de trafic.
+        dns_cache_size (int): Nombre maximal d'hôtes dans le cache DNS.
+        dns_ttl (float): Durée de vie (s) d'une résolution en cache.
+        dns_negative_ttl (float): Durée de vie (s) d'un échec de résolution en cache.
+        connect_timeout (float): Délai maximal (s) de connexion à une cible.
+        connect_attempt_delay (float): Délai (s) entre deux tentatives Happy Eyeballs.
+        idle_timeout (float): Inactivité maximale (s) d'une connexion avant fermeture (0 : illimitée).
+        half_close_timeout (float): Inactivité maximale (s) après la fin d'un des deux sens (0 : illimitée).
+        keepalive_enabled (bool): Keepalive TCP sur tous les sockets.
+        keepalive_idle (int): Inactivité (s) avant la première sonde keepalive.
+        keepalive_interval (int): Intervalle (s) entre deux sondes.
+        keepalive_count (int): Sondes sans réponse avant de déclarer le pair perdu.
+        max_connections (int): Connexions relayées simultanées par processus (0 : illimité).
+        max_connections_per_client (int): Connexions simultanées par certificat client (CN, 0 : illimité).
+        max_pending_handshakes (int): Handshakes TLS en attente ou en cours (0 : illimité).
+        rate_limits_enabled (bool): Compte l'usage par identité et applique les limites de débit.
+        rate_limit_default (RateLimit): Limites de débit d'une identité sans entrée propre.
+        rate_limit_identities (dict[str, RateLimit]): Limites par CN ou par empreinte "sha256:<hex>".
+        compression_enabled (bool): Accepte la compression des flux proposée par les clients.
+        compression_level (int): Niveau de compression (None : défaut de l'algorithme).
+        udp_enabled (bool): Accepte les associations UDP (SOCKS5 UDP ASSOCIATE) des clients.
+        udp_nat_timeout (float): Durée de vie (s) d'une correspondance NAT sans envoi.
+        udp_max_mappings (int): Correspondances NAT simultanées par association (0 : illimité).
+        metrics_enabled (bool): Expose les métriques en HTTP (/metrics).
+        metrics_host (str): Adresse d'écoute de /metrics (bouclage uniquement).
+        metrics_port (int): Port d'écoute de /metrics.
+        stage_timing (bool): Mesure la durée de chaque étape des connexions (histogrammes, journal d'accès).
+        profile_seconds (float): Durée (s) d'un profil déclenché par SIGUSR2 ou /debug/profile.
+        profile_interval (float): Période (s) d'échantillonnage des piles pendant un profil.
+        socket_profiles (dict[str, SocketProfile]): Options TCP par lien : tunnel (connexions des clients), target (connexions aux cibles).
+        fast_open (bool): TCP Fast Open sur les connexions sortantes et l'écoute du tunnel.
+        tls_policy (TLSPolicy): Versions, AEAD, groupes d'échange de clés et options TLS (section tls).
+        reload_interval (float): Période (s) de surveillance des fichiers de configuration et de certificats (0 : SIGHUP uniquement).
+        drain_timeout (float): Durée maximale (s) d'un arrêt progressif avant fermeture des connexions restantes.
     """
 
+    # Paramètres lus au démarrage seulement : un rechargement les ignore
+    RESTART_REQUIRED = (
+        "listen_host", "listen_port", "engine", "backlog", "workers", "handshake_workers",
+        "ktls_enabled", "metrics_enabled", "metrics_host", "metrics_port",
+    )
+
     def __init__(self):
-        loader = ConfigLoader(
-            yaml_path=os.path.join(Path(__file__).resolve().parent, "config", "server_config.yaml")
+        # SERVER_CONFIG_FILE permet d'utiliser un autre fichier (banc de test...)
+        self._loader = ConfigLoader(
+            yaml_path=os.getenv("SERVER_CONFIG_FILE")
+            or os.path.join(Path(__file__).resolve().parent, "config", "server_config.yaml")
         )
-        config = loader.load()
+        self._parse(self._loader.load())
+
+    def changed(self) -> bool:
+        """True si le fichier de configuration a été modifié depuis son chargement."""
+        return self._loader.changed()
+
+    def reload(self) -> list:
+        """
+        Relit le fichier de configuration. Les nouvelles valeurs s'appliquent
+        aux connexions suivantes ; en cas d'erreur (YAML ou valeur invalide),
+        l'exception est propagée et la configuration reste inchangée.
 
+        Returns:
+            list: Paramètres modifiés qui ne prendront effet qu'au redémarrage.
+        """
+        staged = object.__new__(type(self))
+        staged._parse(self._loader.load())
+        ignored = [name for name in self.RESTART_REQUIRED if getattr(staged, name) != getattr(self, name)]
+        for name in self.RESTART_REQUIRED:
+            setattr(staged, name, getattr(self, name))
+        vars(self).update(vars(staged))
+        return ignored
+
+    def _parse(self, config: dict):
         self.listen_host = config.get("server", {}).get("listen_host")
         self.listen_port = int(config.get("server", {}).get("listen_port"))
+        self.engine = config.get("server", {}).get("engine", "threaded")
+        self.backlog = int(config.get("server", {}).get("backlog", 1024))
+        self.workers = int(config.get("server", {}).get("workers", 1))
+        self.handshake_workers = int(config.get("server", {}).get("handshake_workers", 32))
+        self.handshake_timeout = float(config.get("server", {}).get("handshake_timeout", 10))
+        self.ktls_enabled = bool(config.get("ktls", {}).get("enabled", False))
+
+        relay = config.get("relay", {})
+        self.relay_min_buffer = int(relay.get("min_buffer", 4096))
+        self.relay_initial_buffer = int(relay.get("initial_buffer", 16384))
+        self.relay_max_buffer = int(relay.get("max_buffer", 262144))
+        self.relay_adaptive = bool(relay.get("adaptive", True))
+
+        dns = config.get("dns", {})
+        self.dns_cache_size = int(dns.get("cache_size", 4096))
+        self.dns_ttl = float(dns.get("ttl", 60))
+        self.dns_negative_ttl = float(dns.get("negative_ttl", 5))
+
+        connect = config.get("connect", {})
+        self.connect_timeout = float(connect.get("timeout", 10))
+        self.connect_attempt_delay = float(connect.get("attempt_delay", 0.25))
+
+        timeouts = config.get("timeouts", {})
+        self.idle_timeout = float(timeouts.get("idle", 300))
+        self.half_close_timeout = float(timeouts.get("half_close", 60))
+        keepalive = timeouts.get("keepalive", {})
+        self.keepalive_enabled = bool(keepalive.get("enabled", True))
+        self.keepalive_idle = int(keepalive.get("idle", 60))
+        self.keepalive_interval = int(keepalive.get("interval", 10))
+        self.keepalive_count = int(keepalive.get("count", 5))
+
+        admission = config.get("admission", {})
+        self.max_connections = int(admission.get("max_connections", 0))
+        self.max_connections_per_client = int(admission.get("max_connections_per_client", 0))
+        self.max_pending_handshakes = int(admission.get("max_pending_handshakes", 1024))
+
+        rate_limits = config.get("rate_limits", {})
+        self.rate_limits_enabled = bool(rate_limits.get("enabled", False))
+        default = rate_limits.get("default") or {}
+        self.rate_limit_default = self._parse_rate_limit(default)
+        self.rate_limit_identities = {
+            str(identity): self._parse_rate_limit({**default, **(limits or {})})
+            for identity, limits in (rate_limits.get("identities") or {}).items()
+        }
+
+        compression = config.get("compression", {})
+        self.compression_enabled = bool(compression.get("enabled", True))
+        self.compression_level = compression.get("level")
+
+        udp = config.get("udp", {})
+        self.udp_enabled = bool(udp.get("enabled", True))
+        self.udp_nat_timeout = float(udp.get("nat_timeout", 60))
+        self.udp_max_mappings = int(udp.get("max_mappings", 256))
+
+        metrics = config.get("metrics", {})
+        self.metrics_enabled = bool(metrics.get("enabled", False))
+        self.metrics_host = metrics.get("host", "127.0.0.1")
+        self.metrics_port = int(metrics.get("port", 9100))
+
+        profiling = config.get("profiling", {})
+        self.stage_timing = bool(profiling.get("stage_timing", False))
+        self.profile_seconds = float(profiling.get("sample_seconds", 10))
+        self.profile_interval = float(profiling.get("sample_interval", 0.005))
+        if self.profile_seconds <= 0 or self.profile_interval <= 0:
+            raise ValueError("profiling.sample_seconds et profiling.sample_interval doivent être positifs")
+
+        sockets = config.get("sockets", {})
+        self.socket_profiles = {
+            leg: socket_profile(str(sockets.get(leg, "interactive")), sockets.get("profiles"))
+            for leg in ("tunnel", "target")
+        }
+        self.fast_open = bool(sockets.get("fast_open", False))
+
+        tls = config.get("tls", {})
+        self.tls_policy = TLSPolicy(
+            min_version=str(tls.get("min_version", "1.2")),
+            max_version=str(tls.get("max_version", "1.3")),
+            ciphers=list(tls.get("ciphers", ["aes-128-gcm", "aes-256-gcm", "chacha20-poly1305"])),
+            prefer_fastest=bool(tls.get("prefer_fastest", True)),
+            groups=list(tls.get("groups", ["X25519"])),
+            renegotiation=bool(tls.get("renegotiation", False)),
+            compression=bool(tls.get("compression", False)),
+            prioritize_chacha=bool(tls.get("prioritize_chacha", True)),
+        )
+
+        lifecycle = config.get("lifecycle", {})
+        self.reload_interval = float(lifecycle.get("reload_interval", 2))
+        self.drain_timeout = float(lifecycle.get("drain_timeout", 30))
+
+    @staticmethod
+    def _parse_rate_limit(limits: dict) -> RateLimit:
+        limit = RateLimit(
+            bytes_per_second=float(limits.get("bytes_per_second", 0)),
+            burst_bytes=float(limits.get("burst_bytes", 0)),
+            connections_per_second=float(limits.get("connections_per_second", 0)),
+            burst_connections=float(limits.get("burst_connections", 0)),
+        )
+        if min(vars(limit).values()) < 0:
+            raise ValueError(f"Limite de débit négative : {limits}")
+        return limit
@@ -1,90 +1,263 @@
 import socket
+import ssl
 import threading
-from utils.logger import get_logger
+import time
+
+from config import ServerConfig
+from ktls import ktls_stats, ktls_status, splice_pipe
+from resolver import TargetConnector
+from udp_relay import UDPForwarder
+from utils.admission import AdmissionControl
+from utils.compression import CompressedSocket
+from utils.logger import connection_logger, get_logger, log_access
+from utils.metrics import record_error
+from utils.mux import MuxSession
+from utils.profiling import stage_timer
+from utils.protocol import FLAG_UDP, recv_request
+from utils.ratelimit import IdentityLimiter
+from utils.reaper import ConnectionReaper
+from utils.relay import RelayPolicy, abort, relay
+from utils.sockopts import tune_socket
 
 logger = get_logger("SERVER") 
 
 
+def log_forward_access(peer: tuple, request, mux: bool, start: float, counters, error: Exception,
+                       stages: dict = None):
+    """
+    Enregistrement d'accès d'une connexion relayée vers une cible (moteurs threaded et asyncio).
+    `stages` : durées des étapes (utils.profiling.StageTimer.as_dict), ou None.
+    """
+    log_access(
+        side="server",
+        peer=f"{peer[0]}:{peer[1]}" if peer else None,
+        target="udp" if request.flags & FLAG_UDP else f"{request.host}:{request.port}",
+        mux=mux,
+        duration_ms=round((time.monotonic() - start) * 1000, 1),
+        **(counters.as_dict() if counters else {}),
+        error=type(error).__name__ if error else None,
+        **({"stages": stages} if stages else {}),
+    )
+
+
 class ForwardingHandler(threading.Thread):
     """
     Gère une connexion TLS entrante et la redirige vers la cible.
+
+    La cible est annoncée par l'en-tête binaire versionné (utils.protocol) ou,
+    pour les anciens clients, par une ligne "host:port\n".
+    La connexion peut aussi annoncer une session multiplexée (MUX_PREFACE) :
+    chaque flux ouvert par le client est alors traité par son propre
+    ForwardingHandler, avec le même protocole que le mode une-connexion-par-flux.
+    Un flux ouvert avec FLAG_UDP porte les datagrammes d'une association
+    SOCKS5 UDP (udp_relay.UDPForwarder).
+
+    Attributes:
+        client_sock (socket.socket): Connexion TLS ou flux multiplexé (MuxStream).
+        allow_mux (bool): Autorise le passage en mode multiplexé.
+        config (ServerConfig): Configuration du serveur.
+        connector (TargetConnector): Connexion aux cibles (cache DNS, Happy Eyeballs).
+        peer (tuple): Adresse du client du tunnel (pour le journal d'accès).
+        admission (AdmissionControl): Limites de connexions (globale et par certificat).
+        identity (str): CN du certificat du client du tunnel.
+        reaper (ConnectionReaper): Ferme la connexion si elle reste inactive, ou None.
+        limiter (IdentityLimiter): Usage et limites de débit de l'identité (utils.ratelimit), ou None.
+        timer (StageTimer): Horodatage des étapes déjà commencé (handshake), ou None (utils.profiling).
     """
 
-    def __init__(self, client_sock: socket.socket):
-        super().__init__()
+    def __init__(self, client_sock: socket.socket, allow_mux: bool = True, config: ServerConfig = None,
+                 connector: TargetConnector = None, peer: tuple = None,
+                 admission: AdmissionControl = None, identity: str = None, reaper: ConnectionReaper = None,
+                 limiter: IdentityLimiter = None, timer=None):
+        # daemon : la fin du processus (drain échu) n'attend pas les relais restants
+        super().__init__(daemon=True)
         self.client_sock = client_sock
+        self.allow_mux = allow_mux
+        self.config = config
+        self.connector = connector or TargetConnector()
+        self.peer = peer
+        self.admission = admission or AdmissionControl()
+        self.identity = identity
+        self.reaper = reaper
+        self.limiter = limiter
+        self.timer = timer
+        self._target_sock = None
 
     def run(self):
+        log = connection_logger(logger)
+        start = time.monotonic()
+        request = target_sock = counters = error = None
+        admitted = False
+        timer = self.timer if self.timer is not None else stage_timer(start)
+        # Surveillé dès maintenant : un client qui n'envoie jamais sa requête est aussi fermé
+        tracker = self.reaper.track(self._abort) if self.reaper else None
         try:
-            # Lire la ligne cible + garder ce qui suit dans le buffer
-            target_line, leftover = self._recv_until_newline(self.client_sock)
-            if not target_line:
-                logger.debug("Erreur : aucune adresse cible reçue.")
+            # Lire l'en-tête (binaire ou ligne) + garder ce qui suit dans le buffer
+            request, leftover = recv_request(self.client_sock)
+            if request is None:
+                log.debug("Erreur : aucune adresse cible reçue.")
                 self.client_sock.close()
                 return
 
-            target_host, target_port = self._parse_target(target_line)
-            logger.info(f"Requête de connexion vers {target_host}:{target_port}")
+            if request.mux:
+                # Session persistante : seuls ses flux sont surveillés
+                if tracker is not None:
+                    tracker.release()
+                if self.allow_mux:
+                    self._serve_mux(leftover)
+                request = None
+                return
+            timer.mark("header")
+
+            # Au-delà des limites : fermeture immédiate du flux
+            if self.limiter is not None and not self.limiter.admit():
+                log.info(f"Connexion refusée pour {self.identity} (débit de connexions dépassé)")
+                error = ConnectionRefusedError("Débit de connexions dépassé")
+                return
+            admitted = self.admission.try_acquire(self.identity)
+            if not admitted:
+                log.info(f"Connexion refusée pour {self.identity} (limite atteinte)")
+                error = ConnectionRefusedError("Limite de connexions atteinte")
+                return
 
-            # Connexion réelle vers la cible
-            target_sock = socket.create_connection((target_host, target_port))
-            logger.info("Connexion établie")
+            if request.flags & FLAG_UDP:
+                if self.config is not None and not self.config.udp_enabled:
+                    log.info("Association UDP refusée (udp.enabled: false)")
+                    error = ConnectionRefusedError("UDP désactivé")
+                    return
+                log.info("Association UDP ouverte")
+                counters = UDPForwarder(self.client_sock, self.config, self.connector, tracker).run(leftover)
+                timer.mark("relay")
+                log.debug(f"Association UDP terminée : {counters.as_dict()}")
+                return
 
-            # Si des données de la requête sont déjà arrivées, on les forward immédiatement
+            target_host, target_port = request.host, request.port
+            # Données anticipées annoncées : les transmettre avec la connexion
+            # (au plus EARLY_DATA_MAX octets, borne vérifiée par parse_request)
+            early_data = bytearray(leftover)
+            while len(early_data) < request.early_data_len:
+                chunk = self.client_sock.recv(request.early_data_len - len(early_data))
+                if not chunk:
+                    break
+                early_data += chunk
+            leftover = bytes(early_data)
+
+            if request.codecs:
+                # Flux compressé : ce qui suit l'en-tête est déjà en trames
+                self.client_sock = CompressedSocket.server(
+                    self.client_sock, request.codecs, *self._compression(), initial=leftover
+                )
+                leftover = b""
+
+            log.info(f"Requête de connexion vers {target_host}:{target_port}")
+
+            # Connexion réelle vers la cible ; les données déjà arrivées avec la
+            # requête sont transmises aussitôt (dans le SYN avec TCP Fast Open)
+            target_sock = self._target_sock = self.connector.connect(target_host, target_port, timer, leftover)
+            tune_socket(target_sock, "target")
+            timer.mark("connect")
+            log.info("Connexion établie")
             if leftover:
-                logger.info(f"Données leftover à forward : {leftover}")
-                target_sock.sendall(leftover)
+                log.debug(f"{len(leftover)} octets reçus avec l'en-tête transmis à la cible")
 
-            # Relais bidirectionnel
-            self._relay(self.client_sock, target_sock)
+            # Relais bidirectionnel (dans le noyau si kTLS est actif)
+            splice_rx, splice_tx = self._ktls_directions(target_sock, log)
+            counters = relay(
+                self.client_sock,
+                target_sock,
+                self._relay_policy(),
+                fast_upstream=splice_pipe if splice_rx else None,
+                fast_downstream=splice_pipe if splice_tx else None,
+                tracker=tracker,
+                limiter=self.limiter,
+            )
+            timer.mark("relay")
+            log.debug(f"Relais terminé vers {target_host}:{target_port} : {counters.as_dict()}")
 
         except Exception as e:
-            pass
+            error = e
+            record_error("forward", e)
         finally:
-            try:
-                self.client_sock.close()
-            except Exception:
-                pass
-
-    def _recv_until_newline(self, sock: socket.socket) -> tuple[str, bytes]:
-        data = b""
-        while not data.endswith(b"\n"):
-            chunk = sock.recv(1)
-            if not chunk:
-                break
-            data += chunk
-        # tout ce qui reste dans le buffer TLS est déjà lu par recv,
-        # donc on retourne aussi le surplus
-        line, _, rest = data.partition(b"\n")
-        return line.decode().strip(), rest
-
-    def _parse_target(self, line: str) -> tuple[str, int]:
-        if ":" not in line:
-            raise ValueError(f"Adresse invalide reçue : {line}")
-        host, port_str = line.strip().split(":")
-        return host, int(port_str)
-
-    def _relay(self, sock1, sock2):
-        def pipe(src, dst, label):
-            try:
-                while True:
-                    data = src.recv(4096)
-                    if not data:
-                        break
-                    dst.sendall(data)
-            except Exception as e:
-                pass
-            finally:
+            if tracker is not None:
+                tracker.release()
+            if admitted:
+                self.admission.release(self.identity)
+            for sock in (self.client_sock, target_sock):
                 try:
-                    dst.shutdown(socket.SHUT_WR)
+                    if sock is not None:
+                        sock.close()
                 except Exception:
                     pass
+            if request is not None:
+                self._log_access(request, start, counters, error, timer.as_dict())
+
+    def _abort(self):
+        # Appelé par le ramasseur (autre thread) : réveille les lectures bloquées
+        abort(self.client_sock)
+        if self._target_sock is not None:
+            abort(self._target_sock)
+
+    def _log_access(self, request, start: float, counters, error: Exception, stages: dict = None):
+        log_forward_access(self.peer, request, not self.allow_mux, start, counters, error, stages)
+
+    def _serve_mux(self, initial: bytes):
+        """Démultiplexe les flux de la session jusqu'à sa fermeture."""
+        logger.info("Session multiplexée ouverte")
+        session = MuxSession(
+            self.client_sock,
+            is_client=False,
+            on_open=lambda stream: ForwardingHandler(
+                stream,
+                allow_mux=False,
+                config=self.config,
+                connector=self.connector,
+                peer=self.peer,
+                admission=self.admission,
+                identity=self.identity,
+                reaper=self.reaper,
+                limiter=self.limiter,
+            ).start(),
+        )
+        # Arrêt progressif du serveur : le client est invité à ouvrir ses flux ailleurs
+        self.admission.open_session(session)
+        try:
+            session.run(initial)
+        finally:
+            self.admission.close_session(session)
+        logger.info("Session multiplexée fermée")
+
+    def _ktls_directions(self, target_sock: socket.socket, log) -> tuple[bool, bool]:
+        """
+        Détermine les sens du relais pouvant passer par splice :
+        (tunnel→cible si réception kTLS, cible→tunnel si émission kTLS).
+        """
+        if not (self.config and self.config.ktls_enabled and isinstance(self.client_sock, ssl.SSLSocket)):
+            return False, False
+
+        tx, rx = ktls_status(self.client_sock)
+        if tx or rx:
+            ktls_stats.incr("connections_ktls_tx", int(tx))
+            ktls_stats.incr("connections_ktls_rx", int(rx))
+            log.info(f"kTLS actif (émission={tx}, réception={rx})")
+        else:
+            ktls_stats.incr("connections_userspace")
 
-        t1 = threading.Thread(target=pipe, args=(sock1, sock2, "tunnel→cible[request]"), daemon=True)
-        t2 = threading.Thread(target=pipe, args=(sock2, sock1, "cible→tunnel[response]"), daemon=True)
+        # Vider le texte clair déjà déchiffré par OpenSSL avant de lire le socket brut
+        while rx and self.client_sock.pending():
+            target_sock.sendall(self.client_sock.recv(self.client_sock.pending()))
+        return rx, tx
 
-        t1.start()
-        t2.start()
-        t1.join()
-        t2.join()
+    def _compression(self) -> tuple[bool, int]:
+        if self.config is None:
+            return True, None
+        return self.config.compression_enabled, self.config.compression_level
 
+    def _relay_policy(self) -> RelayPolicy:
+        if self.config is None:
+            return RelayPolicy()
+        return RelayPolicy(
+            min_size=self.config.relay_min_buffer,
+            initial_size=self.config.relay_initial_buffer,
+            max_size=self.config.relay_max_buffer,
+            adaptive=self.config.relay_adaptive,
+        )
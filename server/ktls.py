@@ -0,0 +1,105 @@
+import os
+import socket
+import ssl
+import sys
+
+from utils.logger import get_logger
+from utils.stats import Stats
+
+logger = get_logger("KTLS")
+
+# SSL_OP_ENABLE_KTLS (OpenSSL >= 3.0) ; exposé par le module ssl à partir de Python 3.12
+OP_ENABLE_KTLS = getattr(ssl, "OP_ENABLE_KTLS", 0x8 if ssl.OPENSSL_VERSION_INFO >= (3, 0) else 0)
+
+# Constantes Linux (linux/tcp.h, linux/tls.h)
+TCP_ULP = 31
+SOL_TLS = 282
+TLS_TX = 1
+TLS_RX = 2
+
+SPLICE_CHUNK = 64 * 1024
+
+# Compteurs : connexions avec kTLS en émission / réception, en espace utilisateur, octets transférés par splice
+ktls_stats = Stats("ktls")
+
+
+def ktls_available() -> bool:
+    """
+    Indique si le noyau et OpenSSL permettent le kTLS et le transfert par splice.
+    """
+    if not sys.platform.startswith("linux") or not OP_ENABLE_KTLS or not hasattr(os, "splice"):
+        return False
+    try:
+        with open("/proc/sys/net/ipv4/tcp_available_ulp") as f:
+            return "tls" in f.read().split()
+    except OSError:
+        return False
+
+
+def enable_ktls(context: ssl.SSLContext) -> bool:
+    """
+    Active le déchargement kTLS sur le contexte si le système le permet.
+
+    Returns:
+        bool: True si l'option a été positionnée.
+    """
+    if not ktls_available():
+        logger.info("kTLS indisponible sur ce système, relais en espace utilisateur")
+        return False
+    context.options |= OP_ENABLE_KTLS
+    return True
+
+
+def ktls_status(tls_sock: ssl.SSLSocket) -> tuple[bool, bool]:
+    """
+    Retourne (émission, réception) : les sens de la connexion réellement
+    chiffrés/déchiffrés par le noyau après le handshake.
+    """
+    try:
+        ulp = tls_sock.getsockopt(socket.IPPROTO_TCP, TCP_ULP, 16)
+    except OSError:
+        return False, False
+    if not ulp.startswith(b"tls"):
+        return False, False
+
+    def _configured(direction: int) -> bool:
+        try:
+            tls_sock.getsockopt(SOL_TLS, direction, 64)
+            return True
+        except OSError:
+            return False
+
+    return _configured(TLS_TX), _configured(TLS_RX)
+
+
+def splice_pipe(src: socket.socket, dst: socket.socket, touch=None) -> bool:
+    """
+    Copie src vers dst dans le noyau (splice à travers un tube), sans passer
+    les données par des objets Python.
+
+    Returns:
+        bool: True si la fin du flux a été atteinte, False si splice a échoué
+        (enregistrement TLS de contrôle, par exemple) et que l'appelant doit
+        poursuivre en espace utilisateur.
+
+    Args:
+        touch (callable): Signale l'activité au ramasseur de connexions, ou None.
+    """
+    read_fd, write_fd = os.pipe()
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    try:
+        while True:
+            try:
+                n = os.splice(src_fd, write_fd, SPLICE_CHUNK, flags=os.SPLICE_F_MOVE | os.SPLICE_F_MORE)
+            except OSError:
+                return False
+            if n == 0:
+                return True
+            ktls_stats.incr("bytes_spliced", n)
+            if touch is not None:
+                touch()
+            while n:
+                n -= os.splice(read_fd, dst_fd, n, flags=os.SPLICE_F_MOVE)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
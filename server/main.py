@@ -1,11 +1,27 @@
 from tunnel import TLSServerTunnel
+from aio_tunnel import AsyncTLSServerTunnel
 from config import ServerConfig
+from utils.logger import get_logger
+from utils.metrics import start_metrics_server
+from utils.profiling import profile_route
+from workers import WorkerSupervisor, reuse_port_supported
+
+logger = get_logger("SERVER")
 
 if __name__ == "__main__":
     config = ServerConfig()
-    server = TLSServerTunnel()
+    server = TLSServerTunnel(config)
+    if config.workers > 1:
+        if reuse_port_supported():
+            WorkerSupervisor(server, config.workers).run()
+            exit(0)
+        logger.warning("SO_REUSEPORT indisponible sur ce système : processus unique")
+
+    if config.metrics_enabled:
+        start_metrics_server(config.metrics_host, config.metrics_port, routes={"/debug/profile": profile_route})
+    if config.engine == "asyncio":
+        server = AsyncTLSServerTunnel(server)
     try:
         server.start(config.listen_host, config.listen_port)
     except KeyboardInterrupt:
         exit(1)
-
@@ -0,0 +1,297 @@
+import asyncio
+import errno
+import selectors
+import socket
+import threading
+import time
+from collections import OrderedDict
+
+from utils.logger import get_logger
+from utils.metrics import connect_seconds, record_error
+from utils.profiling import NULL_TIMER
+from utils.sockopts import fast_open_connect, wait_connected
+from utils.stats import Stats
+
+logger = get_logger("RESOLVER")
+
+# Cache (cache_hits, cache_misses, negative_hits, resolves, resolve_seconds_total)
+# et connexions (connects, connect_failures, connect_seconds_total)
+resolver_stats = Stats("resolver")
+
+
+class DNSCache:
+    """
+    Cache LRU borné des résolutions DNS, avec cache négatif.
+
+    getaddrinfo() ne remonte pas le TTL des enregistrements : chaque entrée
+    vit au plus `ttl` secondes (plafond configurable), les échecs `negative_ttl`.
+
+    Attributes:
+        max_entries (int): Nombre maximal d'hôtes en cache.
+        ttl (float): Durée de vie (s) d'une résolution réussie.
+        negative_ttl (float): Durée de vie (s) d'un échec de résolution.
+    """
+
+    def __init__(self, max_entries: int = 4096, ttl: float = 60.0, negative_ttl: float = 5.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def lookup(self, host: str):
+        """
+        Retourne les adresses en cache pour `host` : une liste de (famille, adresse IP),
+        lève l'erreur mémorisée pour un échec récent, ou None si absent/expiré.
+        """
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry is None:
+                return None
+            expires, addresses, error = entry
+            if expires < time.monotonic():
+                del self._entries[host]
+                return None
+            self._entries.move_to_end(host)
+
+        if error is not None:
+            resolver_stats.incr("negative_hits")
+            raise error
+        resolver_stats.incr("cache_hits")
+        return addresses
+
+    def resolve(self, host: str) -> list:
+        """Résout `host` (via le cache si possible) en liste de (famille, adresse IP)."""
+        addresses = self.lookup(host)
+        if addresses is not None:
+            return addresses
+
+        resolver_stats.incr("cache_misses")
+        start = time.monotonic()
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            logger.debug(f"Résolution de {host} échouée : {e}")
+            self._store(host, None, e, self.negative_ttl)
+            raise
+        finally:
+            resolver_stats.incr("resolves")
+            resolver_stats.incr("resolve_seconds_total", time.monotonic() - start)
+
+        addresses = []
+        for family, _, _, _, sockaddr in infos:
+            if (family, sockaddr[0]) not in addresses:
+                addresses.append((family, sockaddr[0]))
+        self._store(host, addresses, None, self.ttl)
+        return addresses
+
+    def _store(self, host: str, addresses, error, ttl: float):
+        with self._lock:
+            self._entries[host] = (time.monotonic() + ttl, addresses, error)
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+def interleave_families(addresses: list) -> list:
+    """
+    Alterne les familles d'adresses en commençant par la première retournée
+    par le résolveur (RFC 8305 §4).
+    """
+    if not addresses:
+        return []
+    first_family = addresses[0][0]
+    first = [a for a in addresses if a[0] == first_family]
+    other = [a for a in addresses if a[0] != first_family]
+    ordered = []
+    for i in range(max(len(first), len(other))):
+        ordered.extend(group[i] for group in (first, other) if i < len(group))
+    return ordered
+
+
+def _sockaddr(family: int, ip: str, port: int) -> tuple:
+    return (ip, port, 0, 0) if family == socket.AF_INET6 else (ip, port)
+
+
+class TargetConnector:
+    """
+    Connexion aux cibles : résolution via DNSCache puis course entre adresses
+    façon Happy Eyeballs (RFC 8305) avec un délai global de connexion.
+
+    Attributes:
+        cache (DNSCache): Cache de résolution partagé.
+        connect_timeout (float): Délai maximal (s) de connexion à une cible.
+        attempt_delay (float): Délai (s) avant de lancer la tentative suivante.
+    """
+
+    def __init__(self, cache: DNSCache = None, connect_timeout: float = 10.0, attempt_delay: float = 0.25):
+        self.cache = cache or DNSCache()
+        self.connect_timeout = connect_timeout
+        self.attempt_delay = attempt_delay
+
+    def connect(self, host: str, port: int, timer=NULL_TIMER, data: bytes = b"") -> socket.socket:
+        """
+        Retourne un socket bloquant connecté à host:port.
+
+        Args:
+            timer (StageTimer): Horodatage des étapes de la connexion (fin de l'étape "resolve").
+            data (bytes): Premiers octets pour la cible, déjà envoyés au retour ; avec
+                TCP Fast Open (utils.sockopts), ils partent dans le SYN.
+        """
+        start = time.monotonic()
+        try:
+            addresses = interleave_families(self.cache.resolve(host))
+            timer.mark("resolve")
+            sock, sent = self._race(addresses, port, start + self.connect_timeout, data)
+        except OSError as e:
+            resolver_stats.incr("connect_failures")
+            record_error("connect", e)
+            raise
+        self._record_connect(time.monotonic() - start)
+        if sent < len(data):
+            try:
+                sock.sendall(data[sent:])
+            except OSError:
+                sock.close()
+                raise
+        return sock
+
+    def _record_connect(self, duration: float):
+        resolver_stats.incr("connects")
+        resolver_stats.incr("connect_seconds_total", duration)
+        connect_seconds.observe(duration)
+
+    def _race(self, addresses: list, port: int, deadline: float, data: bytes = b"") -> tuple:
+        """Retourne (socket connecté, octets de `data` partis dans son SYN)."""
+        queue = list(addresses)
+        pending = {}
+        syn_data = {}
+        last_error = None
+        next_attempt = 0.0
+        selector = selectors.DefaultSelector()
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    raise socket.timeout(f"Délai de connexion dépassé (port {port})")
+                # Lancer la tentative suivante si rien n'est en cours ou si le délai est écoulé
+                if queue and (not pending or now >= next_attempt):
+                    family, ip = queue.pop(0)
+                    sock = socket.socket(family, socket.SOCK_STREAM)
+                    sock.setblocking(False)
+                    # TCP Fast Open : données dans le SYN de la première tentative seulement
+                    first = not pending and not syn_data
+                    sent = fast_open_connect(sock, data, _sockaddr(family, ip, port)) if first else None
+                    if sent is None:
+                        err = sock.connect_ex(_sockaddr(family, ip, port))
+                    else:
+                        err = errno.EINPROGRESS
+                        syn_data[sock] = sent
+                    if err in (0, errno.EINPROGRESS):
+                        pending[sock] = ip
+                        selector.register(sock, selectors.EVENT_WRITE)
+                        # Données déjà dans un SYN : pas de tentative parallèle, qui les livrerait deux fois
+                        next_attempt = deadline if sent else now + self.attempt_delay
+                    else:
+                        last_error = OSError(err, f"Connexion à {ip}:{port} impossible")
+                        sock.close()
+                    continue
+
+                if not pending:
+                    raise last_error or OSError(f"Aucune adresse pour le port {port}")
+
+                wake = min(deadline, next_attempt) if queue else deadline
+                for key, _ in selector.select(max(0.0, wake - now)):
+                    sock = key.fileobj
+                    selector.unregister(sock)
+                    ip = pending.pop(sock)
+                    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if err == 0:
+                        sock.setblocking(True)
+                        return sock, syn_data.get(sock, 0)
+                    last_error = OSError(err, f"Connexion à {ip}:{port} impossible")
+                    sock.close()
+                    # Échec : la tentative suivante démarre sans attendre
+                    next_attempt = 0.0
+        finally:
+            for sock in pending:
+                sock.close()
+            selector.close()
+
+    async def connect_async(self, host: str, port: int, timer=NULL_TIMER, data: bytes = b"") -> socket.socket:
+        """Équivalent asyncio de connect() ; retourne un socket non bloquant connecté."""
+        loop = asyncio.get_running_loop()
+        start = time.monotonic()
+        try:
+            addresses = self.cache.lookup(host)
+            if addresses is None:
+                addresses = await loop.run_in_executor(None, self.cache.resolve, host)
+            timer.mark("resolve")
+            sock, sent = await asyncio.wait_for(
+                self._race_async(interleave_families(addresses), port, data),
+                self.connect_timeout,
+            )
+        except OSError as e:
+            resolver_stats.incr("connect_failures")
+            record_error("connect", e)
+            raise
+        self._record_connect(time.monotonic() - start)
+        if sent < len(data):
+            try:
+                await loop.sock_sendall(sock, data[sent:])
+            except OSError:
+                sock.close()
+                raise
+        return sock
+
+    async def _race_async(self, addresses: list, port: int, data: bytes = b"") -> tuple:
+        loop = asyncio.get_running_loop()
+
+        async def connected(sock: socket.socket, address: tuple, started: bool) -> socket.socket:
+            try:
+                if started:
+                    await wait_connected(sock)
+                else:
+                    await loop.sock_connect(sock, address)
+                return sock
+            except BaseException:
+                sock.close()
+                raise
+
+        def attempt(family: int, ip: str, payload: bytes):
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            address = _sockaddr(family, ip, port)
+            sent = fast_open_connect(sock, payload, address)
+            return asyncio.ensure_future(connected(sock, address, sent is not None)), sent or 0
+
+        pending = set()
+        syn_data = {}
+        last_error = None
+        queue = list(addresses)
+        try:
+            while queue or pending:
+                # Données déjà dans un SYN : pas de tentative parallèle, qui les livrerait deux fois
+                holding = any(syn_data.get(task) for task in pending)
+                if queue and not holding:
+                    # TCP Fast Open : données dans le SYN de la première tentative seulement
+                    task, sent = attempt(*queue.pop(0), b"" if syn_data else data)
+                    pending.add(task)
+                    syn_data[task] = sent
+                    holding = sent > 0
+                done, pending = await asyncio.wait(
+                    pending,
+                    timeout=self.attempt_delay if queue and not holding else None,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                for task in done:
+                    if task.exception() is None:
+                        return task.result(), syn_data[task]
+                    last_error = task.exception()
+            raise last_error or OSError(f"Aucune adresse pour le port {port}")
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(
+                    lambda t: t.result().close() if not t.cancelled() and t.exception() is None else None
+                )
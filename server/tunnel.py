@@ -1,17 +1,56 @@
 import socket
 import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import os
 
 from dotenv import load_dotenv
 
+from config import ServerConfig
 from forward_handler import ForwardingHandler
-from utils.logger import get_logger
+from ktls import enable_ktls
+from resolver import DNSCache, TargetConnector
+from utils.admission import AdmissionControl, peer_identity
+from utils.lifecycle import ConfigWatcher, close_listener, install_signal_handlers, lifecycle_stats, wait_drained
+from utils.logger import connection_logger, get_logger
+from utils.metrics import handshake_seconds, record_error
+from utils.profiling import configure_profiling, stage_timer
+from utils.ratelimit import RateLimits, cert_fingerprint
+from utils.reaper import ConnectionReaper, configure_keepalive
+from utils.sockopts import configure_sockets, enable_fast_open_listener, tune_socket
+from utils.stats import Stats
+from utils.tls import OP_IGNORE_UNEXPECTED_EOF, SSLContextCache, log_tls_session
 
 BASE_DIR = Path(__file__).resolve().parent
 load_dotenv(dotenv_path=os.path.join(BASE_DIR, "config", ".env"))
 logger = get_logger("SERVER")
 
+# Compteurs de handshakes (session_resumption_hits / _misses)
+tls_stats = Stats("tls")
+# Durée et échecs des handshakes (handshakes, handshake_seconds_total, handshake_failures...)
+handshake_stats = Stats("handshake")
+
+
+def record_handshake(duration: float, resumed: bool):
+    """Comptabilise un handshake réussi (durée, reprise de session)."""
+    handshake_stats.incr("handshakes")
+    handshake_stats.incr("handshake_seconds_total", duration)
+    handshake_seconds.observe(duration)
+    if resumed:
+        tls_stats.incr("session_resumption_hits")
+    else:
+        tls_stats.incr("session_resumption_misses")
+
+
+def record_handshake_failure(error: Exception):
+    """Comptabilise un handshake échoué, en distinguant les dépassements de délai."""
+    handshake_stats.incr("handshake_failures")
+    record_error("handshake", error)
+    if isinstance(error, socket.timeout):
+        handshake_stats.incr("handshake_timeouts")
+
 class TLSServerTunnel:
     """
     Tunnel TLS serveur qui écoute des connexions TLS entrantes avec authentification mutuelle.
@@ -20,12 +59,112 @@ class TLSServerTunnel:
         certs_dir (Path): Répertoire contenant les certificats.
         ca_cert (Path): Chemin vers le certificat d'autorité.
         server_cert (Path): Chemin vers le certificat serveur.
+        config (ServerConfig): Configuration du serveur (backlog, handshakes...).
+        connector (TargetConnector): Connexion aux cibles, avec cache DNS partagé.
+        admission (AdmissionControl): Limites de connexions et de handshakes en cours.
+        rate_limits (RateLimits): Usage et limites de débit par identité de client.
+        reaper (ConnectionReaper): Fermeture des connexions inactives ou à moitié fermées.
     """
 
-    def __init__(self):
+    def __init__(self, config: ServerConfig = None):
+        self.config = config or ServerConfig()
         self.certs_dir = os.path.join(BASE_DIR,os.getenv("CERTS_DIR"))
         self.ca_cert = os.path.join(self.certs_dir, os.getenv("CA_CERT_NAME", "ca.pem"))
         self.server_cert = os.path.join(self.certs_dir, os.getenv("SERVER_CERT_NAME", "server.pem"))
+        # Un seul contexte pour toutes les connexions : les tickets de session
+        # qu'il émet restent valides tant que les certificats ne changent pas.
+        self.context_cache = SSLContextCache(self._create_ssl_context, (self.ca_cert, self.server_cert))
+        self.connector = TargetConnector(
+            DNSCache(self.config.dns_cache_size, self.config.dns_ttl, self.config.dns_negative_ttl),
+            connect_timeout=self.config.connect_timeout,
+            attempt_delay=self.config.connect_attempt_delay,
+        )
+        self.admission = AdmissionControl(
+            self.config.max_connections,
+            self.config.max_connections_per_client,
+            self.config.max_pending_handshakes,
+        )
+        self.rate_limits = RateLimits(self.config.rate_limit_default, self.config.rate_limit_identities)
+        configure_keepalive(
+            self.config.keepalive_enabled,
+            self.config.keepalive_idle,
+            self.config.keepalive_interval,
+            self.config.keepalive_count,
+        )
+        configure_profiling(self.config.stage_timing, self.config.profile_seconds, self.config.profile_interval)
+        configure_sockets(self.config.socket_profiles, self.config.fast_open)
+        self.reaper = ConnectionReaper(self.config.idle_timeout, self.config.half_close_timeout)
+        self._listener = None
+        self._draining = False
+
+    def changed(self) -> bool:
+        """True si la configuration ou les certificats ont changé sur disque."""
+        return self.config.changed() or self.context_cache.changed()
+
+    def reload(self) -> bool:
+        """
+        Recharge la configuration et les certificats (SIGHUP ou modification
+        des fichiers). Les connexions établies ne sont pas touchées ; les
+        suivantes utilisent les nouvelles limites et le nouveau contexte SSL.
+        Une configuration invalide est refusée en bloc.
+        """
+        try:
+            ignored = self.config.reload()
+        except Exception as e:
+            lifecycle_stats.incr("reload_failures")
+            record_error("reload", e)
+            logger.error(f"Configuration invalide, rechargement annulé : {e}")
+            return False
+        if ignored:
+            logger.warning(f"Pris en compte au prochain redémarrage seulement : {', '.join(ignored)}")
+
+        config = self.config
+        self.admission.configure(config.max_connections, config.max_connections_per_client, config.max_pending_handshakes)
+        self.rate_limits.configure(config.rate_limit_default, config.rate_limit_identities)
+        configure_keepalive(config.keepalive_enabled, config.keepalive_idle, config.keepalive_interval, config.keepalive_count)
+        configure_profiling(config.stage_timing, config.profile_seconds, config.profile_interval)
+        configure_sockets(config.socket_profiles, config.fast_open)
+        self.reaper.idle_timeout = config.idle_timeout
+        self.reaper.half_close_timeout = config.half_close_timeout
+        self.connector.connect_timeout = config.connect_timeout
+        self.connector.attempt_delay = config.connect_attempt_delay
+        self.connector.cache.max_entries = config.dns_cache_size
+        self.connector.cache.ttl = config.dns_ttl
+        self.connector.cache.negative_ttl = config.dns_negative_ttl
+        self.context_cache.reload()
+
+        lifecycle_stats.incr("reloads")
+        logger.info(f"Configuration rechargée (contexte SSL : génération {self.context_cache.generation})")
+        return True
+
+    def limiter(self, ssl_object, identity: str):
+        """
+        Usage et limites de débit de l'identité d'une connexion TLS établie
+        (une recherche par connexion), ou None si rate_limits est désactivé.
+        """
+        if not self.config.rate_limits_enabled:
+            return None
+        return self.rate_limits.limiter(identity, cert_fingerprint(ssl_object.getpeercert(binary_form=True)))
+
+    def drain(self):
+        """
+        Arrêt progressif (SIGTERM) : l'écoute est fermée, plus aucune connexion
+        n'est admise et les sessions multiplexées sont prévenues (GOAWAY).
+        start() rend la main quand les connexions en cours sont terminées, au
+        plus tard après drain_timeout secondes.
+        """
+        if self._draining:
+            return
+        self._draining = True
+        logger.info(
+            f"Arrêt progressif : {self.admission.active} connexion(s) en cours, "
+            f"délai maximal {self.config.drain_timeout:g} s"
+        )
+        if self._listener is not None:
+            close_listener(self._listener)
+        # Hors du thread des signaux : prévenir une session peut bloquer sur l'envoi,
+        # un second SIGTERM doit rester traité
+        threading.Thread(target=self.admission.close, name="drain", daemon=True).start()
 
     def _create_ssl_context(self) -> ssl.SSLContext:
         """
@@ -35,31 +174,97 @@ class TLSServerTunnel:
         context.load_cert_chain(certfile=self.server_cert)
         context.load_verify_locations(self.ca_cert)
         context.verify_mode = ssl.CERT_REQUIRED
+        context.options |= OP_IGNORE_UNEXPECTED_EOF
+        self.config.tls_policy.apply(context, server_side=True)
+        if self.config.ktls_enabled:
+            enable_ktls(context)
         return context
 
-    def start(self, host: str = "0.0.0.0", port: int = 8443):
+    def start(self, host: str = "0.0.0.0", port: int = 8443, reuse_port: bool = False, supervised: bool = False):
         """
-        Lance le serveur TLS en écoute sur l'adresse spécifiée.
+        Lance le serveur TLS en écoute sur l'adresse spécifiée, jusqu'à la fin
+        d'un arrêt progressif (drain).
+
+        La boucle d'acceptation ne fait qu'accepter : les handshakes TLS sont
+        exécutés par un pool de threads borné, avec un délai maximal, pour
+        qu'un client lent ne bloque pas les autres. Au-delà des limites
+        d'admission, la connexion est fermée sans handshake.
 
         Args:
             host (str): Adresse d'écoute (par défaut : 0.0.0.0).
             port (int): Port d'écoute (par défaut : 8443).
+            reuse_port (bool): SO_REUSEPORT, pour plusieurs processus sur le même port.
+            supervised (bool): Worker d'un WorkerSupervisor, qui surveille lui-même les fichiers.
         """
-        context = self._create_ssl_context()
+        self.reaper.start()
+        install_signal_handlers(self.reload, self.drain)
+        if not supervised:
+            ConfigWatcher(self.changed, self.reload, self.config.reload_interval).start()
+        handshake_pool = ThreadPoolExecutor(
+            max_workers=self.config.handshake_workers,
+            thread_name_prefix="handshake",
+        )
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuse_port:
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
             sock.bind((host, port))
-            sock.listen(5)
+            enable_fast_open_listener(sock)
+            sock.listen(self.config.backlog)
+            self._listener = sock
             logger.info(f"En écoute sur {host}:{port}")
 
             while True:
-                client_sock, addr = sock.accept()
-                logger.info(f"Connexion entrante depuis {addr}")
-
                 try:
-                    tls_conn = context.wrap_socket(client_sock, server_side=True)
-                    handler = ForwardingHandler(tls_conn)
-                    handler.start()
-                except ssl.SSLError as e:
-                    logger.error(f"Erreur SSL : {e}")
-                except Exception as e:
-                    logger.error(f"Erreur {e}")
+                    client_sock, addr = sock.accept()
+                except OSError:
+                    if self._draining:
+                        break
+                    raise
+                if not self.admission.try_handshake():
+                    client_sock.close()
+                    continue
+                tune_socket(client_sock, "tunnel")
+                connection_logger(logger).info(f"Connexion entrante depuis {addr}")
+                handshake_pool.submit(self._handshake, client_sock, addr)
+
+        wait_drained(lambda: self.admission.active, self.config.drain_timeout)
+        handshake_pool.shutdown(wait=False)
+        logger.info("Serveur arrêté")
+
+    def _handshake(self, client_sock: socket.socket, addr):
+        """Exécute le handshake TLS (avec délai maximal) puis lance le relais."""
+        start = time.monotonic()
+        try:
+            client_sock.settimeout(self.config.handshake_timeout)
+            tls_conn = self.context_cache.get().wrap_socket(client_sock, server_side=True)
+            tls_conn.settimeout(None)
+        except (ssl.SSLError, OSError) as e:
+            record_handshake_failure(e)
+            logger.error(f"Handshake échoué avec {addr} : {e}")
+            client_sock.close()
+            return
+        finally:
+            self.admission.handshake_done()
+
+        record_handshake(time.monotonic() - start, tls_conn.session_reused)
+        timer = stage_timer(start)
+        timer.mark("handshake")
+        identity = peer_identity(tls_conn.getpeercert())
+        log_tls_session("server", addr, tls_conn.version(), tls_conn.cipher(), tls_conn.session_reused, identity)
+        try:
+            ForwardingHandler(
+                tls_conn,
+                config=self.config,
+                connector=self.connector,
+                peer=addr,
+                admission=self.admission,
+                identity=identity,
+                reaper=self.reaper,
+                limiter=self.limiter(tls_conn, identity),
+                timer=timer,
+            ).start()
+        except Exception as e:
+            record_error("accept", e)
+            logger.error(f"Erreur {e}")
+            tls_conn.close()
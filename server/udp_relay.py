@@ -0,0 +1,208 @@
+import asyncio
+import socket
+import threading
+
+from config import ServerConfig
+from resolver import TargetConnector
+from utils.logger import get_logger
+from utils.metrics import record_error
+from utils.relay import RelayCounters, abort
+from utils.udp import (
+    AsyncFrameSender,
+    DatagramReader,
+    NatTable,
+    encode_datagram,
+    open_udp_socket,
+    record_datagram,
+    record_drop,
+    udp_stats,
+    unmap_address,
+)
+
+logger = get_logger("UDP")
+
+READ_SIZE = 64 * 1024
+
+
+class UDPForwarder:
+    """
+    Relais d'une association UDP côté serveur : les datagrammes reçus du flux
+    du tunnel (utils.udp) partent vers leurs destinations depuis un socket UDP
+    propre à l'association, les réponses reviennent dans le même flux.
+
+    La table NAT (utils.udp.NatTable) ne laisse passer vers le client que les
+    réponses des destinations qu'il a contactées récemment.
+
+    Attributes:
+        stream: Flux du tunnel ouvert avec FLAG_UDP (socket bloquant, MuxStream ou flux asyncio).
+        connector (TargetConnector): Fournit le cache DNS partagé.
+        tracker (TrackedConnection): Suivi d'activité du ramasseur, ou None.
+        nat (NatTable): Correspondances de l'association.
+        udp (DatagramSocket): Socket UDP de l'association.
+        counters (RelayCounters): Datagrammes et octets par sens.
+    """
+
+    def __init__(self, stream, config: ServerConfig = None, connector: TargetConnector = None, tracker=None):
+        self.stream = stream
+        self.connector = connector or TargetConnector()
+        self.tracker = tracker
+        self.nat = NatTable(
+            config.udp_nat_timeout if config else 60,
+            config.udp_max_mappings if config else 256,
+        )
+        self.udp = open_udp_socket()
+        self.counters = RelayCounters()
+
+    def _touch(self):
+        if self.tracker is not None:
+            self.tracker.touch()
+
+    def _sockaddr(self, family: int, ip: str, port: int) -> tuple:
+        if self.udp.family == socket.AF_INET6:
+            # Socket double pile : IPv4 en adresse mappée
+            return (f"::ffff:{ip}" if family == socket.AF_INET else ip, port, 0, 0)
+        if family != socket.AF_INET:
+            return None
+        return ip, port
+
+    def _destination(self, port: int, addresses: list):
+        """Adresse de socket de la destination, ou None (datagramme abandonné)."""
+        for family, ip in addresses:
+            sockaddr = self._sockaddr(family, ip, port)
+            if sockaddr is None:
+                continue
+            if not self.nat.outbound((ip, port)):
+                record_drop("nat_full")
+                return None
+            return sockaddr
+        record_drop("unresolved")
+        return None
+
+    def _addresses(self, host: str) -> list:
+        try:
+            return self.connector.cache.resolve(host)
+        except OSError:
+            return []
+
+    def _send(self, port: int, payload: bytes, addresses: list):
+        sockaddr = self._destination(port, addresses)
+        if sockaddr is not None and self.udp.sendto(payload, sockaddr):
+            record_datagram(self.counters.upstream, len(payload))
+
+    def _replies(self, batch: list) -> list:
+        """Trames des réponses attendues parmi `batch` ; les autres sont abandonnées."""
+        frames = []
+        for data, addr in batch:
+            host, port = unmap_address(addr)
+            if not self.nat.inbound((host, port)):
+                record_drop("unsolicited")
+                continue
+            try:
+                frames.append((encode_datagram(host, port, data), len(data)))
+            except ValueError:
+                record_drop("oversize")
+        return frames
+
+    # === Moteur à threads ===
+
+    def run(self, initial: bytes = b"") -> RelayCounters:
+        """
+        Relaie jusqu'à la fin du flux du tunnel ; retourne les compteurs de l'association.
+
+        Args:
+            initial (bytes): Trames déjà reçues avec l'en-tête d'ouverture.
+        """
+        udp_stats.incr("associations")
+        downstream = threading.Thread(target=self._downstream, name="udp-downstream", daemon=True)
+        downstream.start()
+        try:
+            self._upstream(initial)
+        finally:
+            self.udp.abort()
+            downstream.join()
+            self.udp.close()
+        return self.counters
+
+    def _upstream(self, data: bytes):
+        reader = DatagramReader()
+        while True:
+            if not data:
+                try:
+                    data = self.stream.recv(READ_SIZE)
+                except ConnectionResetError:
+                    # Flux multiplexé fermé par le client sans FIN : fin normale de l'association
+                    return
+                if not data:
+                    return
+            for host, port, payload in reader.feed(data):
+                self._touch()
+                self._send(port, payload, self._addresses(host))
+            data = b""
+
+    def _downstream(self):
+        try:
+            while True:
+                batch = self.udp.recv_batch()
+                if not batch:
+                    return  # socket interrompu par abort()
+                frames = self._replies(batch)
+                if not frames:
+                    continue
+                self._touch()
+                # Réponses déjà arrivées : une seule écriture dans le tunnel
+                self.stream.sendall(b"".join(frame for frame, _ in frames))
+                for _, size in frames:
+                    record_datagram(self.counters.downstream, size)
+        except OSError as e:
+            record_error("udp", e)
+        finally:
+            abort(self.stream)
+
+    # === Moteur asyncio ===
+
+    async def run_async(self, initial: bytes = b"") -> RelayCounters:
+        """Équivalent asyncio de run()."""
+        udp_stats.incr("associations")
+        sender = AsyncFrameSender(self.stream, self.counters.downstream)
+        self.udp.add_reader(lambda data, addr: self._on_reply(sender, data, addr))
+        writer = asyncio.ensure_future(sender.run())
+        upstream = asyncio.ensure_future(self._upstream_async(initial))
+        try:
+            # Le tunnel se ferme (fin du flux) ou n'accepte plus d'écriture
+            done, _ = await asyncio.wait((writer, upstream), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            writer.cancel()
+            upstream.cancel()
+            self.udp.close()
+        if writer in done:
+            record_error("udp", writer.exception())
+        if upstream in done:
+            upstream.result()
+        return self.counters
+
+    def _on_reply(self, sender: AsyncFrameSender, data: bytes, addr: tuple):
+        for frame, size in self._replies([(data, addr)]):
+            self._touch()
+            sender.submit(frame, size)
+
+    async def _upstream_async(self, data: bytes):
+        loop = asyncio.get_running_loop()
+        reader = DatagramReader()
+        while True:
+            if not data:
+                try:
+                    data = await self.stream.read(READ_SIZE)
+                except ConnectionResetError:
+                    return  # voir _upstream
+                if not data:
+                    return
+            for host, port, payload in reader.feed(data):
+                self._touch()
+                try:
+                    addresses = self.connector.cache.lookup(host)
+                except OSError:
+                    addresses = []
+                if addresses is None:
+                    addresses = await loop.run_in_executor(None, self._addresses, host)
+                self._send(port, payload, addresses)
+            data = b""
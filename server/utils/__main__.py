@@ -1,5 +1,12 @@
-from certs import CertificateManager
+import argparse
+
+from certs import KEY_PROFILES, CertificateManager
 
 if __name__ == "__main__":
-    manager = CertificateManager()
+    parser = argparse.ArgumentParser(description="Génération des certificats")
+    parser.add_argument("--profile", choices=KEY_PROFILES, help="Profil de clé (défaut : CERT_KEY_PROFILE ou ecdsa-p256)")
+    parser.add_argument("--key-size", type=int, default=4096, help="Taille des clés RSA (profil rsa)")
+    args = parser.parse_args()
+
+    manager = CertificateManager(key_size=args.key_size, profile=args.profile)
     manager.generate_all()
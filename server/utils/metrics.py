@@ -0,0 +1,268 @@
+import bisect
+import ipaddress
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from utils.logger import get_logger
+from utils.stats import ShardedValues, Stats
+
+logger = get_logger("METRICS")
+
+# Bornes (s) des histogrammes de latence
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PREFIX = "pst_"
+
+
+def _escape_label(value) -> str:
+    # Format texte Prometheus : \\, \" et \n dans les valeurs d'étiquettes
+    # (le CN d'un certificat client peut contenir n'importe quel caractère)
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Counter:
+    """
+    Compteur (ou jauge) fragmenté par thread, avec étiquettes optionnelles.
+
+    Attributes:
+        name (str): Nom exporté (préfixé par "pst_").
+        help (str): Description exportée.
+        label_names (tuple): Noms des étiquettes.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, label_names: tuple = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = ShardedValues()
+
+    def inc(self, amount: float = 1, labels: tuple = ()):
+        values = self._values.local()
+        values[labels] = values.get(labels, 0) + amount
+
+    def labels(self, *values) -> "BoundCounter":
+        """Retourne le compteur lié à ces étiquettes (à préparer hors des boucles chaudes)."""
+        return BoundCounter(self, tuple(str(v) for v in values))
+
+    def collect(self) -> dict:
+        """Valeurs fusionnées de tous les threads, par étiquettes."""
+        return self._values.merged()
+
+    def render(self, merged: dict) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        if not merged and not self.label_names:
+            merged = {(): 0}
+        for labels, value in sorted(merged.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Counter):
+    """Valeur instantanée (connexions actives...) : somme des inc()/dec() de tous les threads."""
+
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, labels: tuple = ()):
+        self.inc(-amount, labels)
+
+
+class BoundCounter:
+    """Compteur avec étiquettes déjà résolues."""
+
+    __slots__ = ("_values", "_key")
+
+    def __init__(self, counter: Counter, labels: tuple):
+        self._values = counter._values
+        self._key = labels
+
+    def inc(self, amount: float = 1):
+        values = self._values.local()
+        values[self._key] = values.get(self._key, 0) + amount
+
+
+class Histogram:
+    """
+    Histogramme à bornes fixes, fragmenté par thread.
+
+    Attributes:
+        name (str): Nom exporté (préfixé par "pst_").
+        help (str): Description exportée.
+        buckets (tuple): Bornes supérieures croissantes des intervalles.
+    """
+
+    def __init__(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._values = ShardedValues()
+
+    def observe(self, value: float):
+        values = self._values.local()
+        index = bisect.bisect_left(self.buckets, value)
+        values[index] = values.get(index, 0) + 1
+        values["sum"] = values.get("sum", 0) + value
+
+    def collect(self) -> dict:
+        """Effectifs fusionnés par intervalle, et somme des observations."""
+        return self._values.merged()
+
+    def render(self, merged: dict) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for index, bound in enumerate(self.buckets):
+            cumulative += merged.get(index, 0)
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += merged.get(len(self.buckets), 0)
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {cumulative}')
+        lines.append(f"{self.name}_sum {_format_value(merged.get('sum', 0))}")
+        lines.append(f"{self.name}_count {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Registre des métriques du processus, rendu au format texte Prometheus.
+    Les groupes utils.stats.Stats sont exportés en plus, sous pst_<groupe>_<clé>.
+    """
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, label_names: tuple = ()) -> Counter:
+        return self.register(Counter(name, help, label_names))
+
+    def gauge(self, name: str, help: str, label_names: tuple = ()) -> Gauge:
+        return self.register(Gauge(name, help, label_names))
+
+    def histogram(self, name: str, help: str, buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, buckets))
+
+    def snapshot(self) -> dict:
+        """Valeurs de toutes les métriques et de tous les groupes Stats (transmissible entre processus)."""
+        return {
+            "metrics": {metric.name: metric.collect() for metric in self._metrics},
+            "stats": {group.name: group.snapshot() for group in Stats.groups()},
+        }
+
+    def cumulative(self, snapshot: dict) -> dict:
+        """Instantané sans les jauges : ce qui reste à compter d'un processus arrêté."""
+        gauges = {metric.name for metric in self._metrics if isinstance(metric, Gauge)}
+        return {
+            "metrics": {name: values for name, values in snapshot["metrics"].items() if name not in gauges},
+            "stats": snapshot["stats"],
+        }
+
+    def render(self, snapshots: list = ()) -> str:
+        """
+        Rend les métriques du processus, additionnées des instantanés
+        `snapshots` d'autres processus (workers du serveur).
+        """
+        total = self.snapshot()
+        for snapshot in snapshots:
+            merge_snapshot(total, snapshot)
+
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render(total["metrics"].get(metric.name, {})))
+        for group_name, values in total["stats"].items():
+            for key, value in sorted(values.items()):
+                name = f"{PREFIX}{group_name}_{key}"
+                lines.append(f"# TYPE {name} untyped")
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def merge_snapshot(total: dict, snapshot: dict, kinds: tuple = ("metrics", "stats")):
+    """Additionne `snapshot` à `total` (instantanés de MetricsRegistry.snapshot())."""
+    for kind in kinds:
+        for name, values in snapshot.get(kind, {}).items():
+            target = total[kind].setdefault(name, {})
+            for key, value in values.items():
+                target[key] = target.get(key, 0) + value
+
+
+registry = MetricsRegistry()
+
+connections_active = registry.gauge("connections_active", "Connexions relayées en cours")
+connections_total = registry.counter("connections_total", "Connexions relayées depuis le démarrage")
+bytes_total = registry.counter("bytes_total", "Octets relayés par sens", ("direction",))
+handshake_seconds = registry.histogram("handshake_seconds", "Durée des handshakes TLS")
+tls_sessions = registry.counter("tls_sessions_total", "Connexions TLS établies par version et suite négociées", ("version", "cipher"))
+connect_seconds = registry.histogram("connect_seconds", "Durée de connexion aux cibles")
+socks_negotiation_seconds = registry.histogram("socks_negotiation_seconds", "Durée de la négociation SOCKS5")
+errors_total = registry.counter("errors_total", "Erreurs par étape et par type", ("stage", "type"))
+
+
+def record_error(stage: str, error: BaseException):
+    """Comptabilise une erreur jusqu'ici ignorée silencieusement."""
+    errors_total.inc(labels=(stage, type(error).__name__))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == "/metrics":
+            body = self.server.render().encode()
+        elif url.path in self.server.routes:
+            try:
+                body = self.server.routes[url.path](parse_qs(url.query)).encode()
+            except ValueError:
+                self.send_error(400)
+                return
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host: str = "127.0.0.1", port: int = 9100, render=None,
+                         routes: dict = None) -> ThreadingHTTPServer:
+    """
+    Expose /metrics en HTTP dans un thread dédié.
+    Le point d'accès n'est servi que sur une adresse de bouclage.
+
+    Args:
+        render (callable): Produit le texte exporté (par défaut : registry.render).
+        routes (dict): Points d'accès d'administration supplémentaires : chemin ->
+            fonction(paramètres de la requête) retournant le texte de la réponse.
+    """
+    try:
+        loopback = ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        loopback = host == "localhost"
+    if not loopback:
+        logger.warning(f"Adresse {host} refusée pour /metrics (bouclage uniquement), 127.0.0.1 utilisée")
+        host = "127.0.0.1"
+
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    server.render = render or registry.render
+    server.routes = dict(routes or {})
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"Métriques exposées sur http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,181 @@
+import os
+import re
+import sys
+import threading
+import time
+from pathlib import Path
+
+from utils.logger import get_logger
+from utils.metrics import registry
+from utils.stats import Stats
+
+logger = get_logger("PROFILING")
+
+# Profils enregistrés (profiles) et demandés pendant qu'un autre tournait (profiles_busy)
+profiling_stats = Stats("profiling")
+
+# Étapes de la vie d'une connexion, dans l'ordre (client : socks, tunnel, relay ;
+# serveur : handshake, header, resolve, connect, relay)
+STAGES = ("handshake", "socks", "header", "resolve", "connect", "tunnel", "relay")
+MAX_PROFILE_SECONDS = 300.0
+
+stage_seconds = {
+    stage: registry.histogram(f"stage_{stage}_seconds", f"Durée de l'étape {stage} des connexions (profiling.stage_timing)")
+    for stage in STAGES
+}
+
+# Réglages du processus (configure_profiling)
+_PROFILING = {"stage_timing": False, "seconds": 10.0, "interval": 0.005}
+
+
+def configure_profiling(stage_timing: bool = False, seconds: float = 10.0, interval: float = 0.005):
+    """Réglages de l'instrumentation du processus (au démarrage et au rechargement)."""
+    _PROFILING.update(stage_timing=stage_timing, seconds=seconds, interval=interval)
+
+
+class StageTimer:
+    """
+    Horodatage des étapes d'une connexion : chaque mark() mesure le temps
+    écoulé depuis l'étape précédente (ou le début de la connexion).
+
+    Attributes:
+        durations (dict[str, float]): Durée (s) de chaque étape terminée.
+    """
+
+    __slots__ = ("_last", "durations")
+
+    def __init__(self, start: float = None):
+        self._last = start if start is not None else time.monotonic()
+        self.durations = {}
+
+    def mark(self, stage: str):
+        """Termine l'étape `stage` (une de STAGES)."""
+        now = time.monotonic()
+        duration = now - self._last
+        self._last = now
+        self.durations[stage] = duration
+        stage_seconds[stage].observe(duration)
+
+    def as_dict(self) -> dict:
+        """Durées en millisecondes, pour l'enregistrement d'accès."""
+        return {stage: round(duration * 1000, 2) for stage, duration in self.durations.items()}
+
+
+class _NullTimer:
+    """Horodatage désactivé : aucune mesure."""
+
+    __slots__ = ()
+
+    def mark(self, stage: str):
+        pass
+
+    def as_dict(self):
+        return None
+
+
+NULL_TIMER = _NullTimer()
+
+
+def stage_timer(start: float = None):
+    """Horodatage d'une nouvelle connexion : StageTimer, ou NULL_TIMER si stage_timing est désactivé."""
+    if not _PROFILING["stage_timing"]:
+        return NULL_TIMER
+    return StageTimer(start)
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Profileur par échantillonnage d'un processus en service : un thread relève
+    la pile de tous les threads toutes les `interval` secondes pendant la durée
+    demandée, puis écrit les piles agrégées au format "collapsed" (une ligne
+    "racine;...;feuille effectif"), lu par flamegraph.pl ou speedscope.
+
+    Aucun coût hors des profils demandés.
+
+    Attributes:
+        directory (Path): Répertoire des fichiers produits.
+    """
+
+    def __init__(self, directory: Path = Path("logs")):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._running = False
+
+    def start(self, seconds: float, interval: float):
+        """
+        Lance un profil de `seconds` secondes dans un thread dédié.
+
+        Returns:
+            Path | None: Fichier qui sera écrit, ou None si un profil est déjà en cours.
+        """
+        with self._lock:
+            if self._running:
+                profiling_stats.incr("profiles_busy")
+                return None
+            self._running = True
+        seconds = min(max(seconds, interval), MAX_PROFILE_SECONDS)
+        path = self.directory / f"profile-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+        threading.Thread(target=self._run, args=(seconds, interval, path), name="profiler", daemon=True).start()
+        logger.info(f"Profil de {seconds:g} s démarré (échantillon toutes les {interval * 1000:g} ms) : {path}")
+        return path
+
+    def _run(self, seconds: float, interval: float, path: Path):
+        try:
+            stacks = self._sample(seconds, interval)
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in sorted(stacks.items()):
+                    f.write(f"{stack} {count}\n")
+            profiling_stats.incr("profiles")
+            logger.info(f"Profil écrit : {path} ({sum(stacks.values())} échantillons)")
+        except Exception as e:
+            logger.error(f"Profil interrompu : {e}")
+        finally:
+            with self._lock:
+                self._running = False
+
+    @staticmethod
+    def _sample(seconds: float, interval: float) -> dict:
+        own = threading.get_ident()
+        stacks = {}
+        names = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()
+            if not names.keys() >= frames.keys():
+                # Nom du thread sans son numéro : les threads d'un même rôle sont regroupés
+                names = {t.ident: re.sub(r"[-_]?\d+", "", t.name) for t in threading.enumerate()}
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                parts = []
+                while frame is not None:
+                    parts.append(_frame_name(frame.f_code))
+                    frame = frame.f_back
+                parts.append(names.get(ident, "thread"))
+                stack = ";".join(reversed(parts))
+                stacks[stack] = stacks.get(stack, 0) + 1
+            del frames
+            time.sleep(interval)
+        return stacks
+
+
+profiler = SamplingProfiler()
+
+
+def start_profile(seconds: float = None):
+    """Profil du processus (SIGUSR2, /debug/profile) ; durée par défaut : profiling.sample_seconds."""
+    return profiler.start(seconds or _PROFILING["seconds"], _PROFILING["interval"])
+
+
+def profile_route(query: dict) -> str:
+    """Point d'accès /debug/profile?seconds=N du serveur de métriques."""
+    seconds = float(query["seconds"][0]) if "seconds" in query else None
+    path = start_profile(seconds)
+    if path is None:
+        return "Un profil est déjà en cours\n"
+    return f"{path}\n"
@@ -0,0 +1,224 @@
+import socket
+import struct
+
+from utils.mux import MUX_PREFACE
+
+# En-tête binaire versionné envoyé par le client en tête de connexion (ou de flux) :
+#
+#   magic (1) | version (1) | type d'adresse (1) | drapeaux (1)
+#   adresse : IPv4 (4) | IPv6 (16) | domaine : longueur (1) + octets
+#   port (2)
+#   longueur des données anticipées (4), seulement si FLAG_EARLY_DATA
+#   algorithmes de compression proposés (1), seulement si FLAG_COMPRESSION
+#
+# L'octet magique n'est jamais le premier octet d'une ligne "host:port\n" ni du
+# préambule multiplexé : le serveur distingue les trois formes sans aller-retour.
+HEADER_MAGIC = 0xA5
+HEADER_VERSION = 1
+HEADER_PREFIX = struct.Struct("!BBBB")
+PORT = struct.Struct("!H")
+EARLY_DATA_LEN = struct.Struct("!I")
+CODECS = struct.Struct("!B")
+
+ATYP_IPV4 = 1
+ATYP_DOMAIN = 3
+ATYP_IPV6 = 4
+
+FLAG_EARLY_DATA = 0x01  # des données applicatives suivent immédiatement l'en-tête
+FLAG_COMPRESSION = 0x02  # flux compressé si le serveur l'accepte (utils.compression)
+FLAG_UDP = 0x04  # flux de datagrammes (SOCKS5 UDP ASSOCIATE, utils.udp) : l'adresse de l'en-tête est ignorée
+
+MAX_LINE = 1024
+EARLY_DATA_MAX = 16384  # données anticipées jointes à l'en-tête, au plus (un enregistrement TLS)
+
+
+class TunnelRequest:
+    """
+    Requête d'ouverture décodée en tête de connexion ou de flux.
+
+    Attributes:
+        host (str): Hôte cible.
+        port (int): Port cible.
+        flags (int): Drapeaux de l'en-tête binaire.
+        early_data_len (int): Octets applicatifs annoncés à la suite de l'en-tête.
+        codecs (int): Algorithmes de compression proposés (masque, 0 : pas de compression).
+        legacy (bool): Requête reçue au format texte "host:port\\n".
+        mux (bool): Préambule de session multiplexée (pas de cible).
+    """
+
+    def __init__(self, host: str = None, port: int = None, flags: int = 0,
+                 early_data_len: int = 0, codecs: int = 0, legacy: bool = False, mux: bool = False):
+        self.host = host
+        self.port = port
+        self.flags = flags
+        self.early_data_len = early_data_len
+        self.codecs = codecs
+        self.legacy = legacy
+        self.mux = mux
+
+
+def encode_address(host: str, port: int) -> bytes:
+    """
+    Encode type d'adresse + adresse + port, comme dans SOCKS5 (mêmes codes
+    ATYP) : utilisé par l'en-tête et par les datagrammes (utils.udp).
+    """
+    try:
+        return bytes([ATYP_IPV4]) + socket.inet_pton(socket.AF_INET, host) + PORT.pack(port)
+    except OSError:
+        pass
+    try:
+        return bytes([ATYP_IPV6]) + socket.inet_pton(socket.AF_INET6, host) + PORT.pack(port)
+    except OSError:
+        pass
+    encoded = host.encode("idna")
+    if len(encoded) > 255:
+        raise ValueError(f"Nom d'hôte trop long : {host}")
+    return bytes([ATYP_DOMAIN, len(encoded)]) + encoded + PORT.pack(port)
+
+
+def parse_address(buf, offset: int = 0):
+    """
+    Décode type d'adresse + adresse + port à partir de `offset`.
+
+    Returns:
+        tuple[str, int, int] | None: (hôte, port, fin de l'adresse), ou None
+        s'il faut lire davantage.
+
+    Raises:
+        ValueError: Type d'adresse inconnu.
+    """
+    if len(buf) < offset + 1:
+        return None
+    return _parse_host_port(buf, buf[offset], offset + 1)
+
+
+def _parse_host_port(buf, atyp: int, offset: int):
+    """Adresse de type `atyp` puis port à partir de `offset` (voir parse_address)."""
+    if atyp == ATYP_IPV4:
+        end = offset + 4
+        if len(buf) < end:
+            return None
+        host = socket.inet_ntop(socket.AF_INET, bytes(buf[offset:end]))
+    elif atyp == ATYP_IPV6:
+        end = offset + 16
+        if len(buf) < end:
+            return None
+        host = socket.inet_ntop(socket.AF_INET6, bytes(buf[offset:end]))
+    elif atyp == ATYP_DOMAIN:
+        if len(buf) < offset + 1:
+            return None
+        end = offset + 1 + buf[offset]
+        if len(buf) < end:
+            return None
+        host = bytes(buf[offset + 1:end]).decode("idna")
+    else:
+        raise ValueError(f"Type d'adresse inconnu : {atyp}")
+    if len(buf) < end + PORT.size:
+        return None
+    return host, PORT.unpack_from(buf, end)[0], end + PORT.size
+
+
+def encode_request(host: str, port: int, flags: int = 0, early_data_len: int = 0, codecs: int = 0) -> bytes:
+    """Encode l'en-tête binaire v1 pour la cible host:port."""
+    address = encode_address(host, port)
+    if early_data_len:
+        flags |= FLAG_EARLY_DATA
+    if codecs:
+        flags |= FLAG_COMPRESSION
+    # L'octet de type d'adresse précède les drapeaux dans l'en-tête
+    header = HEADER_PREFIX.pack(HEADER_MAGIC, HEADER_VERSION, address[0], flags) + address[1:]
+    if flags & FLAG_EARLY_DATA:
+        header += EARLY_DATA_LEN.pack(early_data_len)
+    if flags & FLAG_COMPRESSION:
+        header += CODECS.pack(codecs)
+    return header
+
+
+def parse_target_line(line: str) -> tuple[str, int]:
+    """
+    Extrait (hôte, port) d'une ligne "host:port" (ancien protocole).
+    Accepte les littéraux IPv6, avec ou sans crochets.
+    """
+    host, sep, port_str = line.strip().rpartition(":")
+    if not sep or not host:
+        raise ValueError(f"Adresse invalide reçue : {line}")
+    return host.strip("[]"), int(port_str)
+
+
+def parse_request(buf: bytes):
+    """
+    Décode la requête d'ouverture au début de `buf` (sans E/S).
+
+    Returns:
+        tuple[TunnelRequest, int] | None: La requête et le nombre d'octets
+        consommés, ou None s'il faut lire davantage.
+
+    Raises:
+        ValueError: En-tête invalide, version inconnue, ligne trop longue ou
+            données anticipées annoncées au-delà de EARLY_DATA_MAX.
+    """
+    if not buf:
+        return None
+
+    if buf[0] != HEADER_MAGIC:
+        end = buf.find(b"\n")
+        if end < 0:
+            if len(buf) > MAX_LINE:
+                raise ValueError("Ligne cible trop longue")
+            return None
+        line = buf[:end].decode().strip()
+        if line == MUX_PREFACE.decode().strip():
+            return TunnelRequest(mux=True), end + 1
+        host, port = parse_target_line(line)
+        return TunnelRequest(host, port, legacy=True), end + 1
+
+    if len(buf) < HEADER_PREFIX.size:
+        return None
+    _, version, atyp, flags = HEADER_PREFIX.unpack_from(buf)
+    if version != HEADER_VERSION:
+        raise ValueError(f"Version d'en-tête non supportée : {version}")
+
+    address = _parse_host_port(buf, atyp, HEADER_PREFIX.size)
+    if address is None:
+        return None
+    host, port, offset = address
+
+    early_data_len = 0
+    if flags & FLAG_EARLY_DATA:
+        if len(buf) < offset + EARLY_DATA_LEN.size:
+            return None
+        early_data_len = EARLY_DATA_LEN.unpack_from(buf, offset)[0]
+        if early_data_len > EARLY_DATA_MAX:
+            raise ValueError(f"Données anticipées trop longues : {early_data_len}")
+        offset += EARLY_DATA_LEN.size
+
+    codecs = 0
+    if flags & FLAG_COMPRESSION:
+        if len(buf) < offset + CODECS.size:
+            return None
+        codecs = buf[offset]
+        offset += CODECS.size
+
+    return TunnelRequest(host, port, flags, early_data_len, codecs), offset
+
+
+def recv_request(sock, bufsize: int = 4096) -> tuple[TunnelRequest, bytes]:
+    """
+    Lit la requête d'ouverture sur un socket bloquant, en une ou deux lectures
+    dans le cas courant.
+
+    Returns:
+        tuple[TunnelRequest, bytes]: La requête et les octets reçus au-delà
+        (début des données applicatives), ou (None, b"") si la connexion
+        s'est fermée avant.
+    """
+    buf = b""
+    while True:
+        result = parse_request(buf)
+        if result is not None:
+            request, consumed = result
+            return request, buf[consumed:]
+        chunk = sock.recv(bufsize)
+        if not chunk:
+            return None, b""
+        buf += chunk
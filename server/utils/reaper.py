@@ -0,0 +1,220 @@
+import asyncio
+import socket
+import threading
+import time
+
+from utils.logger import get_logger
+from utils.metrics import registry
+from utils.stats import Stats
+
+logger = get_logger("REAPER")
+
+# Connexions fermées pour inactivité (idle) ou après une demi-fermeture restée sans suite (half_closed)
+reaper_stats = Stats("reaper")
+
+reaper_tracked = registry.gauge("reaper_tracked_connections", "Connexions surveillées par le ramasseur")
+
+# Keepalive TCP appliqué à tous les sockets des deux côtés (configure_keepalive)
+_KEEPALIVE = {"enabled": True, "idle": 60, "interval": 10, "count": 5}
+
+
+def configure_keepalive(enabled: bool = True, idle: int = 60, interval: int = 10, count: int = 5):
+    """Réglages du keepalive TCP du processus (à appeler au démarrage)."""
+    _KEEPALIVE.update(enabled=enabled, idle=idle, interval=interval, count=count)
+
+
+def enable_keepalive(sock):
+    """
+    Active le keepalive TCP : un pair disparu sans FIN ni RST (coupure réseau,
+    machine éteinte) est détecté après idle + interval × count secondes.
+    """
+    if not _KEEPALIVE["enabled"]:
+        return
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, "TCP_KEEPIDLE"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, _KEEPALIVE["idle"])
+        elif hasattr(socket, "TCP_KEEPALIVE"):  # macOS
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPALIVE, _KEEPALIVE["idle"])
+        if hasattr(socket, "TCP_KEEPINTVL"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, _KEEPALIVE["interval"])
+        if hasattr(socket, "TCP_KEEPCNT"):
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, _KEEPALIVE["count"])
+    except OSError:
+        pass
+
+
+class TimingWheel:
+    """
+    Roue temporelle hachée : les échéances sont rangées dans `size` cases de
+    `tick` secondes. Insertion, annulation et avancée d'une case en O(1) par
+    élément, quel que soit le nombre d'échéances en attente.
+
+    Une échéance au-delà d'un tour de roue reste dans sa case jusqu'au tour
+    concerné. Non protégée par un verrou : à l'appelant de sérialiser.
+
+    Attributes:
+        tick (float): Durée (s) d'une case.
+        size (int): Nombre de cases.
+    """
+
+    def __init__(self, tick: float = 1.0, size: int = 512, now: float = None):
+        self.tick = tick
+        self.size = size
+        self._slots = [set() for _ in range(size)]
+        self._current = self._tick_of(time.monotonic() if now is None else now)
+
+    def _tick_of(self, when: float) -> int:
+        return int(when // self.tick)
+
+    def schedule(self, item, deadline: float):
+        """Range `item` (qui doit avoir un attribut `wheel_tick`) pour l'échéance `deadline`."""
+        ticks = max(self._tick_of(deadline) + 1, self._current + 1)
+        item.wheel_tick = ticks
+        self._slots[ticks % self.size].add(item)
+
+    def cancel(self, item):
+        if item.wheel_tick is not None:
+            self._slots[item.wheel_tick % self.size].discard(item)
+            item.wheel_tick = None
+
+    def advance(self, now: float) -> list:
+        """Avance jusqu'à `now` ; retourne les éléments arrivés à échéance (retirés de la roue)."""
+        target = self._tick_of(now)
+        expired = []
+        for step in range(min(target - self._current, self.size)):
+            slot = self._slots[(self._current + 1 + step) % self.size]
+            due = [item for item in slot if item.wheel_tick <= target]
+            for item in due:
+                slot.discard(item)
+                item.wheel_tick = None
+            expired.extend(due)
+        self._current = max(self._current, target)
+        return expired
+
+
+class TrackedConnection:
+    """
+    Connexion suivie par le ramasseur. touch() ne fait qu'horodater :
+    l'échéance n'est recalculée qu'au passage de la roue.
+
+    Attributes:
+        on_expire (callable): Interrompt la connexion (appelé une seule fois).
+        last_activity (float): Dernière activité (time.monotonic()).
+        half_closed (bool): Un sens est terminé : délai de demi-fermeture.
+    """
+
+    __slots__ = ("reaper", "on_expire", "last_activity", "half_closed", "wheel_tick", "released")
+
+    def __init__(self, reaper: "ConnectionReaper", on_expire):
+        self.reaper = reaper
+        self.on_expire = on_expire
+        self.last_activity = time.monotonic()
+        self.half_closed = False
+        self.wheel_tick = None
+        self.released = False
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def half_close(self):
+        self.last_activity = time.monotonic()
+        self.half_closed = True
+        self.reaper._reschedule(self)
+
+    def release(self):
+        """Fin normale de la connexion : elle n'est plus surveillée."""
+        self.reaper._release(self)
+
+
+class ConnectionReaper:
+    """
+    Ferme les connexions inactives depuis `idle_timeout` secondes, ou depuis
+    `half_close_timeout` secondes après qu'un de leurs sens s'est terminé
+    (pair silencieux après un shutdown(SHUT_WR)).
+
+    Toutes les connexions vivantes sont rangées dans une roue temporelle ;
+    l'activité n'est qu'un horodatage, relu à l'échéance : le coût reste
+    constant par connexion, même avec un grand nombre de connexions.
+
+    La roue avance dans un thread dédié (start) ou dans la boucle asyncio
+    (run_async) : les rappels on_expire sont exécutés dans ce contexte.
+
+    Attributes:
+        idle_timeout (float): Inactivité maximale (s, 0 : illimitée).
+        half_close_timeout (float): Inactivité maximale après une demi-fermeture (s, 0 : illimitée).
+        tick (float): Résolution (s) de la roue.
+    """
+
+    def __init__(self, idle_timeout: float = 300, half_close_timeout: float = 60, tick: float = 1.0):
+        self.idle_timeout = idle_timeout
+        self.half_close_timeout = half_close_timeout
+        self.tick = tick
+        self._wheel = TimingWheel(tick)
+        self._lock = threading.Lock()
+
+    def track(self, on_expire) -> TrackedConnection:
+        """Commence la surveillance d'une connexion ; à terminer par release()."""
+        entry = TrackedConnection(self, on_expire)
+        reaper_tracked.inc()
+        self._reschedule(entry)
+        return entry
+
+    def start(self) -> "ConnectionReaper":
+        """Avance la roue dans un thread dédié (moteur à threads)."""
+        threading.Thread(target=self._run, name="reaper", daemon=True).start()
+        return self
+
+    async def run_async(self):
+        """Avance la roue dans la boucle d'événements (moteur asyncio)."""
+        while True:
+            await asyncio.sleep(self.tick)
+            self.advance()
+
+    def advance(self, now: float = None):
+        now = time.monotonic() if now is None else now
+        expired = []
+        with self._lock:
+            for entry in self._wheel.advance(now):
+                timeout = self._timeout(entry)
+                if not timeout:
+                    continue
+                deadline = entry.last_activity + timeout
+                if deadline > now:
+                    self._wheel.schedule(entry, deadline)
+                else:
+                    entry.released = True
+                    expired.append(entry)
+
+        for entry in expired:
+            reaper_tracked.dec()
+            reaper_stats.incr("half_closed" if entry.half_closed else "idle")
+            try:
+                entry.on_expire()
+            except Exception as e:
+                logger.error(f"Fermeture d'une connexion inactive impossible : {e}")
+
+    def _timeout(self, entry: TrackedConnection) -> float:
+        return self.half_close_timeout if entry.half_closed else self.idle_timeout
+
+    def _reschedule(self, entry: TrackedConnection):
+        with self._lock:
+            if entry.released:
+                return
+            self._wheel.cancel(entry)
+            timeout = self._timeout(entry)
+            if timeout:
+                self._wheel.schedule(entry, entry.last_activity + timeout)
+
+    def _release(self, entry: TrackedConnection):
+        with self._lock:
+            if entry.released:
+                return
+            entry.released = True
+            self._wheel.cancel(entry)
+        reaper_tracked.dec()
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            self.advance()
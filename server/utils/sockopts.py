@@ -0,0 +1,219 @@
+import asyncio
+import os
+import socket
+import struct
+import sys
+
+from utils.reaper import enable_keepalive
+from utils.stats import Stats
+
+# Options refusées par le noyau (option_failures), buffers dimensionnés d'après
+# le RTT (auto_buffers), connexions TCP Fast Open (fast_open_connects) et
+# octets partis dans le SYN (fast_open_syn_bytes)
+socket_stats = Stats("sockets")
+
+_LINUX = sys.platform.startswith("linux")
+# Constantes Linux absentes de certaines versions du module socket
+TCP_FASTOPEN = getattr(socket, "TCP_FASTOPEN", 23 if _LINUX else None)
+TCP_FASTOPEN_CONNECT = getattr(socket, "TCP_FASTOPEN_CONNECT", 30 if _LINUX else None)
+MSG_FASTOPEN = getattr(socket, "MSG_FASTOPEN", None)
+TCP_INFO = getattr(socket, "TCP_INFO", None)
+TCP_INFO_RTT = struct.Struct("=I")
+TCP_INFO_RTT_OFFSET = 68  # tcpi_rtt (µs) dans struct tcp_info (Linux)
+
+FAST_OPEN_QUEUE = 256  # connexions TFO en attente d'acceptation sur l'écoute
+MIN_AUTO_BUFFER = 64 * 1024
+MAX_AUTO_BUFFER = 16 * 1024 * 1024
+
+
+class SocketProfile:
+    """
+    Options TCP d'un lien (0 : réglage automatique du noyau).
+
+    Attributes:
+        nodelay (bool): TCP_NODELAY : les petits enregistrements TLS partent sans attendre (Nagle désactivé).
+        sndbuf (int): SO_SNDBUF (octets).
+        rcvbuf (int): SO_RCVBUF (octets).
+        auto_buffers (bool): Dimensionne les deux buffers d'après le RTT mesuré (bandwidth × RTT).
+        bandwidth (int): Débit visé (octets/s) par auto_buffers.
+        keepalive (bool): Keepalive TCP (réglages de timeouts.keepalive).
+    """
+
+    def __init__(self, nodelay: bool = False, sndbuf: int = 0, rcvbuf: int = 0, auto_buffers: bool = False,
+                 bandwidth: int = 12_500_000, keepalive: bool = True):
+        self.nodelay = bool(nodelay)
+        self.sndbuf = int(sndbuf)
+        self.rcvbuf = int(rcvbuf)
+        self.auto_buffers = bool(auto_buffers)
+        self.bandwidth = int(bandwidth)
+        self.keepalive = bool(keepalive)
+        if min(self.sndbuf, self.rcvbuf) < 0 or self.bandwidth <= 0:
+            raise ValueError(f"Options de socket invalides : {vars(self)}")
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, SocketProfile) and vars(self) == vars(other)
+
+
+PROFILES = {
+    # Options du noyau, keepalive seul
+    "default": SocketProfile(),
+    # Petits échanges (web, SSH, API) : latence minimale
+    "interactive": SocketProfile(nodelay=True),
+    # Transferts en masse sur un réseau local ou proche
+    "bulk": SocketProfile(nodelay=True, sndbuf=4 * 1024 * 1024, rcvbuf=4 * 1024 * 1024),
+    # Liens à fort produit débit × délai : buffers à la mesure du RTT (100 Mbit/s visés)
+    "wan": SocketProfile(nodelay=True, auto_buffers=True, bandwidth=12_500_000),
+}
+
+# Profils par lien et TCP Fast Open du processus (configure_sockets)
+_SOCKETS = {"legs": {}, "fast_open": False}
+
+
+def socket_profile(name: str, custom: dict = None) -> SocketProfile:
+    """
+    Profil `name` : un de PROFILES, complété ou remplacé par l'entrée du même
+    nom dans `custom` (section sockets.profiles de la configuration).
+
+    Raises:
+        ValueError: Profil inconnu ou option invalide.
+    """
+    custom = custom or {}
+    if name not in PROFILES and name not in custom:
+        raise ValueError(f"Profil de socket inconnu : {name}")
+    base = vars(PROFILES.get(name, PROFILES["default"]))
+    try:
+        return SocketProfile(**{**base, **(custom.get(name) or {})})
+    except TypeError as e:
+        raise ValueError(f"Profil de socket {name} invalide : {e}") from None
+
+
+def configure_sockets(legs: dict, fast_open: bool = False):
+    """
+    Réglages des sockets du processus (au démarrage et au rechargement).
+
+    Args:
+        legs (dict[str, SocketProfile]): Profil de chaque lien ("local", "tunnel", "target").
+        fast_open (bool): TCP Fast Open sur les connexions sortantes et l'écoute du tunnel.
+    """
+    _SOCKETS.update(legs=dict(legs), fast_open=fast_open)
+
+
+def fast_open_enabled() -> bool:
+    return _SOCKETS["fast_open"]
+
+
+def _setsockopt(sock, level: int, option: int, value: int) -> bool:
+    try:
+        sock.setsockopt(level, option, value)
+        return True
+    except OSError:
+        socket_stats.incr("option_failures")
+        return False
+
+
+def tcp_rtt(sock):
+    """RTT lissé (s) mesuré par le noyau (TCP_INFO, Linux), ou None."""
+    if TCP_INFO is None:
+        return None
+    try:
+        info = sock.getsockopt(socket.IPPROTO_TCP, TCP_INFO, 104)
+    except OSError:
+        return None
+    if len(info) < TCP_INFO_RTT_OFFSET + TCP_INFO_RTT.size:
+        return None
+    rtt = TCP_INFO_RTT.unpack_from(info, TCP_INFO_RTT_OFFSET)[0]
+    return rtt / 1e6 if rtt else None
+
+
+def tune_socket(sock, leg: str):
+    """
+    Applique le profil du lien `leg` à un socket TCP connecté : keepalive,
+    TCP_NODELAY et buffers. Une option refusée par le noyau est ignorée.
+    """
+    profile = _SOCKETS["legs"].get(leg) or PROFILES["default"]
+    if profile.keepalive:
+        enable_keepalive(sock)
+    if profile.nodelay:
+        _setsockopt(sock, socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sndbuf, rcvbuf = profile.sndbuf, profile.rcvbuf
+    if profile.auto_buffers:
+        rtt = tcp_rtt(sock)
+        if rtt is not None:
+            # Produit débit × délai : la fenêtre couvre tout ce qui est en vol
+            sndbuf = rcvbuf = min(max(int(profile.bandwidth * rtt), MIN_AUTO_BUFFER), MAX_AUTO_BUFFER)
+            socket_stats.incr("auto_buffers")
+    if sndbuf:
+        _setsockopt(sock, socket.SOL_SOCKET, socket.SO_SNDBUF, sndbuf)
+    if rcvbuf:
+        _setsockopt(sock, socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+
+
+def enable_fast_open_listener(sock):
+    """TCP Fast Open sur un socket d'écoute, si activé et permis par le noyau."""
+    if _SOCKETS["fast_open"] and TCP_FASTOPEN is not None:
+        _setsockopt(sock, socket.IPPROTO_TCP, TCP_FASTOPEN, FAST_OPEN_QUEUE)
+
+
+def fast_open_connect(sock: socket.socket, data: bytes, address: tuple):
+    """
+    Lance la connexion d'un socket non bloquant avec TCP Fast Open : `data`
+    part dans le SYN si le noyau dispose d'un cookie pour cette destination
+    (sinon le SYN demande un cookie pour la fois suivante).
+
+    Returns:
+        int | None: Octets de `data` partis dans le SYN, ou None si TFO est
+        désactivé ou indisponible (connexion à lancer normalement).
+    """
+    if not _SOCKETS["fast_open"] or MSG_FASTOPEN is None or not data:
+        return None
+    try:
+        sent = sock.sendto(data, MSG_FASTOPEN, address)
+    except BlockingIOError:
+        sent = 0  # SYN parti sans données
+    except OSError:
+        return None
+    socket_stats.incr("fast_open_connects")
+    socket_stats.incr("fast_open_syn_bytes", sent)
+    return sent
+
+
+async def wait_connected(sock: socket.socket):
+    """Attend la fin d'une connexion non bloquante lancée par fast_open_connect."""
+    loop = asyncio.get_running_loop()
+    writable = loop.create_future()
+    loop.add_writer(sock.fileno(), lambda: writable.done() or writable.set_result(None))
+    try:
+        await writable
+    finally:
+        loop.remove_writer(sock.fileno())
+    err = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+    if err:
+        raise OSError(err, os.strerror(err))
+
+
+def connect_tcp(host: str, port: int, timeout: float, leg: str) -> socket.socket:
+    """
+    socket.create_connection suivi de tune_socket. Avec TCP Fast Open,
+    connect() rend la main aussitôt (TCP_FASTOPEN_CONNECT) et le SYN part avec
+    le premier envoi : le ClientHello TLS gagne un aller-retour. Les erreurs
+    de connexion apparaissent alors au handshake.
+    """
+    sock = None
+    if _SOCKETS["fast_open"] and TCP_FASTOPEN_CONNECT is not None:
+        family, kind, proto, _, address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0]
+        sock = socket.socket(family, kind, proto)
+        if _setsockopt(sock, socket.IPPROTO_TCP, TCP_FASTOPEN_CONNECT, 1):
+            try:
+                sock.settimeout(timeout)
+                sock.connect(address)
+                socket_stats.incr("fast_open_connects")
+            except OSError:
+                sock.close()
+                raise
+        else:
+            sock.close()
+            sock = None
+    if sock is None:
+        sock = socket.create_connection((host, port), timeout)
+    tune_socket(sock, leg)
+    return sock
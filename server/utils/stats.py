@@ -0,0 +1,115 @@
+import os
+import threading
+import weakref
+
+# Nombre de fragments au-delà duquel ceux des threads terminés sont fusionnés
+_COMPACT_THRESHOLD = 256
+
+# Toutes les valeurs fragmentées du processus (remises à zéro dans un processus fils)
+_ALL_VALUES = weakref.WeakSet()
+
+
+class ShardedValues:
+    """
+    Valeurs numériques fragmentées par thread : chaque thread écrit dans son
+    propre dictionnaire sans verrou, les fragments sont additionnés à la lecture.
+
+    Un fragment n'a qu'un seul écrivain ; sous le GIL, la copie d'un dictionnaire
+    par le lecteur est atomique. Les fragments des threads terminés sont
+    fusionnés dans un total commun pour ne pas s'accumuler.
+    """
+
+    def __init__(self):
+        self._reset()
+        _ALL_VALUES.add(self)
+
+    def _reset(self):
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def local(self) -> dict:
+        """Fragment du thread courant (créé au premier appel)."""
+        try:
+            return self._local.values
+        except AttributeError:
+            values = self._local.values = {}
+            with self._lock:
+                if len(self._shards) >= _COMPACT_THRESHOLD:
+                    self._compact()
+                self._shards.append((threading.current_thread(), values))
+            return values
+
+    def add(self, key, value: float = 1):
+        values = self.local()
+        values[key] = values.get(key, 0) + value
+
+    def merged(self) -> dict:
+        """Somme de tous les fragments, clé par clé."""
+        with self._lock:
+            self._compact()
+            total = dict(self._retired)
+            for _, values in self._shards:
+                for key, value in dict(values).items():
+                    total[key] = total.get(key, 0) + value
+        return total
+
+    def _compact(self):
+        # Appelé sous self._lock : un thread terminé n'écrira plus dans son fragment
+        alive = []
+        for thread, values in self._shards:
+            if thread.is_alive():
+                alive.append((thread, values))
+                continue
+            for key, value in values.items():
+                self._retired[key] = self._retired.get(key, 0) + value
+        self._shards = alive
+
+
+def _reset_after_fork():
+    # Un processus fils (worker) repart de zéro : le superviseur additionne
+    # les valeurs de chaque processus, celles du parent seraient comptées deux fois.
+    for values in list(_ALL_VALUES):
+        values._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class Stats:
+    """
+    Ensemble de compteurs nommés partagés entre threads.
+
+    Les incréments sont fragmentés par thread (ShardedValues) : ils ne prennent
+    aucun verrou et peuvent être appelés sur les chemins chauds du relais.
+    Chaque groupe créé est exporté par le registre de métriques (utils.metrics).
+
+    Attributes:
+        name (str): Nom du groupe de compteurs (ex: "tls", "handshake").
+    """
+
+    _groups = []
+    _groups_lock = threading.Lock()
+
+    def __init__(self, name: str):
+        self.name = name
+        self._values = ShardedValues()
+        with Stats._groups_lock:
+            Stats._groups.append(self)
+
+    def incr(self, key: str, value: float = 1):
+        self._values.add(key, value)
+
+    def get(self, key: str) -> float:
+        return self.snapshot().get(key, 0)
+
+    def snapshot(self) -> dict:
+        return self._values.merged()
+
+    @classmethod
+    def groups(cls) -> list:
+        """Tous les groupes de compteurs du processus."""
+        with cls._groups_lock:
+            return list(cls._groups)
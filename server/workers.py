@@ -0,0 +1,264 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+from multiprocessing.connection import wait
+
+from aio_tunnel import AsyncTLSServerTunnel
+from tunnel import TLSServerTunnel
+from utils.lifecycle import ConfigWatcher
+from utils.logger import get_logger
+from utils.metrics import merge_snapshot, registry, start_metrics_server
+from utils.stats import Stats
+
+logger = get_logger("SUPERVISOR")
+
+# Démarrages (started), arrêts inattendus (crashes) et remplacements après rechargement (replaced)
+worker_stats = Stats("workers")
+
+REPORT_INTERVAL = 1.0  # période (s) de publication des métriques d'un worker
+RESTART_DELAY = 1.0  # délai (s) avant de relancer un worker arrêté (évite une boucle de plantages)
+STOP_GRACE = 5.0  # marge (s) laissée à un worker au-delà de son délai de drain avant SIGKILL
+
+
+def _worker_main(tunnel: TLSServerTunnel, index: int, conn):
+    """Point d'entrée d'un worker : publie ses métriques puis sert les connexions."""
+    # L'arrêt est piloté par le superviseur (SIGTERM : arrêt progressif du worker)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Profil (SIGUSR2) : ignoré jusqu'à l'installation des gestionnaires du worker
+    signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+
+    def report():
+        while True:
+            try:
+                conn.send(registry.snapshot())
+            except (OSError, ValueError):
+                return
+            time.sleep(REPORT_INTERVAL)
+
+    threading.Thread(target=report, name="metrics-report", daemon=True).start()
+    logger.info(f"Worker {index} démarré (pid {os.getpid()})")
+
+    server = AsyncTLSServerTunnel(tunnel) if tunnel.config.engine == "asyncio" else tunnel
+    server.start(tunnel.config.listen_host, tunnel.config.listen_port, reuse_port=True, supervised=True)
+
+
+class WorkerSupervisor:
+    """
+    Lance plusieurs processus serveur écoutant le même port (SO_REUSEPORT),
+    chacun avec sa propre boucle d'acceptation : le chiffrement TLS n'est plus
+    limité par le GIL d'un seul processus. Le noyau répartit les connexions.
+
+    Le contexte SSL est créé avant le fork : les workers partagent les clés
+    de tickets de session, une session peut être reprise sur n'importe lequel.
+    Les workers arrêtés sont relancés ; leurs métriques sont agrégées et
+    exposées par le superviseur.
+
+    Rechargement (SIGHUP ou modification des fichiers) : le superviseur
+    recharge configuration et certificats, lance de nouveaux workers (qui
+    partagent à nouveau les mêmes clés de tickets) et met les anciens en
+    arrêt progressif ; leurs tunnels continuent jusqu'à drain_timeout.
+    SIGTERM met tous les workers en arrêt progressif. SIGUSR2 (ou
+    /debug/profile) lance un profil dans chaque worker (utils.profiling).
+
+    Attributes:
+        tunnel (TLSServerTunnel): Serveur (configuration, contexte SSL) copié dans chaque worker.
+        workers (int): Nombre de processus.
+    """
+
+    def __init__(self, tunnel: TLSServerTunnel, workers: int):
+        self.tunnel = tunnel
+        self.workers = workers
+        self._mp = multiprocessing.get_context("fork")
+        self._processes = {}
+        # Anciens workers en arrêt progressif après un rechargement : pid -> (process, reader)
+        self._retiring = {}
+        # Workers ayant déjà reçu SIGTERM (un second signal les arrêterait immédiatement)
+        self._terminated = set()
+        self._snapshots = {}
+        # Compteurs cumulés des workers arrêtés (sans les jauges)
+        self._retired = {"metrics": {}, "stats": {}}
+        self._restarts = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._reload_requested = False
+        self._profile_requested = False
+
+    def run(self):
+        """Lance les workers et les surveille (bloquant)."""
+        config = self.tunnel.config
+        self.tunnel.context_cache.get()
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(f"{self.workers} workers en écoute sur {config.listen_host}:{config.listen_port}")
+
+        if config.metrics_enabled:
+            start_metrics_server(
+                config.metrics_host, config.metrics_port, render=self.render,
+                routes={"/debug/profile": self._profile_route},
+            )
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._request_stop())
+        signal.signal(signal.SIGHUP, lambda signum, frame: self._request_reload())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self._request_profile())
+        # Les fichiers sont surveillés ici seulement : un changement remplace les workers
+        ConfigWatcher(self.tunnel.changed, self._request_reload, config.reload_interval).start()
+
+        try:
+            while not self._stopping:
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self.reload()
+                if self._profile_requested:
+                    self._profile_requested = False
+                    self.profile()
+                self._poll()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def render(self) -> str:
+        """Métriques agrégées : superviseur, workers actifs et workers arrêtés."""
+        with self._lock:
+            snapshots = list(self._snapshots.values()) + [self._retired]
+        return registry.render(snapshots)
+
+    def reload(self):
+        """
+        Recharge configuration et certificats, puis remplace chaque worker :
+        le nouveau est lancé avant que l'ancien ne passe en arrêt progressif.
+        """
+        if not self.tunnel.reload():
+            return
+        for index in range(self.workers):
+            current = self._processes.get(index)
+            if current is not None:
+                process, reader = current
+                self._retiring[process.pid] = current
+                with self._lock:
+                    snapshot = self._snapshots.pop(index, None)
+                    if snapshot is not None:
+                        self._snapshots[process.pid] = snapshot
+            self._restarts.pop(index, None)
+            self._spawn(index)
+            if current is not None:
+                self._terminate(process)
+                worker_stats.incr("replaced")
+        logger.info(f"{len(self._processes)} workers remplacés, {len(self._retiring)} en arrêt progressif")
+
+    def profile(self) -> int:
+        """Transmet SIGUSR2 aux workers actifs : chacun écrit son propre profil. Retourne leur nombre."""
+        processes = [process for process, _ in list(self._processes.values()) if process.is_alive()]
+        for process in processes:
+            try:
+                os.kill(process.pid, signal.SIGUSR2)
+            except OSError:
+                pass
+        return len(processes)
+
+    def _profile_route(self, query: dict) -> str:
+        # La durée d'un profil de worker est celle de la configuration (profiling.sample_seconds)
+        count = self.profile()
+        return f"Profil demandé à {count} worker(s) : logs/profile-<pid>-<date>.folded\n"
+
+    def stop(self):
+        """Arrêt progressif de tous les workers ; SIGKILL au-delà de drain_timeout."""
+        self._stopping = True
+        processes = self._all_processes()
+        for process in processes:
+            self._terminate(process)
+        deadline = time.monotonic() + self.tunnel.config.drain_timeout + STOP_GRACE
+        for process in processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+
+    def _all_processes(self) -> list:
+        return [process for process, _ in list(self._processes.values()) + list(self._retiring.values())]
+
+    def _terminate(self, process):
+        """SIGTERM (arrêt progressif), une seule fois par worker."""
+        if process.pid not in self._terminated and process.is_alive():
+            self._terminated.add(process.pid)
+            process.terminate()
+
+    def _request_stop(self):
+        if self._stopping:
+            # Second SIGTERM : arrêt immédiat
+            for process in self._all_processes():
+                process.kill()
+            return
+        # Les workers cessent d'accepter tout de suite, sans attendre la boucle de surveillance
+        self._stopping = True
+        for process in self._all_processes():
+            self._terminate(process)
+
+    def _request_reload(self):
+        # Exécuté par la boucle de surveillance (hors gestionnaire de signal)
+        self._reload_requested = True
+
+    def _request_profile(self):
+        # Idem : les workers sont signalés par la boucle de surveillance
+        self._profile_requested = True
+
+    def _spawn(self, index: int):
+        reader, writer = self._mp.Pipe(duplex=False)
+        process = self._mp.Process(
+            target=_worker_main, args=(self.tunnel, index, writer), name=f"worker-{index}", daemon=True
+        )
+        process.start()
+        writer.close()
+        self._processes[index] = (process, reader)
+        worker_stats.incr("started")
+
+    def _poll(self):
+        now = time.monotonic()
+        for index, due in list(self._restarts.items()):
+            if due <= now:
+                del self._restarts[index]
+                logger.info(f"Redémarrage du worker {index}")
+                self._spawn(index)
+
+        # Clé des métriques : index du worker actif, pid d'un worker en arrêt progressif
+        readers = {reader: index for index, (_, reader) in self._processes.items()}
+        readers.update({reader: pid for pid, (_, reader) in self._retiring.items()})
+        sentinels = {process.sentinel: index for index, (process, _) in self._processes.items()}
+        retiring = {process.sentinel: pid for pid, (process, _) in self._retiring.items()}
+        for ready in wait(list(readers) + list(sentinels) + list(retiring), timeout=RESTART_DELAY):
+            if ready in readers:
+                try:
+                    snapshot = ready.recv()
+                except (EOFError, OSError):
+                    continue
+                with self._lock:
+                    self._snapshots[readers[ready]] = snapshot
+            elif ready in sentinels:
+                self._on_exit(sentinels[ready])
+            elif ready in retiring:
+                pid = retiring[ready]
+                self._reap(pid, *self._retiring.pop(pid))
+
+    def _reap(self, key, process, reader):
+        """Attend la fin du worker et cumule ses derniers compteurs."""
+        process.join()
+        reader.close()
+        self._terminated.discard(process.pid)
+        with self._lock:
+            snapshot = self._snapshots.pop(key, None)
+            if snapshot is not None:
+                merge_snapshot(self._retired, registry.cumulative(snapshot))
+
+    def _on_exit(self, index: int):
+        process, reader = self._processes.pop(index)
+        self._reap(index, process, reader)
+        if self._stopping:
+            return
+        worker_stats.incr("crashes")
+        logger.error(f"Worker {index} arrêté (code {process.exitcode}), relance dans {RESTART_DELAY} s")
+        self._restarts[index] = time.monotonic() + RESTART_DELAY
+
+
+def reuse_port_supported() -> bool:
+    return hasattr(socket, "SO_REUSEPORT") and hasattr(os, "fork")